@@ -1,16 +1,1032 @@
 import pandas as pd
-from scipy.stats import pearsonr, spearmanr, kendalltau
-from scipy import stats
 import numpy as np
+from metrics import span, record_error, logger
+from progress import expect, advance
+from concurrency import process_pool
+from lazy import LazyModule
+from config import (PROCESS_POOL_WORKERS, KENDALL_PARALLEL_MIN_WORK, KENDALL_BATCHED_MAX_ROWS, SERIES_CHUNK_ELEMENTS,
+                    RESAMPLE_BATCH, RESAMPLE_PARALLEL_MIN_WORK, MATRIX_TILE_COLUMNS)
+
+# Upper bound on the rows x columns counted per Kendall chunk
+KENDALL_CHUNK_ELEMENTS = 1 << 22
+# Upper bound on the float64 resampled rows gathered at once
+RESAMPLE_CHUNK_ELEMENTS = 1 << 22
+
+
+# SciPy takes about a second to import, longer than the rest of the app; load it when first used
+stats = LazyModule('scipy.stats')
+special = LazyModule('scipy.special')
+fft = LazyModule('scipy.fft')
+
+
+def _mask_groups(valid: np.ndarray):
+    """Group column indices that share the same missing-value pattern"""
+    groups = {}
+    for idx in range(valid.shape[1]):
+        groups.setdefault(np.packbits(valid[:, idx]).tobytes(), []).append(idx)
+    return [np.asarray(group) for group in groups.values()]
+
+
+def _iter_blocks(left_values: np.ndarray, right_values: np.ndarray = None, right_groups=None):
+    """Yield (left_idx, right_idx, rows, left_block, right_block) over pairwise-complete rows.
+
+    Columns with identical NaN masks are batched together, so a frame without
+    missing values is handled as a single dense block. Without right_values the
+    left columns are paired with themselves and only one triangle of groups is
+    visited.
+    """
+    symmetric = right_values is None
+    left_valid = ~np.isnan(left_values)
+    left_groups = _mask_groups(left_valid)
+    if symmetric:
+        right_values, right_valid = left_values, left_valid
+    else:
+        right_valid = ~np.isnan(right_values)
+        if right_groups is None:
+            right_groups = _mask_groups(right_valid)
+    for a, left_idx in enumerate(left_groups):
+        for right_idx in (left_groups[a:] if symmetric else right_groups):
+            rows = left_valid[:, left_idx[0]] & right_valid[:, right_idx[0]]
+            left = left_values[np.ix_(rows, left_idx)]
+            right = left if right_idx is left_idx else right_values[np.ix_(rows, right_idx)]
+            yield left_idx, right_idx, rows, left, right
+
+
+def _normalize(block: np.ndarray) -> np.ndarray:
+    """Center each column and scale it to unit norm (constant columns become NaN)"""
+    centered = block - block.mean(axis=0)
+    scale = np.abs(centered).max(axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        norm = scale * np.linalg.norm(centered / scale, axis=0)
+        return centered / norm
+
+
+def _dense_ranks(block: np.ndarray) -> np.ndarray:
+    """Per-column dense ranks (0, 1, 2, ... with ties sharing a rank)"""
+    order = np.argsort(block, axis=0, kind='stable')
+    ordered = np.take_along_axis(block, order, axis=0)
+    new_value = np.ones(ordered.shape, dtype=bool)
+    new_value[1:] = ordered[1:] != ordered[:-1]
+    ranks = np.empty(block.shape, dtype=np.int64)
+    np.put_along_axis(ranks, order, np.cumsum(new_value, axis=0) - 1, axis=0)
+    return ranks
+
+
+def _tie_statistics(ranks: np.ndarray):
+    """Per-column tie terms of scipy's kendalltau: (ties, sum t(t-1)(t-2), sum t(t-1)(2t+5))"""
+    n, k = ranks.shape
+    counts = np.bincount((ranks + np.arange(k) * n).ravel(), minlength=n * k)
+    # Only runs of two or more contribute; every term is integer-valued, so the float sums are exact
+    tied = np.flatnonzero(counts > 1)
+    column = tied // n
+    t = counts[tied].astype(np.float64)
+    # bincount of nothing comes back as int64 whatever the weights
+    ties, x0, x1 = (np.bincount(column, term, minlength=k).astype(np.float64)
+                    for term in (t * (t - 1) / 2, t * (t - 1) * (t - 2), t * (t - 1) * (2 * t + 5)))
+    return ties.astype(np.int64), x0, x1
+
+
+def _small_ints(values: np.ndarray, bound: int) -> np.ndarray:
+    """Non-negative ints below bound as uint16 when they fit; NumPy compares those faster and radix-sorts
+    them for a stable argsort"""
+    return values.astype(np.uint16) if bound <= 1 << 16 else values
+
+
+def _count_inversions(seq: np.ndarray) -> np.ndarray:
+    """Count pairs i < j with seq[i] > seq[j] in every row of a non-negative integer array.
+
+    Ties are broken by position, so each row becomes a permutation, and
+    positions and values are both cut into blocks of ``side``. A pair is
+    then counted one of three ways: inside a block of positions, inside a
+    block of values, or from a histogram of (position block, value block)
+    cells with prefix sums. The first two are ``side`` shifted comparisons
+    over the whole array, the last (n / side)^2 cells, so a row costs
+    O(n * side + (n / side)^2) in a few dozen NumPy operations.
+    """
+    rows, n = seq.shape
+    # Balances the shifted comparisons against the histogram; measured best near 0.75 sqrt(n)
+    side = max(2, round(0.75 * np.sqrt(n)))
+    blocks = -(-n // side)
+    size = blocks * side
+    # where[v]: position of the v-th smallest value; padding past the end is already in order
+    where = _small_ints(np.argsort(_small_ints(seq, size), axis=1, kind='stable'), size)
+    where = np.hstack([where, np.broadcast_to(np.arange(n, size, dtype=where.dtype), (rows, size - n))])
+    ordinal = np.empty_like(where)
+    np.put_along_axis(ordinal, where.astype(np.intp), np.arange(size, dtype=where.dtype), axis=1)
+    inversions = np.zeros(rows, dtype=np.int64)
+    by_position = ordinal.reshape(rows, blocks, side)
+    # Within a block of values, inversions are pairs whose positions fall in different blocks the other way round
+    by_value = (where // side).reshape(rows, blocks, side)
+    for shift in range(1, side):
+        inversions += np.count_nonzero(by_position[:, :, :-shift] > by_position[:, :, shift:], axis=(1, 2))
+        inversions += np.count_nonzero(by_value[:, :, :-shift] > by_value[:, :, shift:], axis=(1, 2))
+    cell = (np.arange(rows)[:, None] * blocks + np.arange(size) // side) * blocks + ordinal // side
+    counts = np.bincount(cell.ravel(), minlength=rows * blocks * blocks).reshape(rows, blocks, blocks)
+    # greater[p, v]: values in position block p above value block v; earlier[p, v]: the same over blocks before p
+    greater = side - np.cumsum(counts, axis=2)
+    earlier = np.cumsum(greater, axis=1) - greater
+    inversions += np.einsum('rpv,rpv->r', counts, earlier)
+    return inversions
+
+
+def _kendall_discordance(x_ranks: np.ndarray, y_ranks: np.ndarray):
+    """Discordant and jointly tied pair counts of one ranked column against many"""
+    n = len(x_ranks)
+    y_ranks = np.ascontiguousarray(y_ranks.T)
+    if x_ranks.max() == n - 1:
+        # No ties in x, so one order serves every column and no pair can be tied in both
+        seq = y_ranks[:, np.argsort(x_ranks)]
+        return _count_inversions(seq), np.zeros(len(seq), dtype=np.int64)
+    # Sorted by (x, y), pairs tied in x are in y order and never count as inversions
+    by_y = np.argsort(_small_ints(y_ranks, n), axis=1, kind='stable')
+    order = np.take_along_axis(by_y, np.argsort(_small_ints(x_ranks[by_y], n), axis=1, kind='stable'), axis=1)
+    seq = np.take_along_axis(y_ranks, order, axis=1)
+    x_sorted = x_ranks[order]
+    new_key = np.ones(seq.shape, dtype=bool)
+    new_key[:, 1:] = (seq[:, 1:] != seq[:, :-1]) | (x_sorted[:, 1:] != x_sorted[:, :-1])
+    index = np.arange(n)
+    run_start = np.maximum.accumulate(np.where(new_key, index, 0), axis=1)
+    return _count_inversions(seq), (index - run_start).sum(axis=1)
+
+
+def _kendall_pairs(x: np.ndarray, y: np.ndarray):
+    """(tau, p) of one column against many, one scipy kendalltau call per pair"""
+    results = [stats.kendalltau(x, column) for column in np.ascontiguousarray(y.T)]
+    return np.array([r.statistic for r in results]), np.array([r.pvalue for r in results])
+
+
+def _centered_features(values: np.ndarray):
+    """(mask, x, x^2) per column, x centered on the column mean and zero where missing"""
+    valid = ~np.isnan(values)
+    counts = valid.sum(axis=0)
+    mean = np.where(valid, values, 0).sum(axis=0) / np.maximum(counts, 1)
+    x = np.where(valid, values - mean, 0.0)
+    return valid.astype(np.float64), x, x * x
+
+
+def _block_features(values: np.ndarray, block: int):
+    """_centered_features over consecutive blocks of rows, each centered on its own means.
+
+    Returns features shaped (blocks, block, columns), zero-padded at the end,
+    and the (blocks + 1, columns) centers. Local centers keep window sums of
+    trending series such as prices free of cancellation.
+    """
+    rows, k = values.shape
+    blocks = -(-rows // block)
+    padded = np.full((blocks * block, k), np.nan)
+    padded[:rows] = values
+    padded = padded.reshape(blocks, block, k)
+    valid = ~np.isnan(padded)
+    with np.errstate(invalid='ignore'):
+        centers = np.where(valid, padded, 0).sum(axis=1) / valid.sum(axis=1)
+    # Blocks without values borrow a neighbour's center; one extra row serves the last block's successor
+    centers = pd.DataFrame(np.vstack([centers, centers[-1:]])).ffill().bfill().fillna(0.0).to_numpy()
+    x = np.where(valid, padded - centers[:-1, None, :], 0.0)
+    return (valid.astype(np.float64), x, x * x), centers
+
+
+# Pairwise-complete sums as (left feature, right feature) products of _centered_features:
+# n, sx, sy, sxx, syy, sxy
+_SUM_PRODUCTS = ((0, 0), (1, 0), (0, 1), (2, 0), (0, 2), (1, 1))
+
+
+def _pearson_from_sums(n, sx, sy, sxx, syy, sxy):
+    """(r, degenerate) from pairwise-complete sums; degenerate marks a constant side"""
+    var_x = n * sxx - sx * sx
+    var_y = n * syy - sy * sy
+    # Relative tolerance: a constant column leaves only rounding noise in its variance
+    degenerate = (var_x <= 1e-12 * n * sxx) | (var_y <= 1e-12 * n * syy)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        r = np.clip((n * sxy - sx * sy) / np.sqrt(var_x * var_y), -1.0, 1.0)
+    r[degenerate] = np.nan
+    return r, degenerate
+
+
+def _tie_runs(values: np.ndarray):
+    """Per column: NaN-last sort order, and for every sorted position the first and last position of its run of ties"""
+    order = np.argsort(values, axis=0, kind='stable')
+    ordered = np.take_along_axis(values, order, axis=0)
+    index = np.arange(len(values))[:, None]
+    starts = np.ones(ordered.shape, dtype=bool)
+    starts[1:] = ordered[1:] != ordered[:-1]
+    ends = np.ones(ordered.shape, dtype=bool)
+    ends[:-1] = starts[1:]
+    first = np.maximum.accumulate(np.where(starts, index, 0), axis=0)
+    last = np.minimum.accumulate(np.where(ends, index, len(values) - 1)[::-1], axis=0)[::-1]
+    return order, first, last
+
+
+def _subset_ranks(member: np.ndarray, first: np.ndarray, last: np.ndarray) -> np.ndarray:
+    """Average ranks among the flagged positions of each column, which are in sorted order; 0 elsewhere"""
+    counts = np.cumsum(member, axis=0)
+    before = counts - member
+    ranks = (np.take_along_axis(before, first, axis=0) + 1 + np.take_along_axis(counts, last, axis=0)) * 0.5
+    return np.where(member, ranks, 0.0)
+
+
+def _pairwise_spearman(left_values: np.ndarray, right_values: np.ndarray, right_runs=None):
+    """(rho, n_obs, degenerate) for every left x right pair, each ranked on its own complete rows.
+
+    Columns are sorted once; a pair's ranks are then running counts of the
+    shared rows along each sort order, so no pair is re-sorted however the
+    NaNs are scattered. Ties get average ranks, as in scipy's spearmanr.
+    right_runs is _tie_runs(right_values) when already known.
+    """
+    left_valid, right_valid = ~np.isnan(left_values), ~np.isnan(right_values)
+    left_runs = _tie_runs(left_values)
+    if right_runs is None:
+        right_runs = left_runs if right_values is left_values else _tie_runs(right_values)
+    left_order, left_first, left_last = left_runs
+    right_order, right_first, right_last = right_runs
+    right_valid_sorted = np.take_along_axis(right_valid, right_order, axis=0)
+    shape = (left_values.shape[1], right_values.shape[1])
+    rho, sums = np.empty(shape), np.empty((3,) + shape)
+    n_obs = (left_valid.T.astype(np.float64) @ right_valid).astype(np.int64)
+    x = np.empty(right_values.shape)
+    y = np.empty(right_values.shape)
+    for a in range(shape[0]):
+        order = left_order[:, a]
+        member = right_valid[order] & left_valid[order, a][:, None]
+        x[order] = _subset_ranks(member, left_first[:, a, None], left_last[:, a, None])
+        member = left_valid[right_order, a] & right_valid_sorted
+        np.put_along_axis(y, right_order, _subset_ranks(member, right_first, right_last), axis=0)
+        # Ranks of n rows average (n + 1) / 2; rows outside the pair are 0 in both and stay 0
+        center = (n_obs[a] + 1) * 0.5
+        shared = left_valid[:, a, None] & right_valid
+        xc = np.where(shared, x - center, 0.0)
+        yc = np.where(shared, y - center, 0.0)
+        sums[:, a] = np.einsum('ij,ij->j', xc, yc), np.einsum('ij,ij->j', xc, xc), np.einsum('ij,ij->j', yc, yc)
+    sxy, sxx, syy = sums
+    degenerate = (sxx == 0) | (syy == 0) | (n_obs < 3)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        rho = np.clip(sxy / np.sqrt(sxx * syy), -1.0, 1.0)
+    rho[degenerate] = np.nan
+    return rho, n_obs, degenerate
+
+def _right_chunks(count, length):
+    """Slices of right-hand columns small enough for length x chunk scratch arrays"""
+    size = max(1, SERIES_CHUNK_ELEMENTS // max(length, 1))
+    return [slice(start, start + size) for start in range(0, count, size)]
+
+
+def _resample_index(rng, rows, resamples, block_size, kind):
+    """(resamples, rows) row indices, drawn in blocks of consecutive rows to keep autocorrelation.
+
+    'permutation' shuffles the order of the blocks (a block permutation);
+    'bootstrap' draws block starts with replacement (a moving-block bootstrap).
+    """
+    blocks = -(-rows // block_size)
+    offsets = np.arange(block_size)
+    if kind == 'permutation':
+        order = np.argsort(rng.random((resamples, blocks)), axis=1)
+        index = (order[:, :, None] * block_size + offsets).reshape(resamples, -1)
+        # The short last block leaves positions past the end, the same number in every row
+        return index[index < rows].reshape(resamples, rows)
+    starts = rng.integers(0, rows - block_size + 1, size=(resamples, blocks))
+    return (starts[:, :, None] + offsets).reshape(resamples, -1)[:, :rows]
+
+
+def _block_lengths(values: np.ndarray):
+    """Politis-White automatic block lengths per column, and which columns are walks.
+
+    Autocovariances to lag m_max ~ sqrt(rows) come from one FFT per column;
+    the flat-top kernel spans twice the first lag after which K_N of them
+    in a row are insignificant, and the length is Politis and White's
+    (2004, corrected 2009) optimum for the circular block bootstrap, capped
+    at min(3 sqrt(rows), rows / 3). A column whose autocorrelation never
+    dies out inside m_max is a walk (a trend or unit root, like a price
+    level), which no block length resamples faithfully.
+    """
+    rows, k = values.shape
+    run = max(5, int(np.ceil(np.sqrt(np.log10(rows)))))
+    max_lag = min(int(np.ceil(np.sqrt(rows))) + run, rows - 1)
+    if max_lag < run:
+        # Too short to tell anything apart
+        return np.ones(k, dtype=np.int64), np.zeros(k, dtype=bool)
+    centered = values - values.mean(axis=0)
+    spectrum = fft.rfft(centered, 2 * rows, axis=0)
+    acov = fft.irfft(spectrum * np.conj(spectrum), 2 * rows, axis=0)[:max_lag + 1] / rows
+    with np.errstate(invalid='ignore', divide='ignore'):
+        significant = np.abs(acov[1:] / acov[0]) >= 2 * np.sqrt(np.log10(rows) / rows)
+    # quiet[m]: lags m + 1 .. m + run all insignificant
+    quiet = ~np.lib.stride_tricks.sliding_window_view(significant, run, axis=0).any(axis=2)
+    cut = quiet.any(axis=0)
+    span = np.minimum(np.maximum(2 * np.where(cut, quiet.argmax(axis=0), max_lag), 1), max_lag)
+    lag = np.arange(1, max_lag + 1)[:, None]
+    weight = np.clip(2 * (1 - lag / span), 0, 1) * acov[1:]
+    g = acov[0] + 2 * weight.sum(axis=0)
+    big_g = 2 * (lag * weight).sum(axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        length = np.cbrt(1.5 * big_g ** 2 / g ** 2 * rows)
+    cap = min(3 * np.sqrt(rows), rows / 3)
+    return np.clip(np.nan_to_num(np.ceil(length), nan=1.0), 1, max(cap, 1)).astype(np.int64), ~cut
+
+
+def _resampled_series(values, walks, index):
+    """Columns at the resampled rows; walks instead cumulate the steps that end on those rows (all >= 1)"""
+    if not walks.any():
+        return values[index]
+    steps = np.diff(values[:, walks], axis=0)
+    if walks.all():
+        return np.cumsum(steps[index - 1], axis=1)
+    series = values[index]
+    series[..., walks] = np.cumsum(steps[index - 1], axis=1)
+    return series
+
+
+def _resample_counts(left, right, observed, kind, block_size, resamples, seed, left_walks, right_walks):
+    """Tail counts over one batch of resamples drawn from its own seed.
+
+    left and right are centered unit-norm columns over the same rows. For
+    'permutation' the first count is of resampled |r| at least |observed|;
+    for 'bootstrap' the counts are of resampled r <= 0 and r >= 0. Walks
+    are rebuilt from resampled steps (see _resampled_p_values).
+    """
+    rng = np.random.default_rng(seed)
+    rows = len(left)
+    chunk = max(1, RESAMPLE_CHUNK_ELEMENTS // (rows * (left.shape[1] + right.shape[1])))
+    first = np.zeros(observed.shape, dtype=np.int64)
+    second = np.zeros(observed.shape, dtype=np.int64)
+    # Ties with the observed value count as extreme, within rounding
+    threshold = np.abs(observed) - 1e-12
+    stationary = ~right_walks
+    steps_block = min(block_size, rows - 1)
+    for start in range(0, resamples, chunk):
+        size = min(chunk, resamples - start)
+        if kind == 'permutation':
+            r = np.empty((size,) + observed.shape)
+            if stationary.any():
+                # Permuting rows keeps the columns centered and unit-norm
+                index = _resample_index(rng, rows, size, block_size, kind)
+                r[..., stationary] = left.T @ right[:, stationary][index]
+            if right_walks.any():
+                # Walks take the permuted steps from 0 at the first row. left is centered, so the walks' offset
+                # drops out of the products and only their norms need centering.
+                index = _resample_index(rng, rows - 1, size, steps_block, kind) + 1
+                walks = _resampled_series(right[:, right_walks], right_walks[right_walks], index)
+                norm = np.einsum('ijk,ijk->ik', walks, walks) - walks.sum(axis=1) ** 2 / rows
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    r[..., right_walks] = (left[1:].T @ walks) / np.sqrt(norm)[:, None, :]
+            first += (np.abs(r) >= threshold).sum(axis=0)
+            continue
+        if left_walks.any() or right_walks.any():
+            # One index over the steps, shared by both sides; stationary columns are read where each step ends
+            index = _resample_index(rng, rows - 1, size, steps_block, kind) + 1
+            n = rows - 1
+        else:
+            index = _resample_index(rng, rows, size, block_size, kind)
+            n = rows
+        x, y = _resampled_series(left, left_walks, index), _resampled_series(right, right_walks, index)
+        sx, sy = x.sum(axis=1)[:, :, None], y.sum(axis=1)[:, None, :]
+        sxx, syy = (x * x).sum(axis=1)[:, :, None], (y * y).sum(axis=1)[:, None, :]
+        r, _ = _pearson_from_sums(n, sx, sy, sxx, syy, np.matmul(x.transpose(0, 2, 1), y))
+        first += (r <= 0).sum(axis=0)
+        second += (r >= 0).sum(axis=0)
+    return first, second
+
+
+def _unit_columns(prepared, method):
+    """Centered unit-norm columns from _prepare's output for a vectorized method"""
+    if method == 'spearman':
+        ranks, std = prepared
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return ranks / (std * np.sqrt(len(ranks) - 1))
+    return prepared
+
+
+def _benjamini_hochberg(p_values: np.ndarray) -> np.ndarray:
+    """Benjamini-Hochberg adjusted p-values (q-values) over the non-NaN entries"""
+    q_values = np.full(p_values.shape, np.nan)
+    tested = ~np.isnan(p_values)
+    if tested.any():
+        q_values[tested] = stats.false_discovery_control(p_values[tested], method='bh')
+    return q_values
+
+
+class ColumnStatistics:
+    """A fixed set of columns prepared once and correlated against many left-hand frames.
+
+    Pass it as ``right_columns`` to analyze_correlations. Per-column work
+    (normalization, ranks, tie counts) depends only on which rows a pair
+    shares, so it is memoized by row subset; left frames aligned to the same
+    rows, e.g. tickers on one exchange calendar, reuse it. The whole-column
+    features and sort orders of the scattered-NaN path do not depend on the
+    left frame at all and are computed once.
+    """
+
+    def __init__(self, data: pd.DataFrame, columns):
+        self.columns = list(columns)
+        self.values = data[self.columns].to_numpy(dtype=np.float64, na_value=np.nan)
+        self.groups = _mask_groups(~np.isnan(self.values))
+        self._memo = {}
+
+    def _cached(self, key, compute):
+        value = self._memo.get(key)
+        if value is None:
+            value = self._memo[key] = compute()
+        return value
+
+    def prepared(self, rows, right_idx, method, compute):
+        return self._cached((np.packbits(rows).tobytes(), int(right_idx[0]), method), compute)
+
+    def centered_features(self):
+        """_centered_features of every column"""
+        return self._cached('centered_features', lambda: _centered_features(self.values))
+
+    def tie_runs(self):
+        """_tie_runs of every column"""
+        return self._cached('tie_runs', lambda: _tie_runs(self.values))
+
+
+class PearsonAccumulator:
+    """Running pairwise-complete sums for Pearson correlation, updated batch by batch.
+
+    Adding rows costs O(rows x columns^2); correlations are then read off the
+    sums in O(columns^2) without revisiting earlier rows. Values are shifted
+    by the first batch's column means to keep the sums well conditioned.
+    """
+
+    parts = ('n', 'sx', 'sxx', 'sxy')
+
+    def __init__(self, columns):
+        self.columns = list(columns)
+        k = len(self.columns)
+        self.shift = None
+        # n[i, j]: rows where both i and j are present; sx[i, j]: sum of x_i over those rows;
+        # sxx[i, j]: sum of x_i^2 over them; sxy[i, j]: sum of x_i * x_j
+        self.n, self.sx, self.sxx, self.sxy = (np.zeros((k, k)) for _ in self.parts)
+
+    @span('analysis.running_sums')
+    def add(self, data: pd.DataFrame):
+        values = data[self.columns].to_numpy(dtype=np.float64, na_value=np.nan)
+        valid = ~np.isnan(values)
+        if self.shift is None:
+            counts = valid.sum(axis=0)
+            self.shift = np.where(counts > 0, np.where(valid, values, 0).sum(axis=0) / np.maximum(counts, 1), 0.0)
+        x = np.where(valid, values - self.shift, 0.0)
+        v = valid.astype(np.float64)
+        self.n += v.T @ v
+        self.sx += x.T @ v
+        self.sxx += (x * x).T @ v
+        self.sxy += x.T @ x
+        return self
+
+    def correlation(self, left_columns, right_columns):
+        """(r, n_obs, degenerate) matrices for left x right; degenerate marks a constant side"""
+        position = {col: i for i, col in enumerate(self.columns)}
+        li = [position[col] for col in left_columns]
+        ri = [position[col] for col in right_columns]
+        n = self.n[np.ix_(li, ri)]
+        sx, sxx = self.sx[np.ix_(li, ri)], self.sxx[np.ix_(li, ri)]
+        sy, syy = self.sx[np.ix_(ri, li)].T, self.sxx[np.ix_(ri, li)].T
+        sxy = self.sxy[np.ix_(li, ri)]
+        r, degenerate = _pearson_from_sums(n, sx, sy, sxx, syy, sxy)
+        return r, n.astype(np.int64), degenerate
+
+    def to_frame(self) -> pd.DataFrame:
+        """Flat frame form, so the sums can be kept in a session like any other frame"""
+        k = len(self.columns)
+        frame = pd.DataFrame(np.hstack([getattr(self, part) for part in self.parts]),
+                             columns=[f'{part}_{j}' for part in self.parts for j in range(k)])
+        frame.insert(0, 'column', self.columns)
+        frame['shift'] = self.shift if self.shift is not None else np.nan
+        return frame
+
+    @classmethod
+    def from_frame(cls, frame: pd.DataFrame):
+        accumulator = cls(frame['column'].tolist())
+        k = len(accumulator.columns)
+        for part in cls.parts:
+            # Copies, since frames read back from a session may be memory-mapped read-only
+            setattr(accumulator, part, frame[[f'{part}_{j}' for j in range(k)]].to_numpy(dtype=np.float64, copy=True))
+        shift = frame['shift'].to_numpy(dtype=np.float64, copy=True)
+        accumulator.shift = None if np.isnan(shift).all() else shift
+        return accumulator
+
 
 class CorrelationAnalyzer:
+    # scipy.stats functions, by name so nothing is imported before the first analysis
     methods = {
-        'pearson': pearsonr,
-        'spearman': spearmanr,
-        'kendall': kendalltau
+        'pearson': 'pearsonr',
+        'spearman': 'spearmanr',
+        'kendall': 'kendalltau'
     }
+    vectorized_methods = ('pearson', 'spearman')
+
+    @span('analysis.correlations')
+    def analyze_correlations(self, data: pd.DataFrame, numeric_columns, methods=None, min_correlation=0.1,
+                             right_columns=None, pearson_stats=None, significance='analytic', resamples=1000,
+                             block_size=None, seed=0):
+        """Correlate numeric_columns pairwise, or against right_columns only when given.
+
+        right_columns may be a list of columns of data or a ColumnStatistics
+        built from a frame with the same rows. Results with |correlation|
+        below min_correlation are dropped. When only Pearson is requested and
+        pearson_stats (a PearsonAccumulator over data's rows) is given, the
+        results are read off its running sums without a pass over the rows.
+
+        significance 'permutation' or 'bootstrap' replaces the closed-form
+        Pearson and Spearman p-values with block-resampled ones (see
+        _resampled_p_values), and every method's p-values are then
+        Benjamini-Hochberg adjusted over all pairs tested, before pruning;
+        'significant' means q < 0.05.
+        """
+        if not methods:
+            methods = ['pearson']
+        left_columns = list(numeric_columns)
+        symmetric = right_columns is None
+        resampled = significance != 'analytic'
+        if pearson_stats is not None and set(methods) == {'pearson'} and not resampled:
+            if isinstance(right_columns, ColumnStatistics):
+                right_columns = right_columns.columns
+            right_columns = left_columns if symmetric else list(right_columns)
+            corr, n_obs, degenerate = pearson_stats.correlation(left_columns, right_columns)
+            pairs = len(left_columns) * (len(left_columns) - 1) // 2 if symmetric else corr.size
+            expect(pairs)
+            advance(pairs)
+            corr = {'pearson': corr}
+            p_values = {'pearson': self._p_values('pearson', corr['pearson'], n_obs)}
+            return self._emit(left_columns, right_columns, methods, corr, p_values, n_obs,
+                              degenerate | (n_obs < 3), symmetric, min_correlation)
+
+        left_values = data[left_columns].to_numpy(dtype=np.float64, na_value=np.nan)
+        if isinstance(right_columns, ColumnStatistics):
+            statistics = right_columns
+        elif not symmetric:
+            statistics = ColumnStatistics(data, right_columns)
+        else:
+            statistics = None
+        right_columns = left_columns if symmetric else statistics.columns
+        k = len(left_columns)
+        pairs = k * (k - 1) // 2 if symmetric else k * len(right_columns)
+        expect(pairs * len(set(methods) & set(self.methods)))
+        corr, p_values, n_obs, degenerate = self._correlate(left_values, statistics, methods, significance,
+                                                            resamples, block_size, seed)
+
+        q_values = None
+        if resampled:
+            tested = ~degenerate
+            if symmetric:
+                tested &= np.triu(np.ones(degenerate.shape, dtype=bool), 1)
+            q_values = {}
+            for method in corr:
+                q_values[method] = _benjamini_hochberg(np.where(tested, p_values[method], np.nan))
+                if symmetric:
+                    q_values[method] = np.where(tested, q_values[method], q_values[method].T)
+        return self._emit(left_columns, right_columns, methods, corr, p_values, n_obs, degenerate, symmetric,
+                          min_correlation, q_values, significance)
+
+    def _correlate(self, left_values, statistics, methods, significance='analytic', resamples=1000, block_size=None,
+                   seed=0):
+        """Correlation, p-value, pair count and degenerate-pair matrices of left_values against statistics'
+        columns, or against themselves when statistics is None. Pairs are reported to the current job as
+        they finish; callers expect() them."""
+        symmetric = statistics is None
+        resampled = significance != 'analytic'
+        right_values = None if symmetric else statistics.values
+        shape = (left_values.shape[1], left_values.shape[1] if symmetric else right_values.shape[1])
+
+        # Pairwise-complete counts straight from the NaN mask
+        left_valid = (~np.isnan(left_values)).astype(np.float64)
+        right_valid = left_valid if symmetric else (~np.isnan(right_values)).astype(np.float64)
+        n_obs = (left_valid.T @ right_valid).astype(np.int64)
+
+        degenerate = np.zeros(shape, dtype=bool)
+        corr = {method: np.full(shape, np.nan) for method in methods if method in self.methods}
+        right_groups = None if symmetric else statistics.groups
+        blocked = list(corr)
+        left_groups = _mask_groups(left_valid.astype(bool))
+        blocks = len(left_groups) * (len(left_groups) if symmetric else len(right_groups))
+        if not resampled and blocks > shape[0]:
+            # Scattered NaNs leave mask groups of a column or two, and the blocks below would go pair by pair.
+            # Pearson from masked sums and Spearman from per-pair subset ranks take whole matrices at once.
+            pairs = shape[0] * (shape[0] - 1) // 2 if symmetric else shape[0] * shape[1]
+            other_values = left_values if symmetric else right_values
+            if 'pearson' in corr:
+                left_features = _centered_features(left_values)
+                right_features = left_features if symmetric else statistics.centered_features()
+                corr['pearson'], pair_degenerate = _pearson_from_sums(
+                    *[left_features[i].T @ right_features[j] for i, j in _SUM_PRODUCTS])
+                degenerate |= pair_degenerate
+                advance(pairs)
+            if 'spearman' in corr:
+                corr['spearman'], _, pair_degenerate = _pairwise_spearman(
+                    left_values, other_values, None if symmetric else statistics.tie_runs())
+                degenerate |= pair_degenerate
+                advance(pairs)
+            blocked = [method for method in corr if method not in self.vectorized_methods]
+        # Every p-value the blocks fill in starts as NaN, so pairs no block reaches (too few rows) stay NaN
+        p_values = {method: np.full(shape, np.nan) for method in blocked
+                    if resampled or method not in self.vectorized_methods}
+        for left_idx, right_idx, rows, left, right in (_iter_blocks(left_values, right_values, right_groups)
+                                                       if blocked else ()):
+            block_symmetric = left is right
+            if block_symmetric:
+                block_pairs = len(left_idx) * (len(left_idx) - 1) // 2
+            else:
+                block_pairs = len(left_idx) * len(right_idx)
+            if len(left) < 3:
+                # Covered by the n_obs check below
+                advance(block_pairs * len(blocked))
+                continue
+            cells = np.ix_(left_idx, right_idx)
+
+            def prepare_right(method):
+                if block_symmetric:
+                    return prepared_left[method]
+                if statistics is None:
+                    return self._prepare(right, method)
+                return statistics.prepared(rows, right_idx, method, lambda: self._prepare(right, method))
+
+            prepared_left = {method: self._prepare(left, method) for method in ['constant', *blocked]}
+            block_degenerate = prepared_left['constant'][:, None] | prepare_right('constant')[None, :]
+            blocks = {}
+            for method in blocked:
+                if method in self.vectorized_methods:
+                    prepared_right = prepare_right(method)
+                    blocks[method] = self._block_correlation(prepared_left[method], prepared_right, method, len(left))
+                    if resampled:
+                        block_p = self._resampled_p_values(
+                            _unit_columns(prepared_left[method], method), _unit_columns(prepared_right, method),
+                            blocks[method], significance, resamples, block_size, seed)
+                        p_values[method][cells] = block_p
+                        if symmetric:
+                            p_values[method][np.ix_(right_idx, left_idx)] = block_p.T
+                    advance(block_pairs)
+                else:
+                    blocks[method], block_p = self._block_kendall(
+                        left, right, prepared_left[method], prepare_right(method), block_symmetric)
+                    p_values[method][cells] = block_p
+                    if symmetric:
+                        p_values[method][np.ix_(right_idx, left_idx)] = block_p.T
+            degenerate[cells] |= block_degenerate
+            for method, block in blocks.items():
+                corr[method][cells] = block
+            if symmetric:
+                mirrored = np.ix_(right_idx, left_idx)
+                degenerate[mirrored] |= block_degenerate.T
+                for method, block in blocks.items():
+                    corr[method][mirrored] = block.T
+        degenerate |= n_obs < 3
+
+        for method in corr:
+            if method in self.vectorized_methods and method not in p_values:
+                p_values[method] = self._p_values(method, corr[method], n_obs)
+        return corr, p_values, n_obs, degenerate
+
+    def correlation_tiles(self, data: pd.DataFrame, columns, method='pearson', tile_columns=MATRIX_TILE_COLUMNS):
+        """Yield (row_idx, col_idx, corr, n_obs) over the upper-triangular column tiles of the correlation matrix.
+
+        Pairwise-complete like DataFrame.corr, with NaN for degenerate pairs
+        (constant columns, fewer than 3 shared rows). Only two tiles of
+        columns are converted and prepared at a time, so the working set is
+        rows x 2 x tile_columns however wide the frame; the price is that a
+        tile's per-column work (ranks, normalization) is redone for every
+        tile it is paired with.
+        """
+        columns = list(columns)
+        starts = range(0, len(columns), tile_columns)
+        expect(len(columns) * (len(columns) - 1) // 2)
+        for a in starts:
+            row_idx = np.arange(a, min(a + tile_columns, len(columns)))
+            left_values = data[columns[a:a + tile_columns]].to_numpy(dtype=np.float64, na_value=np.nan)
+            left_features = _centered_features(left_values) if method == 'pearson' else None
+            for b in starts:
+                if b < a:
+                    continue
+                col_idx = np.arange(b, min(b + tile_columns, len(columns)))
+                if method == 'pearson':
+                    # Pairwise-complete sums are six matrix products whatever the NaN pattern, where
+                    # _correlate's mask groups go one pair at a time once every column has its own gaps
+                    right_features = left_features if b == a else _centered_features(
+                        data[columns[b:b + tile_columns]].to_numpy(dtype=np.float64, na_value=np.nan))
+                    sums = [left_features[i].T @ right_features[j] for i, j in _SUM_PRODUCTS]
+                    corr, degenerate = _pearson_from_sums(*sums)
+                    n_obs = np.rint(sums[0]).astype(np.int64)
+                    degenerate |= n_obs < 3
+                    advance(len(row_idx) * (len(row_idx) - 1) // 2 if b == a else corr.size)
+                else:
+                    statistics = None if b == a else ColumnStatistics(data, columns[b:b + tile_columns])
+                    corr, _, n_obs, degenerate = self._correlate(left_values, statistics, [method])
+                    corr = corr[method]
+                corr[degenerate] = np.nan
+                if b == a:
+                    # A column with itself, as DataFrame.corr has it
+                    np.fill_diagonal(corr, np.where(np.diag(degenerate), np.nan, 1.0))
+                yield row_idx, col_idx, corr, n_obs
+
+    @span('analysis.matrix')
+    def correlation_matrix(self, data: pd.DataFrame, columns, method='pearson', tile_columns=MATRIX_TILE_COLUMNS):
+        """Full (corr, n_obs) matrices assembled from correlation_tiles"""
+        k = len(columns)
+        corr = np.full((k, k), np.nan)
+        n_obs = np.zeros((k, k), dtype=np.int64)
+        for row_idx, col_idx, tile_corr, tile_n in self.correlation_tiles(data, columns, method, tile_columns):
+            corr[np.ix_(row_idx, col_idx)] = tile_corr
+            corr[np.ix_(col_idx, row_idx)] = tile_corr.T
+            n_obs[np.ix_(row_idx, col_idx)] = tile_n
+            n_obs[np.ix_(col_idx, row_idx)] = tile_n.T
+        return corr, n_obs
+
+    @span('analysis.matrix')
+    def top_correlations(self, data: pd.DataFrame, columns, k, method='pearson', min_periods=3,
+                         tile_columns=MATRIX_TILE_COLUMNS):
+        """The k strongest off-diagonal pairs as (i, j, corr, n_obs) arrays, strongest first.
+
+        Candidates are merged tile by tile, so memory stays at k plus one
+        tile however many columns there are.
+        """
+        best = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0), np.empty(0, dtype=np.int64))
+        for row_idx, col_idx, tile_corr, tile_n in self.correlation_tiles(data, columns, method, tile_columns):
+            rows, cols = np.nonzero(~np.isnan(tile_corr) & (tile_n >= min_periods)
+                                    & (row_idx[:, None] < col_idx[None, :]))
+            best = tuple(np.concatenate(pair) for pair in zip(
+                best, (row_idx[rows], col_idx[cols], tile_corr[rows, cols], tile_n[rows, cols])))
+            if len(best[2]) > k:
+                keep = np.argpartition(-np.abs(best[2]), k - 1)[:k]
+                best = tuple(values[keep] for values in best)
+        order = np.lexsort((best[1], best[0], -np.abs(best[2])))
+        return tuple(values[order] for values in best)
+
+    @span('analysis.lagged')
+    def lagged_correlations(self, data: pd.DataFrame, left_columns, right_columns, lags, min_correlation=0.1):
+        """Pearson correlation of every left x right pair at each lag, in rows.
+
+        At lag L, left at row t is paired with right at row t - L, so a
+        positive lag means the right-hand series leads and a negative one that
+        it lags. Rows must be in time
+        order. Each pairwise-complete sum is an FFT cross-correlation, which
+        yields every lag at once in O(rows log rows) per pair. Pairs whose
+        strongest lag is below min_correlation are dropped.
+        """
+        left_columns, right_columns = list(left_columns), list(right_columns)
+        lags = np.asarray(lags, dtype=np.int64)
+        rows = len(data)
+        left = _centered_features(data[left_columns].to_numpy(dtype=np.float64, na_value=np.nan))
+        right = _centered_features(data[right_columns].to_numpy(dtype=np.float64, na_value=np.nan))
+        # Long enough that shifted products never wrap around
+        size = fft.next_fast_len(rows + int(np.abs(lags).max(initial=0)), real=True)
+        left = [fft.rfft(feature, size, axis=0) for feature in left]
+        right = [np.conj(fft.rfft(feature, size, axis=0)) for feature in right]
+        positions = lags % size
+
+        sums = np.empty((len(_SUM_PRODUCTS), len(lags), len(left_columns), len(right_columns)))
+        expect(len(left_columns) * len(right_columns))
+        for chunk in _right_chunks(len(right_columns), size):
+            for i in range(len(left_columns)):
+                for s, (p, q) in enumerate(_SUM_PRODUCTS):
+                    product = fft.irfft(left[p][:, i, None] * right[q][:, chunk], size, axis=0)
+                    sums[s, :, i, chunk] = product[positions]
+                advance(len(range(len(right_columns))[chunk]))
+        n = np.rint(sums[0])
+        corr, degenerate = _pearson_from_sums(n, *sums[1:])
+        n_obs = n.astype(np.int64)
+        corr[degenerate | (n_obs < 3)] = np.nan
+
+        strength = np.where(np.isnan(corr), -1.0, np.abs(corr))
+        best = strength.argmax(axis=0)
+        pairs = np.indices(best.shape)
+        best_corr = corr[best, pairs[0], pairs[1]]
+        best_n = n_obs[best, pairs[0], pairs[1]]
+        best_p = self._p_values('pearson', best_corr, best_n)
+
+        correlations = []
+        with np.errstate(invalid='ignore'):
+            keep = np.abs(best_corr) >= min_correlation
+        for i, j in zip(*np.nonzero(keep)):
+            correlations.append({
+                'variable1': left_columns[i],
+                'variable2': right_columns[j],
+                'method': 'pearson',
+                'best_lag': int(lags[best[i, j]]),
+                'correlation': float(best_corr[i, j]),
+                'p_value': float(best_p[i, j]),
+                'n_observations': int(best_n[i, j]),
+                'significant': bool(best_p[i, j] < 0.05),
+                'lag_correlations': corr[:, i, j],
+                'lag_observations': n_obs[:, i, j]
+            })
+        correlations.sort(key=lambda x: abs(x['correlation']), reverse=True)
+        return correlations
+
+    @span('analysis.rolling')
+    def rolling_correlations(self, data: pd.DataFrame, left_columns, right_columns, window, min_periods=None,
+                             step=1, min_correlation=0.1):
+        """Trailing-window Pearson correlation of every left x right pair, like pandas' rolling().corr().
+
+        Returns (positions, correlations): the row of each window's end,
+        every step-th row counted back from the last, and per pair the series
+        of window correlations. Window sums are differences of cumulative
+        sums, so the cost per pair is O(rows) whatever the window length.
+        Pairs whose windows never reach min_correlation are dropped.
+        """
+        left_columns, right_columns = list(left_columns), list(right_columns)
+        min_periods = window if min_periods is None else min_periods
+        rows = len(data)
+        # Windows longer than the data are all prefixes of it, so blocks never need to be longer than the rows;
+        # sizing them by window alone would pad the features out to window rows
+        block = min(window, max(rows, 1))
+        left, left_centers = _block_features(data[left_columns].to_numpy(dtype=np.float64, na_value=np.nan), block)
+        right, right_centers = _block_features(data[right_columns].to_numpy(dtype=np.float64, na_value=np.nan),
+                                               block)
+        ends = np.arange(rows - 1, -1, -step)[::-1]
+        starts = np.maximum(ends + 1 - window, 0)
+        # A window covers the tail of its start block and, when it crosses
+        # into the next block, that block's head
+        first_block = starts // block
+        crosses = ends // block != first_block
+        before = np.where(starts % block != 0, starts - 1, -1)
+        first_end = np.where(crosses, first_block * block + block - 1, ends)
+
+        def window_sums(factor):
+            cumulative = np.cumsum(factor, axis=1).reshape(-1, factor.shape[2])
+            head = cumulative[first_end] - np.where(before[:, None] >= 0, cumulative[before], 0.0)
+            return head, np.where(crosses[:, None], cumulative[ends], 0.0)
+
+        # Against a column without gaps the other side's mask is all ones, so
+        # its sums need no per-pair pass
+        left_complete = left[0].reshape(-1, len(left_columns))[:rows].all(axis=0)
+        right_complete = right[0].reshape(-1, len(right_columns))[:rows].all(axis=0)
+        corr = np.full((len(left_columns), len(right_columns), len(ends)), np.nan)
+        expect(len(left_columns) * len(right_columns))
+        for chunk in _right_chunks(len(right_columns), rows):
+            delta_y = (right_centers[first_block + 1] - right_centers[first_block])[:, chunk]
+            right_only = {}
+            for i in range(len(left_columns)):
+                delta_x = (left_centers[first_block + 1, i] - left_centers[first_block, i])[:, None]
+                head, tail = [], []
+                for p, q in _SUM_PRODUCTS:
+                    if q == 0 and right_complete[chunk].all():
+                        sums = window_sums(left[p][:, :, i, None])
+                    elif p == 0 and left_complete[i]:
+                        if q not in right_only:
+                            right_only[q] = window_sums(right[q][:, :, chunk])
+                        sums = right_only[q]
+                    else:
+                        sums = window_sums(left[p][:, :, i, None] * right[q][:, :, chunk])
+                    head.append(sums[0])
+                    tail.append(sums[1])
+                # Move the next block's sums onto the start block's centers
+                n, sx, sy, sxx, syy, sxy = tail
+                tail = (n,
+                        sx + n * delta_x,
+                        sy + n * delta_y,
+                        sxx + (2 * sx + n * delta_x) * delta_x,
+                        syy + (2 * sy + n * delta_y) * delta_y,
+                        sxy + delta_x * sy + delta_y * sx + n * delta_x * delta_y)
+                n, *moments = [a + b for a, b in zip(head, tail)]
+                n = np.rint(n)
+                r, degenerate = _pearson_from_sums(n, *moments)
+                r[degenerate | (n < max(min_periods, 2))] = np.nan
+                corr[i, chunk] = r.T
+                advance(len(range(len(right_columns))[chunk]))
+
+        correlations = []
+        defined = ~np.isnan(corr)
+        strongest = np.abs(np.where(defined, corr, 0.0)).max(axis=2, initial=0.0)
+        keep = defined.any(axis=2) & (strongest >= min_correlation)
+        for i, j in zip(*np.nonzero(keep)):
+            series = corr[i, j]
+            values = series[~np.isnan(series)]
+            correlations.append({
+                'variable1': left_columns[i],
+                'variable2': right_columns[j],
+                'method': 'pearson',
+                'window': window,
+                'mean_correlation': float(values.mean()),
+                'min_correlation': float(values.min()),
+                'max_correlation': float(values.max()),
+                'latest_correlation': float(series[-1]) if not np.isnan(series[-1]) else None,
+                'windows': len(values),
+                'correlations': series
+            })
+        correlations.sort(key=lambda x: abs(x['mean_correlation']), reverse=True)
+        return ends, correlations
+
+    @span('analysis.resampling')
+    def _resampled_p_values(self, left, right, observed, kind, resamples, block_size=None, seed=0):
+        """Two-sided p-values for every left x right pair from block resampling.
 
-    def analyze_correlations(self, data: pd.DataFrame, numeric_columns, methods=None, min_correlation=0.1):
+        left and right are centered unit-norm columns over the same rows.
+        'permutation' block-permutes the right rows to build the null
+        distribution of r; 'bootstrap' resamples row blocks jointly and
+        reads p off how often r changes sign. Walks (columns whose
+        autocorrelation never dies out, such as price levels) are resampled
+        through their steps and rebuilt by cumulating them: no block short
+        of the whole series keeps a walk's trend, and resampled levels
+        would make independent walks look related far more often than
+        alpha. Blocks default to the longest Politis-White length among
+        the columns resampled, measured on steps for walks. Resamples are
+        drawn in fixed batches, each from its own child of seed, so results
+        depend only on seed; large jobs spread the batches over the process
+        pool.
+        """
+        rows = len(left)
+
+        def measure(values):
+            lengths, walks = _block_lengths(values)
+            if walks.any():
+                lengths[walks] = _block_lengths(np.diff(values[:, walks], axis=0))[0]
+            return lengths, walks
+
+        left_lengths, left_walks = measure(left)
+        right_lengths, right_walks = measure(right)
+        if block_size is None:
+            lengths = right_lengths if kind == 'permutation' else np.concatenate([left_lengths, right_lengths])
+            block_size = lengths.max(initial=1)
+        block_size = int(min(max(block_size, 1), rows))
+        sizes = [min(RESAMPLE_BATCH, resamples - start) for start in range(0, resamples, RESAMPLE_BATCH)]
+        seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+        tasks = [(left, right, observed, kind, block_size, size, child, left_walks, right_walks)
+                 for size, child in zip(sizes, seeds)]
+        work = resamples * rows * observed.size
+        if PROCESS_POOL_WORKERS > 1 and len(tasks) > 1 and work >= RESAMPLE_PARALLEL_MIN_WORK:
+            results = process_pool().map(_resample_counts, *zip(*tasks))
+        else:
+            results = (_resample_counts(*task) for task in tasks)
+        first = np.zeros(observed.shape, dtype=np.int64)
+        second = np.zeros(observed.shape, dtype=np.int64)
+        for batch_first, batch_second in results:
+            first += batch_first
+            second += batch_second
+        if kind == 'permutation':
+            p_values = (first + 1) / (resamples + 1)
+        else:
+            p_values = np.minimum(1.0, 2 * (np.minimum(first, second) + 1) / (resamples + 1))
+        return np.where(np.isnan(observed), np.nan, p_values)
+
+    def _emit(self, left_columns, right_columns, methods, corr, p_values, n_obs, degenerate, symmetric,
+              min_correlation, q_values=None, significance='analytic'):
+        """Result dicts from per-method correlation and p-value matrices, strongest first"""
+        shape = n_obs.shape
+        # Emit in the same order as the per-pair loop so ties sort identically
+        if symmetric:
+            rows, cols = np.triu_indices(shape[0], 1)
+        else:
+            rows, cols = np.indices(shape).reshape(2, -1)
+        keep = ~degenerate[rows, cols]
+        rows, cols = rows[keep], cols[keep]
+        # Prune weak pairs before any per-result Python work
+        strong = np.zeros(len(rows), dtype=bool)
+        pair_corr = {}
+        for method in corr:
+            pair_corr[method] = corr[method][rows, cols]
+            with np.errstate(invalid='ignore'):
+                pair_corr[method] = np.where(np.abs(pair_corr[method]) >= min_correlation, pair_corr[method], np.nan)
+            strong |= ~np.isnan(pair_corr[method])
+        rows, cols = rows[strong], cols[strong]
+
+        n_list = n_obs[rows, cols].tolist()
+        method_lists = []
+        for method in methods:
+            if method not in corr:
+                logger.warning(f"Correlation calculation error: unknown method {method}")
+                continue
+            r = pair_corr[method][strong]
+            lower, upper = self._confidence_intervals(r, n_obs[rows, cols])
+            method_lists.append((
+                method,
+                r.tolist(),
+                p_values[method][rows, cols].tolist(),
+                q_values[method][rows, cols].tolist() if q_values is not None else None,
+                lower.tolist(),
+                upper.tolist()
+            ))
+
+        correlations = []
+        for pos, (i, j) in enumerate(zip(rows.tolist(), cols.tolist())):
+            for method, r_list, p_list, q_list, lo_list, hi_list in method_lists:
+                corr_value = r_list[pos]
+                if corr_value != corr_value:
+                    continue
+                p_val = p_list[pos]
+                lo = lo_list[pos]
+                result = {
+                    'variable1': left_columns[i],
+                    'variable2': right_columns[j],
+                    'correlation': corr_value,
+                    'p_value': p_val,
+                    'method': method,
+                    'n_observations': n_list[pos],
+                    'significant': bool(p_val < 0.05),
+                    'confidence_interval': None if lo != lo else {
+                        'lower': lo,
+                        'upper': hi_list[pos],
+                        'confidence_level': 0.95
+                    }
+                }
+                if q_list is not None:
+                    # Significance after false discovery rate control across every pair tested
+                    result['q_value'] = q_list[pos]
+                    result['significant'] = bool(q_list[pos] < 0.05)
+                    result['significance_test'] = significance if method in self.vectorized_methods else 'analytic'
+                correlations.append(result)
+        correlations.sort(key=lambda x: abs(x['correlation']), reverse=True)
+        return correlations
+
+    @span('analysis.pairwise')
+    def analyze_correlations_pairwise(self, data: pd.DataFrame, numeric_columns, methods=None, min_correlation=0.1):
+        """Reference implementation: one scipy call per column pair (used for verification and benchmarks)"""
         if not methods:
             methods = ['pearson']
         correlations = []
@@ -22,12 +1038,12 @@ class CorrelationAnalyzer:
                         continue
                     for method in methods:
                         try:
-                            corr_func = self.methods[method]
+                            corr_func = getattr(stats, self.methods[method])
                             corr, p_val = corr_func(clean_data[var1], clean_data[var2])
-                            
+
                             # Calculate confidence interval
                             confidence_interval = self._calculate_confidence_interval(corr, len(clean_data))
-                            
+
                             correlations.append({
                                 'variable1': var1,
                                 'variable2': var2,
@@ -38,39 +1054,172 @@ class CorrelationAnalyzer:
                                 'significant': bool(p_val < 0.05),
                                 'confidence_interval': confidence_interval
                             })
-                        except Exception as e:
-                            print(f"Correlation calculation error for {var1} vs {var2}: {str(e)}")
+                        except Exception:
+                            record_error('analysis.pairwise', f"Correlation calculation error for {var1} vs {var2}")
         correlations.sort(key=lambda x: abs(x['correlation']), reverse=True)
         return correlations
-    
+
+    def _prepare(self, block, method):
+        """Per-column work for one side of a block, independent of the other side"""
+        if method == 'constant':
+            return np.ptp(block, axis=0) == 0
+        if method == 'pearson':
+            return _normalize(block)
+        if method == 'spearman':
+            ranks = stats.rankdata(block, axis=0)
+            ranks = ranks - ranks.mean(axis=0)
+            std = np.sqrt(np.einsum('ij,ij->j', ranks, ranks) * (1 / (len(block) - 1)))
+            return ranks, std
+        if len(block) > KENDALL_BATCHED_MAX_ROWS:
+            # Counted pair by pair by scipy, which ranks the columns itself
+            return block, None
+        ranks = _dense_ranks(block)
+        return ranks, _tie_statistics(ranks)
+
+    def _block_correlation(self, left, right, method, n):
+        """Correlate every prepared left column with every prepared right column"""
+        if method == 'spearman':
+            # Same arithmetic as np.corrcoef on the ranks, as scipy's spearmanr does
+            (left_ranks, left_std), (right_ranks, right_std) = left, right
+            cov = (left_ranks.T @ right_ranks) * (1 / (n - 1))
+            with np.errstate(invalid='ignore', divide='ignore'):
+                cov /= left_std[:, None]
+                cov /= right_std[None, :]
+            return np.clip(cov, -1.0, 1.0)
+        return np.clip(left.T @ right, -1.0, 1.0)
+
+    def _block_kendall(self, left, right, left_prepared, right_prepared, symmetric=False):
+        """Kendall's tau-b for every left x right pair from ranks computed once per column.
+
+        Columns longer than KENDALL_BATCHED_MAX_ROWS arrive unranked from
+        _prepare and go through scipy one pair at a time, as do single
+        pairs.
+        """
+        if not symmetric and right.shape[1] < left.shape[1]:
+            # Tau is symmetric in its arguments; chunk over the narrower side so every count covers more columns
+            tau, p_values = self._block_kendall(right, left, right_prepared, left_prepared)
+            return tau.T, p_values.T
+        n = len(left)
+        left_ranks, left_ties = left_prepared
+        right_ranks, right_ties = right_prepared
+
+        # Split the pairs into (left column, right columns) chunks of bounded size
+        chunk = max(1, KENDALL_CHUNK_ELEMENTS // n)
+        tasks = []
+        for a in range(left.shape[1]):
+            start = a + 1 if symmetric else 0
+            for lo in range(start, right.shape[1], chunk):
+                tasks.append((a, np.arange(lo, min(lo + chunk, right.shape[1]))))
+
+        # The batched count costs O(n^1.5) per pair against scipy's O(n log n), and a fixed O(sqrt(n)) NumPy
+        # calls per chunk, so long columns and single pairs (scattered NaNs) go pair by pair
+        per_pair = n > KENDALL_BATCHED_MAX_ROWS or right.shape[1] == 1
+        worker = _kendall_pairs if per_pair else _kendall_discordance
+        pairs = sum(len(cols) for _, cols in tasks)
+        if PROCESS_POOL_WORKERS > 1 and len(tasks) > 1 and n * pairs >= KENDALL_PARALLEL_MIN_WORK:
+            pool = process_pool()
+            results = pool.map(worker,
+                               [left_ranks[:, a] for a, _ in tasks],
+                               [right_ranks[:, cols] for _, cols in tasks])
+        else:
+            results = (worker(left_ranks[:, a], right_ranks[:, cols]) for a, cols in tasks)
+
+        shape = (left.shape[1], right.shape[1])
+        dtype = np.float64 if per_pair else np.int64
+        # Per pair: tau and p; batched: discordant and jointly tied pair counts
+        first = np.zeros(shape, dtype=dtype)
+        second = np.zeros(shape, dtype=dtype)
+        computed = np.zeros(shape, dtype=bool)
+        for (a, cols), (first_cols, second_cols) in zip(tasks, results):
+            first[a, cols], second[a, cols], computed[a, cols] = first_cols, second_cols, True
+            advance(len(cols))
+
+        if per_pair:
+            tau, p_values = first, second
+        else:
+            tau, p_values = self._kendall_from_counts(left, right, left_ties, right_ties, first, second, computed)
+        tau[~computed] = np.nan
+        p_values[~computed] = np.nan
+
+        if symmetric:
+            tau = np.where(computed, tau, tau.T)
+            p_values = np.where(computed, p_values, p_values.T)
+        return tau, p_values
+
+    def _kendall_from_counts(self, left, right, left_ties, right_ties, discordant, joint_ties, computed):
+        """Tau-b and p-values from discordant and jointly tied pair counts, as scipy's kendalltau has them"""
+        n = len(left)
+        xtie, x0, x1 = (t[:, None] for t in left_ties)
+        ytie, y0, y1 = (t[None, :] for t in right_ties)
+        tot = (n * (n - 1)) // 2
+        con_minus_dis = tot - xtie - ytie + joint_ties - 2 * discordant
+        m = n * (n - 1.)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            tau = np.clip(con_minus_dis / np.sqrt(tot - xtie) / np.sqrt(tot - ytie), -1., 1.)
+            var = ((m * (2*n + 5) - x1 - y1) / 18 +
+                   (2 * xtie * ytie) / m + x0 * y0 / (9 * m * (n - 2)))
+            p_values = 2 * special.ndtr(-np.abs(con_minus_dis / np.sqrt(var)))
+
+        # scipy switches to the exact null distribution for small, tie-free samples
+        exact = (computed & (xtie == 0) & (ytie == 0) &
+                 ((n <= 33) | (np.minimum(discordant, tot - discordant) <= 1)))
+        for a, b in zip(*np.nonzero(exact)):
+            tau[a, b], p_values[a, b] = stats.kendalltau(left[:, a], right[:, b])
+        return tau, p_values
+
+    def _p_values(self, method, corr, n_obs):
+        """Two-sided p-values in closed form, matching scipy's per-pair tests"""
+        n = n_obs.astype(np.float64)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            if method == 'pearson':
+                ab = n / 2 - 1
+                return 2 * special.betaincc(ab, ab, (np.abs(corr) + 1) / 2)
+            dof = n - 2
+            t = corr * np.sqrt((dof / ((corr + 1.0) * (1.0 - corr))).clip(0))
+            return 2 * special.stdtr(dof, -np.abs(t))
+
+    def _confidence_intervals(self, corr, n_obs, confidence_level=0.95):
+        """Vectorized form of _calculate_confidence_interval; NaN where it would return None"""
+        alpha = 1 - confidence_level
+        z_critical = stats.norm.ppf(1 - alpha/2)
+        defined = (np.abs(corr) < 1.0) & (n_obs >= 4)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            z = 0.5 * np.log((1 + corr) / (1 - corr))
+            se = 1 / np.sqrt(n_obs - 3)
+            z_lower = z - z_critical * se
+            z_upper = z + z_critical * se
+            r_lower = (np.exp(2 * z_lower) - 1) / (np.exp(2 * z_lower) + 1)
+            r_upper = (np.exp(2 * z_upper) - 1) / (np.exp(2 * z_upper) + 1)
+        return np.where(defined, r_lower, np.nan), np.where(defined, r_upper, np.nan)
+
     def _calculate_confidence_interval(self, correlation, n, confidence_level=0.95):
         """Calculate confidence interval for correlation coefficient using Fisher's z-transform"""
         try:
             if abs(correlation) >= 1.0 or n < 4:
                 return None
-            
+
             # Fisher's z-transform
             z = 0.5 * np.log((1 + correlation) / (1 - correlation))
-            
+
             # Standard error
             se = 1 / np.sqrt(n - 3)
-            
+
             # Critical value for given confidence level
             alpha = 1 - confidence_level
             z_critical = stats.norm.ppf(1 - alpha/2)
-            
+
             # Confidence interval in z-space
             z_lower = z - z_critical * se
             z_upper = z + z_critical * se
-            
+
             # Transform back to correlation space
             r_lower = (np.exp(2 * z_lower) - 1) / (np.exp(2 * z_lower) + 1)
             r_upper = (np.exp(2 * z_upper) - 1) / (np.exp(2 * z_upper) + 1)
-            
+
             return {
                 'lower': float(r_lower),
                 'upper': float(r_upper),
                 'confidence_level': confidence_level
             }
         except Exception as e:
-            return None
\ No newline at end of file
+            return None
@@ -1,39 +1,84 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException, Query
+from fastapi import FastAPI, File, UploadFile, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from models import  StockAnalysisRequest, VisualizationRequest
-from session import SessionManager
+from fastapi.responses import StreamingResponse, Response, JSONResponse
+from models import  (StockAnalysisRequest, BatchStockAnalysisRequest, VisualizationRequest, CorrelationMatrixRequest,
+                     CrossDatasetRequest)
+from session import SessionManager, content_hash
 from csv_utils import CSVValidator
-from analysis import CorrelationAnalyzer
+from analysis import CorrelationAnalyzer, ColumnStatistics, PearsonAccumulator
 from stock import StockAnalyzer
 from visualization import VisualizationEngine
-from datetime import datetime
+from result_cache import ResultCache
+from responses import negotiated_response, dumps
+from concurrency import run_analysis, run_fetch
+from warmup import warm_up
+from jobs import JobManager
+from joins import shared_dates, join_on_dates
+from metrics import MetricsMiddleware, Gauge, span, record_error, on_collect
+import metrics
+from config import SESSION_CLEANUP_INTERVAL_SECONDS, STOCK_DATA_CACHE_MINUTES, WARM_UP, MATRIX_MAX_CELLS
+import concurrency
+from contextlib import asynccontextmanager
+from functools import partial
+from datetime import datetime, timedelta
 import pandas as pd
-import math
-from dotenv import load_dotenv
+import asyncio
+import secrets
+import json
 import os
 
-load_dotenv()
+STOCK_VARIABLES = ['Date', 'Open', 'High', 'Low', 'Close', 'Adj Close', 'Volume', 'Dividends', 'Stock Splits']
 
-def make_json_safe(data):
-    if isinstance(data, dict):
-        return {k: make_json_safe(v) for k, v in data.items()}
-    elif isinstance(data, list):
-        return [make_json_safe(i) for i in data]
-    elif isinstance(data, float) and not math.isfinite(data):
-        return None
-    else:
-        return data
+def format_stock_correlations(correlations):
+    """Stock-on-the-left analyzer results in the response shape of /stock-analysis"""
+    return [{
+        'stock_variable': corr['variable1'],
+        'custom_variable': corr['variable2'],
+        **{key: value for key, value in corr.items() if key not in ('variable1', 'variable2')}
+    } for corr in correlations]
 
 session_manager = SessionManager()
 validator = CSVValidator()
 correlation_analyzer = CorrelationAnalyzer()
 stock_analyzer = StockAnalyzer()
 viz_engine = VisualizationEngine()
+result_cache = ResultCache()
+job_manager = JobManager(session_manager)
+append_locks = {}
+session_manager.on_change(result_cache.invalidate)
+
+def drop_append_lock(session_id, keys):
+    # Deleted or expired: the lock would otherwise outlive its session
+    if keys is None:
+        append_locks.pop(session_id, None)
+
+session_manager.on_change(drop_append_lock)
+
+async def expire_sessions():
+    # cleanup_sessions used to exist without ever being called
+    while True:
+        await asyncio.sleep(SESSION_CLEANUP_INTERVAL_SECONDS)
+        try:
+            await run_fetch(session_manager.cleanup_sessions)
+        except Exception:
+            record_error('session.cleanup', "Session cleanup error")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    concurrency.configure()
+    if WARM_UP:
+        # Lifespan startup finishes before the server accepts connections, so no request pays for it
+        await run_analysis(warm_up)
+    expiry = asyncio.create_task(expire_sessions())
+    yield
+    expiry.cancel()
+    concurrency.shutdown()
 
 app = FastAPI(
     title="CSV & Stock Analysis Platform",
     description="Analyze CSV data and discover correlations with stock market data.",
-    version="1.1.0"
+    version="1.1.0",
+    lifespan=lifespan
 )
 
 app.add_middleware(
@@ -42,7 +87,34 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Profile-Path", "Location"],
 )
+app.add_middleware(MetricsMiddleware)
+
+CACHE_HITS = Gauge('cache_hits_total', 'Cache lookups answered from the cache', ('cache',), kind='counter')
+CACHE_MISSES = Gauge('cache_misses_total', 'Cache lookups that had to compute or fetch', ('cache',), kind='counter')
+CACHE_BYTES = Gauge('cache_bytes', 'Bytes of frames held by a cache', ('cache',))
+SESSIONS = Gauge('sessions', 'Sessions in this worker, by whether their frames are in memory', ('state',))
+SESSION_MEMORY = Gauge('session_memory_bytes', 'Bytes of session frames resident in memory')
+SESSION_BUDGET = Gauge('session_memory_budget_bytes', 'Memory budget for resident session frames')
+
+def collect_metrics():
+    for name, cache in (('result', result_cache), ('alignment', stock_analyzer.alignments)):
+        stats = cache.stats()
+        CACHE_HITS.set(stats['hits'], cache=name)
+        CACHE_MISSES.set(stats['misses'], cache=name)
+        CACHE_BYTES.set(stats['bytes'], cache=name)
+    CACHE_HITS.set(stock_analyzer.cache.hits, cache='stock')
+    CACHE_MISSES.set(stock_analyzer.cache.misses, cache='stock')
+    memory = session_manager.memory_usage()
+    resident = sum(s['resident'] for s in memory['sessions'])
+    SESSIONS.set(resident, state='resident')
+    SESSIONS.set(len(memory['sessions']) - resident, state='spilled')
+    SESSION_MEMORY.set(memory['resident_bytes'])
+    if memory['budget_bytes'] is not None:
+        SESSION_BUDGET.set(memory['budget_bytes'])
+
+on_collect(collect_metrics)
 
 @app.get("/")
 async def root():
@@ -55,12 +127,13 @@ async def root():
 async def upload_csv(file: UploadFile = File(...)):
     if not file.filename.lower().endswith('.csv'):
         raise HTTPException(status_code=400, detail="File must be a CSV")
-    content = await file.read()
-    validation_result = validator.validate_csv(content)
+    # Parse straight from the spooled upload instead of reading it into memory first
+    validation_result = await run_analysis(validator.validate_csv, file.file)
     if not validation_result['is_valid']:
         raise HTTPException(status_code=400, detail=validation_result['error'])
-    session_id = f"session_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
-    session_manager.create_session(session_id, validation_result)
+    # The timestamp keeps ids readable; the random part makes same-second uploads distinct
+    session_id = f"session_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{secrets.token_hex(8)}"
+    await run_fetch(session_manager.create_session, session_id, validation_result)
     return {
         'session_id': session_id,
         'validation_result': {
@@ -72,121 +145,558 @@ async def upload_csv(file: UploadFile = File(...)):
     }
 
 
-@app.post("/stock-analysis/{session_id}")
-async def stock_analysis(session_id: str, request: StockAnalysisRequest):
-    session_data = session_manager.get_session(session_id)
+@span('append.select')
+def select_new_rows(session_data, validation_result):
+    """Rows of an append upload dated after the session's last row, in the session's columns"""
+    date_column = session_data['date_column']
+    incoming = validation_result['data']
+    if validation_result['date_column'] != date_column:
+        raise ValueError(f"Date column '{validation_result['date_column']}' does not match '{date_column}'")
+    missing = [col for col in session_data['numeric_columns'] if col not in incoming.columns]
+    if missing:
+        raise ValueError(f"Missing columns: {', '.join(missing)}")
+    new = (incoming[date_column] > session_data['data'][date_column].max()).to_numpy()
+    rows = incoming.loc[new, [date_column] + session_data['numeric_columns']].reset_index(drop=True)
+    return rows, validation_result['dates'][new].reset_index(drop=True), int((~new).sum())
+
+
+@span('append.extend')
+def extend_session(session_data, rows, dates, stock_data):
+    """Session update for appended rows: frames grow by the new rows, running sums absorb only them"""
+    data = session_data['data']
+    if 'data_stats' in session_data:
+        stats = PearsonAccumulator.from_frame(session_data['data_stats'])
+    else:
+        # First append pays for the existing rows once
+        stats = PearsonAccumulator(session_data['numeric_columns']).add(data)
+    data = pd.concat([data, rows], ignore_index=True)
+    quality = session_data['data_quality']
+    update = {
+        'data': data,
+        'dates': pd.concat([session_data['dates'], dates], ignore_index=True),
+        'data_stats': stats.add(rows).to_frame(),
+        'total_rows': len(data),
+        'data_quality': {**quality, 'date_range': {
+            **quality['date_range'], 'end': data[session_data['date_column']].max().strftime('%Y-%m-%d')}}
+    }
+    merged_rows = 0
+    if stock_data is not None:
+        merged = stock_analyzer.align_and_merge(stock_data, rows, session_data['date_column'], dates)
+        if not merged.empty:
+            merged_stats = PearsonAccumulator.from_frame(session_data['merged_stats']).add(merged)
+            update['merged_data'] = pd.concat([session_data['merged_data'], merged], ignore_index=True)
+            update['merged_stats'] = merged_stats.to_frame()
+            merged_rows = len(merged)
+    return update, merged_rows
+
+
+@app.post("/upload/{session_id}/append")
+async def append_csv(session_id: str, file: UploadFile = File(...)):
+    """Append newer rows to a session, extending its merged stock data and running statistics in place"""
+    if not file.filename.lower().endswith('.csv'):
+        raise HTTPException(status_code=400, detail="File must be a CSV")
+    # Only sessions that exist get a lock, so unknown ids cannot grow append_locks
+    if not await run_fetch(session_manager.get_session, session_id):
+        raise HTTPException(status_code=404, detail="Session not found")
+    # Appends to one session are read-modify-write, so they take turns
+    async with append_locks.setdefault(session_id, asyncio.Lock()):
+        session_data = await run_fetch(session_manager.get_session, session_id)
+        if not session_data:
+            raise HTTPException(status_code=404, detail="Session not found")
+        validation_result = await run_analysis(validator.validate_csv, file.file, 1)
+        if not validation_result['is_valid']:
+            raise HTTPException(status_code=400, detail=validation_result['error'])
+        try:
+            rows, dates, skipped = await run_analysis(select_new_rows, session_data, validation_result)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+        # Only the new rows are merged, with prices for their dates inside the last analysis' range.
+        # As-of and period merges can change rows already merged, so those are rebuilt by the next analysis.
+        stock_data = None
+        merged_request = session_data.get('merged_request')
+        extendable = (bool(merged_request) and merged_request.get('alignment', 'exact') == 'exact'
+                      and merged_request.get('frequency') is None)
+        if extendable and len(rows):
+            start = max(pd.Timestamp(merged_request['start_date']), dates.min())
+            end = min(pd.Timestamp(merged_request['end_date']), dates.max() + pd.Timedelta(days=1))
+            if start < end:
+                stock_data = await run_fetch(stock_analyzer.fetch_stock_data, merged_request['symbol'],
+                                             start.date(), end.date())
+
+        merged_rows = 0
+        if len(rows):
+            update, merged_rows = await run_analysis(extend_session, session_data, rows, dates, stock_data)
+            if merged_request and not extendable:
+                update['merged_request'] = None
+            written = await run_fetch(session_manager.update_session, session_id, update,
+                                      {'merged_data': session_data['content_hashes'].get('merged_data')})
+            if not written and await run_fetch(session_manager.get_session, session_id):
+                # A /stock-analysis replaced the merged data meanwhile: append to the custom data only
+                # and leave the merged frame for the next analysis to rebuild
+                update = {key: value for key, value in update.items() if not key.startswith('merged_')}
+                update['merged_request'] = None
+                merged_rows = 0
+                await run_fetch(session_manager.update_session, session_id, update)
+    return {
+        'session_id': session_id,
+        'appended_rows': len(rows),
+        'skipped_rows': skipped,
+        'merged_rows_appended': merged_rows,
+        'total_rows': len(session_data['data']) + len(rows)
+    }
+
+
+async def stock_analysis_content(session_id: str, request: StockAnalysisRequest):
+    """Response content of /stock-analysis, computed or from the result cache"""
+    session_data = await run_fetch(session_manager.get_session, session_id)
     if not session_data:
         raise HTTPException(status_code=404, detail="Session not found")
+    if request.mode == 'lagged' and request.min_lag > request.max_lag:
+        raise HTTPException(status_code=400, detail="min_lag must not exceed max_lag")
     
+    # The frontend re-sends identical requests when variables are toggled
+    cache_key = ('stock-analysis', session_data['content_hashes']['data'], request.stock_symbol.strip().upper(),
+                 request.start_date, request.end_date, tuple(request.methods), request.min_correlation,
+                 request.alignment, request.tolerance_days, request.frequency, request.aggregation,
+                 request.mode, request.min_lag, request.max_lag, request.window, request.step,
+                 request.significance, request.resamples, request.block_size, request.seed)
+    cached = result_cache.get(cache_key)
+    if cached is not None:
+        content, merged_update, merged_hash = cached
+        if session_data['content_hashes'].get('merged_data') != merged_hash:
+            await run_fetch(session_manager.update_session, session_id, merged_update,
+                            {'data': session_data['content_hashes']['data']})
+        return content
+
     custom_data = session_data['data']
     date_column = session_data['date_column']
-    
-    # Fetch stock data
-    stock_data = stock_analyzer.fetch_stock_data(
-        request.stock_symbol,
-        request.start_date,
-        request.end_date
-    )
-    if stock_data is None:
-        raise HTTPException(status_code=400, detail=f"Could not fetch stock data for {request.stock_symbol}")
-    
-    # Merge datasets
-    merged = stock_analyzer.align_and_merge(stock_data, custom_data, date_column)
-    if merged.empty:
-        raise HTTPException(status_code=400, detail="No overlapping dates found between datasets")
+
+    merged_request = {'symbol': request.stock_symbol.strip().upper(),
+                      'start_date': request.start_date.isoformat(), 'end_date': request.end_date.isoformat(),
+                      'alignment': request.alignment, 'tolerance_days': request.tolerance_days,
+                      'frequency': request.frequency, 'aggregation': request.aggregation}
+    previous = session_data.get('merged_request') or {}
+    if ({key: previous.get(key) for key in merged_request} == merged_request
+            and datetime.now() - datetime.fromisoformat(previous['fetched_at'])
+            < timedelta(minutes=STOCK_DATA_CACHE_MINUTES)):
+        # Same stock and range as the session's merged data, which appends keep current:
+        # skip the fetch and merge, and let Pearson come from the running sums
+        merged = session_data['merged_data']
+        pearson_stats = PearsonAccumulator.from_frame(session_data['merged_stats'])
+        merged_request = previous
+    else:
+        # Fetch stock data
+        stock_data = await run_fetch(
+            stock_analyzer.fetch_stock_data,
+            request.stock_symbol,
+            request.start_date,
+            request.end_date
+        )
+        if stock_data is None:
+            raise HTTPException(status_code=400, detail=f"Could not fetch stock data for {request.stock_symbol}")
+        
+        # Merge datasets
+        merged = await run_analysis(
+            stock_analyzer.align_and_merge, stock_data, custom_data, date_column, session_data.get('dates'),
+            alignment=request.alignment, tolerance_days=request.tolerance_days, frequency=request.frequency,
+            aggregation=request.aggregation, dates_key=session_data['content_hashes'].get('dates'))
+        if merged.empty:
+            raise HTTPException(status_code=400, detail="No overlapping dates found between datasets")
+        pearson_stats = None
+        merged_request['fetched_at'] = datetime.now().isoformat()
     
     # Prepare variables for correlation analysis
-    stock_vars = ['Date', 'Open', 'High', 'Low', 'Close', 'Adj Close', 'Volume', 'Dividends', 'Stock Splits']
+    stock_vars = STOCK_VARIABLES
     available_stock_vars = [col for col in stock_vars if col in merged.columns]
     custom_vars = [col for col in merged.columns 
                    if col not in ['date', 'Date'] + stock_vars 
-                   and merged[col].dtype in ['float64', 'int64']]
+                   and pd.api.types.is_numeric_dtype(merged[col])]
     
     if not available_stock_vars or not custom_vars:
         raise HTTPException(status_code=400, detail="No valid variables found for correlation analysis")
     
-    # Use the CorrelationAnalyzer for consistent correlation calculation
+    # Only the stock x custom block is needed, so skip stock-stock and custom-custom pairs
     all_vars = available_stock_vars + custom_vars
-    correlations = correlation_analyzer.analyze_correlations(
-        data=merged,
-        numeric_columns=all_vars,
-        methods=request.methods,
-        min_correlation=request.min_correlation
-    )
-    
-    # Filter to only include stock-to-custom correlations
-    stock_custom_correlations = [
-        corr for corr in correlations
-        if (corr['variable1'] in available_stock_vars and corr['variable2'] in custom_vars) or
-           (corr['variable1'] in custom_vars and corr['variable2'] in available_stock_vars)
-    ]
-    
-    # Reformat to match expected output structure
-    formatted_correlations = []
-    for corr in stock_custom_correlations:
-        # Determine which variable is stock and which is custom
-        if corr['variable1'] in available_stock_vars:
-            stock_var, custom_var = corr['variable1'], corr['variable2']
-        else:
-            stock_var, custom_var = corr['variable2'], corr['variable1']
+    if request.mode == 'lagged':
+        lags = list(range(request.min_lag, request.max_lag + 1))
+        correlations = await run_analysis(
+            correlation_analyzer.lagged_correlations, merged, available_stock_vars, custom_vars, lags,
+            min_correlation=request.min_correlation)
+        content = {'mode': 'lagged', 'lags': lags, 'correlations': format_stock_correlations(correlations)}
+    elif request.mode == 'rolling':
+        if request.window > len(merged):
+            raise HTTPException(status_code=422, detail=f"window of {request.window} rows exceeds the "
+                                                        f"{len(merged)} merged rows")
+        positions, correlations = await run_analysis(
+            correlation_analyzer.rolling_correlations, merged, available_stock_vars, custom_vars, request.window,
+            step=request.step, min_correlation=request.min_correlation)
+        content = {
+            'mode': 'rolling',
+            'window': request.window,
+            'x': merged['date'].iloc[positions].dt.strftime('%Y-%m-%d').tolist(),
+            'correlations': format_stock_correlations(correlations)
+        }
+    else:
+        correlations = await run_analysis(
+            correlation_analyzer.analyze_correlations,
+            data=merged,
+            numeric_columns=available_stock_vars,
+            right_columns=custom_vars,
+            methods=request.methods,
+            min_correlation=request.min_correlation,
+            pearson_stats=pearson_stats,
+            significance=request.significance,
+            resamples=request.resamples,
+            block_size=request.block_size,
+            seed=request.seed
+        )
         
-        formatted_correlations.append({
-            'stock_variable': stock_var,
-            'custom_variable': custom_var,
-            'correlation': corr['correlation'],
-            'p_value': corr['p_value'],
-            'method': corr['method'],
-            'n_observations': corr['n_observations'],
-            'significant': corr['significant'],
-            'confidence_interval': corr.get('confidence_interval')
-        })
+        # Reformat to match expected output structure
+        content = {'correlations': format_stock_correlations(correlations)}
     
-    # Update session with merged data
-    session_manager.update_session(session_id, {
+    if pearson_stats is None:
+        # Running sums that appends extend instead of recomputing from every row
+        pearson_stats = await run_analysis(PearsonAccumulator(all_vars).add, merged)
+    merged_update = {
         'merged_data': merged,
         'merged_date_column': 'date',
-        'merged_numeric_columns': all_vars
-    })
-    
-    return {'correlations': formatted_correlations}
+        'merged_numeric_columns': all_vars,
+        'merged_stats': pearson_stats.to_frame(),
+        'merged_request': merged_request
+    }
+    # Expires with the stock prices it was computed from
+    merged_hash = await run_analysis(content_hash, merged)
+    result_cache.put(cache_key, (content, merged_update, merged_hash), session_id, ['data'],
+                     nbytes=int(merged.memory_usage(deep=True).sum()), ttl_minutes=STOCK_DATA_CACHE_MINUTES)
 
-@app.post("/visualization/{session_id}")
-async def create_visualization(
-    session_id: str, 
-    request: VisualizationRequest,
-    source: str = Query("custom", enum=["custom", "merged"])
-):
-    session_data = session_manager.get_session(session_id)
+    # Update session with merged data, unless an append changed the custom data it was built from;
+    # reusing a stale merged frame later would miss the appended rows
+    await run_fetch(session_manager.update_session, session_id, merged_update,
+                    {'data': session_data['content_hashes']['data']})
+    return content
+
+@app.post("/stock-analysis/{session_id}")
+async def stock_analysis(session_id: str, request: StockAnalysisRequest, http_request: Request):
+    content = await stock_analysis_content(session_id, request)
+    return await run_analysis(negotiated_response, http_request, content)
+
+@app.post("/stock-analysis/{session_id}/batch")
+async def batch_stock_analysis(session_id: str, request: BatchStockAnalysisRequest):
+    """Screen one session against many tickers, streaming one NDJSON line per symbol as it finishes"""
+    session_data = await run_fetch(session_manager.get_session, session_id)
     if not session_data:
         raise HTTPException(status_code=404, detail="Session not found")
 
+    custom_data = session_data['data']
+    custom_vars = [col for col in session_data['numeric_columns']
+                   if col not in ['date', 'Date'] + STOCK_VARIABLES
+                   and pd.api.types.is_numeric_dtype(custom_data[col])]
+    if not custom_vars:
+        raise HTTPException(status_code=400, detail="No valid variables found for correlation analysis")
+    symbols = list(dict.fromkeys(s.strip().upper() for s in request.stock_symbols if s.strip()))
+
+    # Custom-side work happens once: the per-column statistics every ticker is
+    # correlated against (the calendar dates were parsed at upload)
+    dates = session_data['dates']
+    statistics = await run_analysis(ColumnStatistics, custom_data, custom_vars)
+
+    async def fetch(symbol):
+        return symbol, await run_fetch(
+            stock_analyzer.fetch_stock_data, symbol, request.start_date, request.end_date)
+
+    @span('batch.analyze')
+    def analyze(stock_data):
+        aligned = stock_analyzer.align_to_dates(stock_data, dates, request.alignment, request.tolerance_days,
+                                                session_data['content_hashes'].get('dates'))
+        if not aligned.notna().any().any():
+            return None
+        return correlation_analyzer.analyze_correlations(
+            data=aligned,
+            numeric_columns=list(aligned.columns),
+            right_columns=statistics,
+            methods=request.methods,
+            min_correlation=request.min_correlation
+        )
+
+    async def stream():
+        tasks = [asyncio.ensure_future(fetch(symbol)) for symbol in symbols]
+        try:
+            for finished in asyncio.as_completed(tasks):
+                symbol, stock_data = await finished
+                if stock_data is None:
+                    result = {'symbol': symbol, 'error': f"Could not fetch stock data for {symbol}"}
+                else:
+                    correlations = await run_analysis(analyze, stock_data)
+                    if correlations is None:
+                        result = {'symbol': symbol, 'error': "No overlapping dates found between datasets"}
+                    else:
+                        result = {'symbol': symbol, 'correlations': format_stock_correlations(correlations)}
+                yield dumps(result) + b'\n'
+        finally:
+            # Client went away or we are done: drop any downloads still queued
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(stream(), media_type='application/x-ndjson')
+
+def session_frame(session_data, source):
+    """(frame, date column, session key of the frame) for a ?source= of custom or merged"""
     if source == "merged":
         data = session_data.get('merged_data')
         date_column = session_data.get('merged_date_column')
         if data is None or date_column is None:
             raise HTTPException(status_code=400, detail="No merged data found. Run stock analysis first.")
-    else:
-        data = session_data['data']
-        date_column = session_data['date_column']
+        return data, date_column, 'merged_data'
+    return session_data['data'], session_data['date_column'], 'data'
+
+def session_stats(session_data, source, columns):
+    """The session's running Pearson sums for source, if they cover columns"""
+    stats_frame = session_data.get('merged_stats' if source == "merged" else 'data_stats')
+    stats = PearsonAccumulator.from_frame(stats_frame) if stats_frame is not None else None
+    if stats is not None and not set(columns) <= set(stats.columns):
+        return None
+    return stats
+
+async def visualization_content(session_id: str, request: VisualizationRequest, source: str):
+    """Response content of /visualization, computed or from the result cache"""
+    session_data = await run_fetch(session_manager.get_session, session_id)
+    if not session_data:
+        raise HTTPException(status_code=404, detail="Session not found")
+    data, date_column, frame_key = session_frame(session_data, source)
+
+    cache_key = ('visualization', session_data['content_hashes'][frame_key], date_column,
+                 json.dumps(request.model_dump(mode='json'), sort_keys=True))
+    cached = result_cache.get(cache_key)
+    if cached is not None:
+        return cached
     
     if request.chart_type == 'correlation_matrix':
         valid_vars = [var for var in request.variables if var in data.columns]
         if len(valid_vars) < 2:
             raise HTTPException(status_code=400, detail="Need at least 2 variables for correlation matrix")
-        viz_data = viz_engine.create_correlation_matrix(data[valid_vars])
+        stats = session_stats(session_data, source, valid_vars)
+        viz_data = await run_analysis(viz_engine.create_correlation_matrix, data[valid_vars], stats)
     elif request.chart_type == 'time_series':
         valid_vars = [var for var in request.variables if var in data.columns]
         if not valid_vars:
             raise HTTPException(status_code=400, detail="No valid variables specified")
-        viz_data = viz_engine.create_time_series_data(data, date_column, valid_vars)
+        windowed = (request.max_points is not None or request.start_date is not None
+                    or request.end_date is not None or request.offset or request.limit is not None)
+        if windowed:
+            viz_data = await run_analysis(
+                viz_engine.create_time_series_window, data, date_column, valid_vars,
+                max_points=request.max_points, start_date=request.start_date, end_date=request.end_date,
+                offset=request.offset, limit=request.limit, downsample=request.downsample)
+        else:
+            viz_data = await run_analysis(viz_engine.create_time_series_data, data, date_column, valid_vars)
     else:
         raise HTTPException(status_code=400, detail="Invalid chart_type")
     
-    return make_json_safe(viz_data)
+    # Sized by its JSON encoding so full time series count against RESULT_CACHE_MAX_MB
+    result_cache.put(cache_key, viz_data, session_id, [frame_key], nbytes=len(await run_analysis(dumps, viz_data)))
+    return viz_data
+
+@app.post("/visualization/{session_id}")
+async def create_visualization(
+    session_id: str, 
+    request: VisualizationRequest,
+    http_request: Request,
+    source: str = Query("custom", enum=["custom", "merged"])
+):
+    content = await visualization_content(session_id, request, source)
+    return await run_analysis(negotiated_response, http_request, content)
+
+async def correlation_matrix_content(session_id: str, request: CorrelationMatrixRequest, source: str):
+    """Response content of /correlation-matrix, computed or from the result cache"""
+    session_data = await run_fetch(session_manager.get_session, session_id)
+    if not session_data:
+        raise HTTPException(status_code=404, detail="Session not found")
+    data, _, frame_key = session_frame(session_data, source)
+
+    if request.variables is None:
+        variables = session_data['merged_numeric_columns' if source == "merged" else 'numeric_columns']
+    else:
+        variables = list(dict.fromkeys(request.variables))
+    valid_vars = [var for var in variables
+                  if var in data.columns and pd.api.types.is_numeric_dtype(data[var])]
+    if len(valid_vars) < 2:
+        raise HTTPException(status_code=400, detail="Need at least 2 numeric variables for correlation matrix")
+    if request.top_k is None and len(valid_vars) ** 2 > MATRIX_MAX_CELLS:
+        raise HTTPException(status_code=400, detail=f"{len(valid_vars)} variables make too large a matrix; "
+                                                    f"ask for top_k cells or fewer variables")
+
+    cache_key = ('correlation-matrix', session_data['content_hashes'][frame_key], tuple(valid_vars),
+                 request.method, request.min_periods, request.top_k, request.order)
+    cached = result_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    stats = session_stats(session_data, source, valid_vars) if request.method == 'pearson' else None
+    content = await run_analysis(
+        viz_engine.create_correlation_matrix, data[valid_vars], stats, method=request.method,
+        min_periods=request.min_periods, top_k=request.top_k, order=request.order)
+    result_cache.put(cache_key, content, session_id, [frame_key], nbytes=len(await run_analysis(dumps, content)))
+    return content
+
+@app.post("/correlation-matrix/{session_id}")
+async def correlation_matrix(
+    session_id: str,
+    request: CorrelationMatrixRequest,
+    http_request: Request,
+    source: str = Query("custom", enum=["custom", "merged"])
+):
+    """Pearson, Spearman or Kendall matrix with per-cell observation counts, or only its top_k strongest cells"""
+    content = await correlation_matrix_content(session_id, request, source)
+    return await run_analysis(negotiated_response, http_request, content)
+
+async def cross_correlation_content(request: CrossDatasetRequest):
+    """Response content of /cross-correlation, computed or from the result cache"""
+    session_ids = request.session_ids
+    labels = request.labels if request.labels is not None else session_ids
+    if len(labels) != len(session_ids):
+        raise HTTPException(status_code=400, detail="Need one label per session")
+    symbols = list(dict.fromkeys(s.strip().upper() for s in request.stock_symbols if s.strip()))
+    if len(set(labels + symbols)) != len(labels) + len(symbols):
+        raise HTTPException(status_code=400, detail="Session labels and stock symbols must be distinct")
+    if len(labels) + len(symbols) < 2:
+        raise HTTPException(status_code=400, detail="Need at least two datasets to correlate across")
+    sessions = await asyncio.gather(*(run_fetch(session_manager.get_session, sid) for sid in session_ids))
+    missing = [sid for sid, session_data in zip(session_ids, sessions) if not session_data]
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Session not found: {', '.join(missing)}")
+
+    cache_key = ('cross-correlation', tuple(session_data['content_hashes']['data'] for session_data in sessions),
+                 json.dumps(request.model_dump(mode='json'), sort_keys=True))
+    cached = result_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    datasets = [(label, session_data['dates'], session_data['data'][session_data['numeric_columns']])
+                for label, session_data in zip(labels, sessions)]
+    index = await run_analysis(shared_dates, [dates for _, dates, _ in datasets], request.join)
+    if not len(index):
+        raise HTTPException(status_code=400, detail="No dates shared by all sessions")
+
+    if symbols:
+        start = request.start_date or index[0].date()
+        end = request.end_date or (index[-1] + pd.Timedelta(days=1)).date()
+        stock_frames = await asyncio.gather(*(run_fetch(stock_analyzer.fetch_stock_data, symbol, start, end)
+                                              for symbol in symbols))
+        failed = [symbol for symbol, stock_data in zip(symbols, stock_frames) if stock_data is None]
+        if failed:
+            raise HTTPException(status_code=400, detail=f"Could not fetch stock data for {', '.join(failed)}")
+        dates = pd.Series(index)
+        for symbol, stock_data in zip(symbols, stock_frames):
+            aligned = await run_analysis(stock_analyzer.align_to_dates, stock_data, dates, request.alignment,
+                                         request.tolerance_days)
+            datasets.append((symbol, dates, aligned))
+
+    joined = await run_analysis(join_on_dates, index, datasets)
+    dataset_of = {f'{label}:{col}': label for label, _, frame in datasets for col in frame.columns}
+    correlations = await run_analysis(
+        correlation_analyzer.analyze_correlations, joined, list(dataset_of), request.methods, request.min_correlation)
+    if request.cross_only:
+        correlations = [corr for corr in correlations
+                        if dataset_of[corr['variable1']] != dataset_of[corr['variable2']]]
+    content = {
+        'join': request.join,
+        'rows': len(index),
+        'date_range': {'start': index[0].strftime('%Y-%m-%d'), 'end': index[-1].strftime('%Y-%m-%d')},
+        'datasets': [{
+            'label': label,
+            **({'session_id': session_ids[i]} if i < len(session_ids) else {'stock_symbol': label}),
+            'columns': [f'{label}:{col}' for col in frame.columns]
+        } for i, (label, _, frame) in enumerate(datasets)],
+        'correlations': [{
+            **corr, 'dataset1': dataset_of[corr['variable1']], 'dataset2': dataset_of[corr['variable2']]
+        } for corr in correlations]
+    }
+    # Filed under the first session, though the key covers them all; prices expire as in /stock-analysis
+    result_cache.put(cache_key, content, session_ids[0], ['data'], nbytes=len(await run_analysis(dumps, content)),
+                     ttl_minutes=STOCK_DATA_CACHE_MINUTES if symbols else None)
+    return content
+
+@app.post("/cross-correlation")
+async def cross_correlation(request: CrossDatasetRequest, http_request: Request):
+    """Correlate columns across several sessions and tickers, joined on one shared date index"""
+    content = await cross_correlation_content(request)
+    return await run_analysis(negotiated_response, http_request, content)
+
+async def submit_job(session_id, kind, request, compute, **query):
+    """Queue compute() as a background job of an existing session; the 202 body is the job's status"""
+    if not await run_fetch(session_manager.get_session, session_id):
+        raise HTTPException(status_code=404, detail="Session not found")
+    job = job_manager.submit(session_id, kind, {**request.model_dump(mode='json'), **query}, compute)
+    return JSONResponse(job.record(), status_code=202,
+                        headers={'Location': f"/jobs/{session_id}/{job.id}"})
+
+@app.post("/jobs/{session_id}/stock-analysis")
+async def submit_stock_analysis(session_id: str, request: StockAnalysisRequest):
+    """/stock-analysis as a background job, for analyses that outlast proxy timeouts"""
+    return await submit_job(session_id, 'stock-analysis', request,
+                            partial(stock_analysis_content, session_id, request))
+
+@app.post("/jobs/{session_id}/visualization")
+async def submit_visualization(
+    session_id: str,
+    request: VisualizationRequest,
+    source: str = Query("custom", enum=["custom", "merged"])
+):
+    return await submit_job(session_id, 'visualization', request,
+                            partial(visualization_content, session_id, request, source), source=source)
+
+@app.post("/jobs/{session_id}/correlation-matrix")
+async def submit_correlation_matrix(
+    session_id: str,
+    request: CorrelationMatrixRequest,
+    source: str = Query("custom", enum=["custom", "merged"])
+):
+    return await submit_job(session_id, 'correlation-matrix', request,
+                            partial(correlation_matrix_content, session_id, request, source), source=source)
+
+@app.post("/jobs/cross-correlation")
+async def submit_cross_correlation(request: CrossDatasetRequest):
+    """/cross-correlation as a background job, kept with the first session"""
+    return await submit_job(request.session_ids[0], 'cross-correlation', request,
+                            partial(cross_correlation_content, request))
+
+@app.get("/jobs/{session_id}")
+async def list_jobs(session_id: str):
+    return {'jobs': await run_fetch(job_manager.list, session_id)}
+
+@app.get("/jobs/{session_id}/{job_id}")
+async def get_job(session_id: str, job_id: str):
+    """Status and progress (pairs done out of total) of a job"""
+    record = await run_fetch(job_manager.get, session_id, job_id)
+    if record is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return record
+
+@app.get("/jobs/{session_id}/{job_id}/result")
+async def get_job_result(session_id: str, job_id: str, http_request: Request):
+    """A finished job's result, encoded like the synchronous endpoint's response"""
+    found = await run_fetch(job_manager.result, session_id, job_id)
+    if found is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    record, content = found
+    if record['status'] == 'failed':
+        raise HTTPException(status_code=record['status_code'], detail=record['error'])
+    if record['status'] != 'done':
+        raise HTTPException(status_code=409, detail=f"Job is {record['status']}")
+    return await run_analysis(negotiated_response, http_request, content)
+
+@app.delete("/jobs/{session_id}/{job_id}")
+async def cancel_job(session_id: str, job_id: str):
+    """Cancel a queued or running job; finished jobs are left as they are"""
+    record = await run_fetch(job_manager.cancel, session_id, job_id)
+    if record is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return record
 
 @app.get("/data/{session_id}/info")
 async def get_data_info(session_id: str):
-    session_data = session_manager.get_session(session_id)
+    session_data = await run_fetch(session_manager.get_session, session_id)
     if not session_data:
         raise HTTPException(status_code=404, detail="Session not found")
     data = session_data['data']
@@ -205,7 +715,8 @@ async def get_data_info(session_id: str):
 @app.get("/sessions")
 async def list_sessions():
     sessions = []
-    for session_id, session_data in session_manager.sessions.items():
+    session_list = await run_fetch(session_manager.list_sessions)
+    for session_id, session_data in session_list.items():
         sessions.append({
             'session_id': session_id,
             'created_at': session_data['created_at'].isoformat(),
@@ -221,5 +732,12 @@ async def health_check():
     return {
         'status': 'healthy',
         'timestamp': datetime.now().isoformat(),
-        'active_sessions': len(session_manager.sessions)
-    }
\ No newline at end of file
+        'active_sessions': await run_fetch(len, session_manager),
+        'session_memory': session_manager.memory_usage(),
+        'result_cache': result_cache.stats()
+    }
+
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus text format: request latency, stage durations and errors, caches and session memory"""
+    return Response(await run_fetch(metrics.render), media_type='text/plain; version=0.0.4; charset=utf-8')
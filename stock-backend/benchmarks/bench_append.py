@@ -0,0 +1,108 @@
+"""Append uploads against re-uploading the whole file: latency, and results identical to a fresh upload.
+
+Uploads a base CSV, analyzes it against a stock, then appends batches of newer
+rows. After each append the Pearson analysis and correlation matrix must
+match a fresh upload of the combined file. Uses the offline stock source.
+
+Usage: python benchmarks/bench_append.py [--rows 200000] [--batch 250] [--appends 5]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+from fastapi.testclient import TestClient
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as app_module
+from bench_stock_cache import LocalPriceSource
+from session import SessionManager
+from stock import StockDataCache
+
+
+def make_frame(rows, columns=8, seed=0):
+    rng = np.random.default_rng(seed)
+    frame = pd.DataFrame(rng.normal(size=(rows, columns)).cumsum(axis=0),
+                         columns=[f'metric_{j}' for j in range(columns)])
+    frame.insert(0, 'date', pd.date_range('1990-01-01', periods=rows, freq='D').strftime('%Y-%m-%d'))
+    return frame
+
+
+def upload(client, frame):
+    response = client.post('/upload', files={'file': ('data.csv', frame.to_csv(index=False).encode(), 'text/csv')})
+    response.raise_for_status()
+    return response.json()['session_id']
+
+
+def results(client, session_id, analysis):
+    correlations = client.post(f'/stock-analysis/{session_id}', json=analysis).json()['correlations']
+    matrix = client.post(f'/visualization/{session_id}',
+                         json={'variables': [f'metric_{j}' for j in range(8)], 'chart_type': 'correlation_matrix'}).json()['data']
+    return {(c['stock_variable'], c['custom_variable']): c['correlation'] for c in correlations}, \
+        np.asarray(matrix['values'], dtype=float)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=200_000)
+    parser.add_argument('--batch', type=int, default=250)
+    parser.add_argument('--appends', type=int, default=5)
+    args = parser.parse_args()
+
+    total = args.rows + args.batch * args.appends
+    frame = make_frame(total)
+    dates = pd.to_datetime(frame['date'])
+    analysis = {'stock_symbol': 'BENCH', 'start_date': str(dates[0].date()),
+                'end_date': str((dates.iloc[-1] + pd.Timedelta(days=1)).date()),
+                'methods': ['pearson'], 'min_correlation': 0.0}
+
+    failures = []
+    with tempfile.TemporaryDirectory() as session_dir:
+        app_module.session_manager = SessionManager(session_dir=session_dir)
+        app_module.session_manager.on_change(app_module.result_cache.invalidate)
+        app_module.stock_analyzer.source = LocalPriceSource()
+        app_module.stock_analyzer.cache = StockDataCache(cache_dir=None)
+        with TestClient(app_module.app) as client:
+            session_id = upload(client, frame.iloc[:args.rows])
+            results(client, session_id, analysis)
+
+            append_time = reupload_time = 0.0
+            for a in range(args.appends):
+                end = args.rows + (a + 1) * args.batch
+                # Overlaps the previous batch by one row, which the append must skip
+                batch = frame.iloc[end - args.batch - 1:end].to_csv(index=False).encode()
+                started = time.perf_counter()
+                response = client.post(f'/upload/{session_id}/append', files={'file': ('more.csv', batch, 'text/csv')})
+                appended = results(client, session_id, analysis)
+                append_time += time.perf_counter() - started
+                body = response.json()
+                if body['appended_rows'] != args.batch or body['skipped_rows'] != 1:
+                    failures.append(f'append {a}: {body}')
+
+                started = time.perf_counter()
+                fresh = results(client, upload(client, frame.iloc[:end]), analysis)
+                reupload_time += time.perf_counter() - started
+
+                if appended[0].keys() != fresh[0].keys():
+                    failures.append(f'append {a}: different correlation pairs')
+                else:
+                    worst = max(abs(appended[0][key] - fresh[0][key]) for key in fresh[0])
+                    if worst > 1e-9:
+                        failures.append(f'append {a}: pearson differs by {worst:.2e}')
+                if not np.allclose(appended[1], fresh[1], atol=1e-9):
+                    failures.append(f'append {a}: correlation matrix differs')
+
+    print(f'{args.appends} appends of {args.batch} rows onto {args.rows} rows')
+    print(f'append + re-analysis: {append_time / args.appends * 1000:.0f} ms each')
+    print(f'full re-upload + analysis: {reupload_time / args.appends * 1000:.0f} ms each')
+    for failure in failures:
+        print('FAIL', failure)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""Compare the vectorized correlation engine against the per-pair scipy loop.
+
+Usage: python benchmarks/bench_correlation.py [--rows 750] [--columns 10 50 100 200]
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from analysis import CorrelationAnalyzer
+
+
+def make_frame(rows, columns, nan_ratio, seed=0):
+    rng = np.random.default_rng(seed)
+    base = rng.normal(size=(rows, 1))
+    values = base + rng.normal(size=(rows, columns))
+    # A few integer-valued columns so Spearman sees ties
+    values[:, ::7] = np.round(values[:, ::7])
+    if nan_ratio:
+        values[rng.random(values.shape) < nan_ratio] = np.nan
+    return pd.DataFrame(values, columns=[f'var_{i}' for i in range(columns)])
+
+
+def max_difference(expected, actual):
+    """Largest absolute difference across correlation, p-value and CI fields"""
+    assert len(expected) == len(actual), f'{len(expected)} != {len(actual)} results'
+    key = lambda c: (c['variable1'], c['variable2'], c['method'])
+    expected = {key(c): c for c in expected}
+    worst = 0.0
+    for c in actual:
+        e = expected[key(c)]
+        assert e['n_observations'] == c['n_observations']
+        assert (e['confidence_interval'] is None) == (c['confidence_interval'] is None)
+        diffs = [e['correlation'] - c['correlation'], e['p_value'] - c['p_value']]
+        if e['confidence_interval']:
+            diffs += [e['confidence_interval']['lower'] - c['confidence_interval']['lower'],
+                      e['confidence_interval']['upper'] - c['confidence_interval']['upper']]
+        worst = max(worst, max(abs(d) for d in diffs))
+    return worst
+
+
+def check_short_frames(analyzer):
+    """Pairs with fewer than 3 shared rows are dropped, as the per-pair loop drops them, for every method"""
+    methods = list(analyzer.methods)
+    for rows in range(3):
+        data = make_frame(rows, 4, 0.0)
+        names = list(data.columns)
+        for significance in ('analytic', 'permutation'):
+            kwargs = dict(methods=methods, min_correlation=0.0, significance=significance, resamples=10)
+            assert analyzer.analyze_correlations(data, names, **kwargs) == []
+            assert analyzer.analyze_correlations(data, names[:2], right_columns=names[2:], **kwargs) == []
+        assert analyzer.analyze_correlations_pairwise(data, names, methods=methods) == []
+
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=750)
+    parser.add_argument('--columns', type=int, nargs='+', default=[10, 50, 100, 200])
+    parser.add_argument('--nan-ratio', type=float, default=0.0)
+    parser.add_argument('--methods', nargs='+', default=['pearson', 'spearman'])
+    args = parser.parse_args()
+
+    analyzer = CorrelationAnalyzer()
+    check_short_frames(analyzer)
+    print(f"{'columns':>8} {'pairs':>8} {'pairwise_s':>11} {'vectorized_s':>13} {'speedup':>8} {'max_diff':>10}")
+    for columns in args.columns:
+        data = make_frame(args.rows, columns, args.nan_ratio)
+        names = list(data.columns)
+        slow, expected = timed(analyzer.analyze_correlations_pairwise, data, names, methods=args.methods)
+        fast, actual = timed(analyzer.analyze_correlations, data, names, methods=args.methods, min_correlation=0.0)
+        diff = max_difference(expected, actual)
+        pairs = columns * (columns - 1) // 2
+        print(f'{columns:>8} {pairs:>8} {slow:>11.3f} {fast:>13.3f} {slow / fast:>7.1f}x {diff:>10.2e}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""Peak memory and wall time of CSV ingestion: whole-file read vs chunked streaming.
+
+Each run happens in a fresh subprocess so ru_maxrss measures only that path.
+
+Usage: python benchmarks/bench_csv_ingest.py [--rows 700000] [--columns 10]
+"""
+import argparse
+import io
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def legacy_validate(content: bytes):
+    """The pre-streaming path: bytes in memory, one read_csv, whole-frame coercion"""
+    df = pd.read_csv(io.BytesIO(content), encoding='utf-8')
+    df.columns = df.columns.str.strip()
+    df['date'] = pd.to_datetime(df['date'], errors='coerce')
+    df = df.dropna(subset=['date'])
+    for col in df.columns:
+        if col != 'date':
+            df[col] = pd.to_numeric(df[col], errors='coerce')
+    return df.sort_values('date').reset_index(drop=True)
+
+
+def write_csv(path, rows, columns):
+    rng = np.random.default_rng(0)
+    frame = pd.DataFrame({'date': pd.date_range('1990-01-01', periods=rows, freq='min').strftime('%Y-%m-%d %H:%M')})
+    for i in range(columns):
+        # Mix of integer counts and two-decimal prices, like typical exports
+        frame[f'metric_{i}'] = rng.integers(0, 1000, rows) if i % 2 else np.round(rng.normal(100, 10, rows), 2)
+    frame.to_csv(path, index=False)
+
+
+def run_one(mode, path):
+    start = time.perf_counter()
+    if mode == 'legacy':
+        with open(path, 'rb') as f:
+            df = legacy_validate(f.read())
+    else:
+        from csv_utils import CSVValidator
+        with open(path, 'rb') as f:
+            result = CSVValidator().validate_csv(f)
+        assert result['is_valid'], result['error']
+        df = result['data']
+    elapsed = time.perf_counter() - start
+    print(json.dumps({
+        'seconds': elapsed,
+        'peak_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'frame_mb': df.memory_usage(deep=True).sum() / 2**20,
+        'rows': len(df)
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=700_000)
+    parser.add_argument('--columns', type=int, default=10)
+    parser.add_argument('--run', choices=['legacy', 'streaming'], help=argparse.SUPPRESS)
+    parser.add_argument('--path', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        run_one(args.run, args.path)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'upload.csv')
+        write_csv(path, args.rows, args.columns)
+        print(f"{args.rows} rows x {args.columns} columns, {os.path.getsize(path) / 2**20:.1f} MB on disk")
+        for mode in ('legacy', 'streaming'):
+            proc = subprocess.run([sys.executable, __file__, '--run', mode, '--path', path],
+                                  capture_output=True, text=True)
+            if proc.returncode:
+                print(f"{mode:>10}: failed\n{proc.stderr}")
+                continue
+            stats = json.loads(proc.stdout)
+            print(f"{mode:>10}: {stats['seconds']:6.2f}s  peak RSS {stats['peak_mb']:7.1f} MB  "
+                  f"frame {stats['frame_mb']:6.1f} MB  rows {stats['rows']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""Date column detection and parsing: per-call format inference vs one inferred explicit format.
+
+The legacy path mirrors what an upload plus one stock analysis used to cost:
+detection on the full column, the conversion in validate_csv and the reparse
+in align_and_merge.
+
+Usage: python benchmarks/bench_dates.py [--rows 1000000]
+"""
+import argparse
+import os
+import sys
+import time
+import warnings
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dates import infer_date_format, parse_dates
+
+FORMATS = ['%Y-%m-%d', '%m/%d/%Y', '%d/%m/%Y', '%d.%m.%Y', '%Y-%m-%d %H:%M:%S', '%b %d, %Y']
+
+
+def legacy(values):
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', UserWarning)
+        pd.to_datetime(values.dropna().head(10), errors='coerce')
+        pd.to_datetime(values, errors='coerce')
+        parsed = pd.to_datetime(values, errors='coerce')
+        pd.to_datetime(parsed, errors='coerce').dt.normalize()
+    return parsed
+
+
+def current(values):
+    return parse_dates(values, infer_date_format(values))
+
+
+def timed(func, values):
+    start = time.perf_counter()
+    result = func(values)
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    dates = pd.Series(pd.date_range('1990-01-01', periods=args.rows, freq='h'))
+    print(f"{args.rows} rows")
+    print(f"{'format':>20} {'legacy':>9} {'inferred':>9} {'speedup':>8}  parsed (legacy / inferred)")
+    for fmt in FORMATS:
+        values = dates.dt.strftime(fmt).astype(object)
+        legacy_time, legacy_result = timed(legacy, values)
+        current_time, current_result = timed(current, values)
+        print(f"{fmt:>20} {legacy_time:8.2f}s {current_time:8.2f}s {legacy_time / current_time:7.1f}x  "
+              f"{legacy_result.notna().mean():.0%} / {current_result.notna().mean():.0%}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""Joining N uploads on date: chained pd.merge vs one shared index (joins.join_on_dates).
+
+Each dataset has its own date range and calendar (business days, every day,
+weekly), so the inner join keeps the dates they all share.
+
+Usage: python benchmarks/bench_join.py [--datasets 8] [--rows 20000] [--columns 50] [--how inner]
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dates import normalize_dates
+from joins import shared_dates, join_on_dates
+from synthetic import make_frame
+
+CALENDARS = ('B', 'D', 'W-FRI')
+
+
+def measure(func):
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, elapsed, peak / (1024 * 1024)
+
+
+def chained_merge(datasets, how):
+    joined = None
+    for label, dates, frame in datasets:
+        frame = frame.add_prefix(f'{label}:').assign(date=dates.to_numpy()).groupby('date').mean()
+        joined = frame if joined is None else joined.merge(frame, how=how, left_index=True, right_index=True)
+    return joined.sort_index()
+
+
+def shared_index(datasets, how):
+    return join_on_dates(shared_dates([dates for _, dates, _ in datasets], how), datasets)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--datasets', type=int, default=8)
+    parser.add_argument('--rows', type=int, default=20000)
+    parser.add_argument('--columns', type=int, default=50)
+    parser.add_argument('--how', choices=('inner', 'outer'), default='inner')
+    args = parser.parse_args()
+
+    datasets = []
+    for i in range(args.datasets):
+        frame = make_frame(args.rows, args.columns, nan_ratio=0.02, seed=i, freq=CALENDARS[i % len(CALENDARS)],
+                           start=(pd.Timestamp('1990-01-01') + pd.Timedelta(days=30 * i)).strftime('%Y-%m-%d'))
+        datasets.append((f'd{i}', normalize_dates(frame.pop('date')), frame))
+    print(f'{args.datasets} datasets x {args.rows} rows x {args.columns} columns, {args.how} join')
+    print(f"{'case':<16} {'seconds':>8} {'peak_mb':>8} {'rows':>7} {'max_diff':>9}")
+
+    reference, elapsed, peak = measure(lambda: chained_merge(datasets, args.how))
+    print(f"{'chained merge':<16} {elapsed:>8.2f} {peak:>8.1f} {len(reference):>7}")
+    joined, elapsed, peak = measure(lambda: shared_index(datasets, args.how))
+    diff = np.nanmax(np.abs(joined.drop(columns='date').to_numpy() - reference.to_numpy()), initial=0.0)
+    print(f"{'shared index':<16} {elapsed:>8.2f} {peak:>8.1f} {len(joined):>7} {diff:>9.1e}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+"""Scaling of the batched Kendall path against one scipy kendalltau call per pair.
+
+Two shapes: 'square' correlates every column pair of one frame (every 7th
+column integer-valued, so some columns tie), 'bipartite' correlates a few
+cents-rounded price columns, which tie heavily, against many custom
+columns, as /stock-analysis does.
+
+Usage: python benchmarks/bench_kendall.py [--rows 500 2500 10000] [--columns 10 50] [--stocks 6]
+                                          [--shapes square bipartite]
+"""
+import argparse
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+from scipy.stats import kendalltau
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import analysis
+from analysis import CorrelationAnalyzer
+from bench_correlation import make_frame, max_difference, timed
+
+
+def make_stock_frame(rows, stocks, columns, nan_ratio, seed=0):
+    """stocks cents-rounded price walks next to columns custom ones"""
+    rng = np.random.default_rng(seed)
+    prices = np.round(100 + rng.normal(size=(rows, stocks)).cumsum(axis=0), 2)
+    custom = make_frame(rows, columns, nan_ratio, seed).to_numpy()
+    return pd.DataFrame(np.hstack([prices, custom]),
+                        columns=[f'stock_{i}' for i in range(stocks)] + [f'var_{i}' for i in range(columns)])
+
+
+def bipartite_reference(data, left, right):
+    """Plain per-pair scipy results, keyed by (left, right) column"""
+    reference = {}
+    for var1 in left:
+        x = data[var1].to_numpy()
+        for var2 in right:
+            y = data[var2].to_numpy()
+            both = ~np.isnan(x) & ~np.isnan(y)
+            reference[var1, var2] = kendalltau(x[both], y[both])
+    return reference
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, nargs='+', default=[500, 2500, 10000])
+    parser.add_argument('--columns', type=int, nargs='+', default=[10, 50])
+    parser.add_argument('--stocks', type=int, default=6, help='price columns of the bipartite shape')
+    parser.add_argument('--shapes', nargs='+', choices=['square', 'bipartite'], default=['square', 'bipartite'])
+    parser.add_argument('--nan-ratio', type=float, default=0.0)
+    parser.add_argument('--reference-limit', type=int, default=10_000_000,
+                        help='skip the per-pair scipy loop above this many rows x pairs')
+    parser.add_argument('--serial', action='store_true', help='never use the process pool')
+    args = parser.parse_args()
+
+    if args.serial:
+        analysis.PROCESS_POOL_WORKERS = 1
+
+    analyzer = CorrelationAnalyzer()
+    print(f"{'shape':>9} {'rows':>8} {'columns':>8} {'pairs':>8} {'pairwise_s':>11} {'batched_s':>10} "
+          f"{'speedup':>8} {'max_diff':>10}")
+    for shape in args.shapes:
+        for rows in args.rows:
+            for columns in args.columns:
+                if shape == 'square':
+                    data = make_frame(rows, columns, args.nan_ratio)
+                    names = list(data.columns)
+                    pairs = columns * (columns - 1) // 2
+                    fast, actual = timed(analyzer.analyze_correlations, data, names, methods=['kendall'],
+                                         min_correlation=0.0)
+                else:
+                    data = make_stock_frame(rows, args.stocks, columns, args.nan_ratio)
+                    left, right = list(data.columns[:args.stocks]), list(data.columns[args.stocks:])
+                    pairs = len(left) * len(right)
+                    fast, actual = timed(analyzer.analyze_correlations, data, left, methods=['kendall'],
+                                         min_correlation=0.0, right_columns=right)
+                if rows * pairs > args.reference_limit:
+                    print(f"{shape:>9} {rows:>8} {columns:>8} {pairs:>8} {'-':>11} {fast:>10.3f} {'-':>8} {'-':>10}")
+                    continue
+                if shape == 'square':
+                    slow, expected = timed(analyzer.analyze_correlations_pairwise, data, names, methods=['kendall'])
+                    diff = max_difference(expected, actual)
+                else:
+                    slow, expected = timed(bipartite_reference, data, left, right)
+                    assert len(actual) == len(expected), f'{len(expected)} != {len(actual)} results'
+                    diff = max(max(abs(r['correlation'] - expected[r['variable1'], r['variable2']].statistic),
+                                   abs(r['p_value'] - expected[r['variable1'], r['variable2']].pvalue))
+                               for r in actual)
+                print(f'{shape:>9} {rows:>8} {columns:>8} {pairs:>8} {slow:>11.3f} {fast:>10.3f} '
+                      f'{slow / fast:>7.1f}x {diff:>10.2e}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""Lagged and rolling correlations: vectorized engine vs one scipy call per pair and lag (or window).
+
+The per-pair baselines are timed on a sample of lags and windows and
+extrapolated; results are checked against them on that sample. Rolling is
+also compared with pandas' rolling().corr() run pair by pair.
+
+Usage: python benchmarks/bench_lagged.py [--rows 100000] [--stock 5] [--custom 10] [--max-lag 250] [--window 60]
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+from scipy.stats import pearsonr
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from analysis import CorrelationAnalyzer
+
+
+def make_data(rows, stock, custom):
+    rng = np.random.default_rng(0)
+    data = pd.DataFrame(100 + rng.normal(size=(rows, stock)).cumsum(axis=0),
+                        columns=[f'stock_{i}' for i in range(stock)])
+    for j in range(custom):
+        # Half the custom series lead a stock column by j rows, with gaps
+        series = data[f'stock_{j % stock}'].shift(-j) if j % 2 else pd.Series(rng.normal(size=rows).cumsum())
+        data[f'custom_{j}'] = series + rng.normal(size=rows)
+        data.loc[rng.choice(rows, rows // 50), f'custom_{j}'] = np.nan
+    return data
+
+
+def pearson_at_lag(data, left, right, lag):
+    pair = pd.DataFrame({'x': data[left], 'y': data[right].shift(lag)}).dropna()
+    return pearsonr(pair['x'], pair['y'])[0]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=100_000)
+    parser.add_argument('--stock', type=int, default=5)
+    parser.add_argument('--custom', type=int, default=10)
+    parser.add_argument('--max-lag', type=int, default=250)
+    parser.add_argument('--window', type=int, default=60)
+    parser.add_argument('--sample', type=int, default=20, help='lags / windows timed for the per-pair baselines')
+    args = parser.parse_args()
+
+    data = make_data(args.rows, args.stock, args.custom)
+    left = [col for col in data.columns if col.startswith('stock_')]
+    right = [col for col in data.columns if col.startswith('custom_')]
+    pairs = len(left) * len(right)
+    analyzer = CorrelationAnalyzer()
+    rng = np.random.default_rng(1)
+    print(f"{args.rows} rows, {len(left)} x {len(right)} pairs")
+
+    lags = np.arange(-args.max_lag, args.max_lag + 1)
+    start = time.perf_counter()
+    lagged = analyzer.lagged_correlations(data, left, right, lags, min_correlation=0.0)
+    engine_time = time.perf_counter() - start
+    sample = rng.choice(len(lags), args.sample, replace=False)
+    worst = 0.0
+    start = time.perf_counter()
+    for result in lagged:
+        for k in sample:
+            expected = pearson_at_lag(data, result['variable1'], result['variable2'], lags[k])
+            worst = max(worst, abs(expected - result['lag_correlations'][k]))
+    baseline = (time.perf_counter() - start) / args.sample * len(lags) * pairs / len(lagged)
+    print(f"lagged, {len(lags)} lags: engine {engine_time:.2f}s, per-pair scipy ~{baseline:.0f}s "
+          f"({baseline / engine_time:.0f}x), max diff {worst:.1e}")
+
+    start = time.perf_counter()
+    ends, rolling = analyzer.rolling_correlations(data, left, right, args.window, min_correlation=0.0)
+    engine_time = time.perf_counter() - start
+    start = time.perf_counter()
+    for result in rolling:
+        data[result['variable1']].rolling(args.window).corr(data[result['variable2']])
+    pandas_time = (time.perf_counter() - start) * pairs / len(rolling)
+    sample = rng.choice(np.arange(args.window - 1, args.rows), args.sample, replace=False)
+    worst = 0.0
+    start = time.perf_counter()
+    for result in rolling:
+        for end in sample:
+            frame = data[[result['variable1'], result['variable2']]].iloc[end + 1 - args.window:end + 1].dropna()
+            if len(frame) < args.window:
+                continue
+            worst = max(worst, abs(pearsonr(frame.iloc[:, 0], frame.iloc[:, 1])[0] - result['correlations'][end]))
+    baseline = (time.perf_counter() - start) / args.sample * len(ends) * pairs / len(rolling)
+    print(f"rolling, window {args.window}: engine {engine_time:.2f}s, pandas per pair {pandas_time:.2f}s, "
+          f"per-window scipy ~{baseline:.0f}s ({baseline / engine_time:.0f}x), max diff {worst:.1e}")
+
+
+if __name__ == '__main__':
+    main()
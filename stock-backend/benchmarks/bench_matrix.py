@@ -0,0 +1,71 @@
+"""Correlation matrices of wide frames: DataFrame.corr vs the tiled engine, full matrix vs top-k payload.
+
+Rank methods pair columns one mask pattern at a time, as pandas does, so they
+run on the first --rank-columns columns.
+
+Usage: python benchmarks/bench_matrix.py [--rows 5000] [--columns 600] [--rank-columns 100] [--nan-ratio 0.05]
+                                         [--top-k 100]
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from responses import dumps
+from synthetic import make_frame
+from visualization import VisualizationEngine
+
+
+def measure(func):
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, elapsed, peak / (1024 * 1024)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=5000)
+    parser.add_argument('--columns', type=int, default=600)
+    parser.add_argument('--rank-columns', type=int, default=100)
+    parser.add_argument('--nan-ratio', type=float, default=0.05)
+    parser.add_argument('--top-k', type=int, default=100)
+    args = parser.parse_args()
+
+    frame = make_frame(args.rows, args.columns, nan_ratio=args.nan_ratio).drop(columns='date')
+    engine = VisualizationEngine()
+    print(f'{args.rows} rows, {args.columns} columns, {args.nan_ratio:.0%} NaN')
+    print(f"{'case':<34} {'seconds':>8} {'peak_mb':>8} {'payload_kb':>11} {'max_diff':>9}")
+
+    for method in ('pearson', 'spearman', 'kendall'):
+        data = frame if method == 'pearson' else frame.iloc[:, :args.rank_columns]
+        reference, elapsed, peak = measure(lambda: data.corr(method=method, min_periods=3))
+        legacy = dumps({'values': reference.fillna(0).to_numpy().tolist()})
+        print(f"{'DataFrame.corr ' + method:<34} {elapsed:>8.2f} {peak:>8.1f} {len(legacy) / 1024:>11.0f}")
+
+        content, elapsed, peak = measure(lambda: engine.create_correlation_matrix(data, method=method))
+        values = content['data']['values']
+        expected = reference.to_numpy().copy()
+        np.fill_diagonal(expected, np.diag(values))  # pandas keeps 1 on the diagonal of constant columns
+        diff = np.nanmax(np.abs(values - expected))
+        print(f"{'tiled ' + method:<34} {elapsed:>8.2f} {peak:>8.1f} {len(dumps(content)) / 1024:>11.0f} {diff:>9.1e}")
+
+        content, elapsed, peak = measure(lambda: engine.create_correlation_matrix(data, method=method,
+                                                                                  top_k=args.top_k))
+        print(f"{f'tiled {method} top {args.top_k}':<34} {elapsed:>8.2f} {peak:>8.1f} "
+              f"{len(dumps(content)) / 1024:>11.0f}")
+
+    _, elapsed, peak = measure(lambda: engine.create_correlation_matrix(frame, order='clustered'))
+    print(f"{'tiled pearson clustered':<34} {elapsed:>8.2f} {peak:>8.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""align_and_merge against the previous copy + normalize + hash-merge implementation.
+
+Usage: python benchmarks/bench_merge.py [--rows 1000000] [--columns 5] [--repeat 5]
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_stock_cache import LocalPriceSource
+from dates import normalize_dates
+from stock import StockAnalyzer, StockDataCache
+
+
+def hash_merge(stock_data, custom_data, date_column, dates):
+    """The implementation align_and_merge replaced"""
+    stock_data = stock_data.copy()
+    stock_data['date'] = normalize_dates(stock_data['Date'])
+    custom_data = custom_data.copy()
+    custom_data['date'] = dates.to_numpy()
+    stock_data = stock_data.dropna(subset=['date'])
+    custom_data = custom_data.dropna(subset=['date'])
+    return pd.merge(stock_data, custom_data, on='date', how='inner')
+
+
+def timed(func, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = func()
+    return (time.perf_counter() - start) / repeat, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--columns', type=int, default=5)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    # Hourly custom rows, so many share each trading day
+    index = pd.date_range('1995-01-01', periods=args.rows, freq='h')
+    rng = np.random.default_rng(0)
+    custom = pd.DataFrame(rng.normal(size=(args.rows, args.columns)), columns=[f'm{i}' for i in range(args.columns)])
+    custom.insert(0, 'when', index.strftime('%Y-%m-%d %H:%M'))
+    dates = normalize_dates(custom['when'])
+    analyzer = StockAnalyzer(LocalPriceSource(), StockDataCache(cache_dir=None))
+    stock = analyzer.fetch_stock_data('BENCH', index[0].date(), (index[-1] + pd.Timedelta(days=1)).date())
+    print(f"{args.rows} custom rows, {len(stock)} trading days")
+
+    baseline, expected = timed(lambda: hash_merge(stock, custom, 'when', dates), args.repeat)
+    print(f"{'hash merge':>22}: {baseline * 1000:8.1f} ms")
+    cases = [
+        ('exact', {}),
+        ('exact, cached index', {'dates_key': 'bench'}),
+        ('backward, 3 days', {'alignment': 'backward', 'tolerance_days': 3, 'dates_key': 'bench'}),
+        ('weekly mean', {'frequency': 'weekly'}),
+    ]
+    for name, options in cases:
+        elapsed, merged = timed(lambda: analyzer.align_and_merge(stock, custom, 'when', dates, **options), args.repeat)
+        note = ''
+        if name.startswith('exact'):
+            note = 'identical' if merged.equals(expected) else 'DIFFERENT'
+        print(f"{name:>22}: {elapsed * 1000:8.1f} ms  {len(merged):>8} rows  {note}")
+
+
+if __name__ == '__main__':
+    main()
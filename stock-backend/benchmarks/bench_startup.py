@@ -0,0 +1,88 @@
+"""Cold start: import time, startup and time to first response, eager imports vs lazy vs lazy with warm-up.
+
+Every sample is a fresh interpreter, timed from its first line. The app runs
+in-process through the TestClient with the offline stock stand-in, so the
+first /stock-analysis measures first-use initialization, not the network.
+
+Usage: python benchmarks/bench_startup.py [--runs 5] [--rows 2000]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODES = {
+    'eager': {'LAZY_IMPORTS': '0', 'WARM_UP': '0'},
+    'lazy': {'LAZY_IMPORTS': '1', 'WARM_UP': '0'},
+    'lazy + warm-up': {'LAZY_IMPORTS': '1', 'WARM_UP': '1'},
+}
+STAGES = ('import', 'startup', 'first_upload', 'first_analysis', 'second_analysis', 'to_first_response')
+
+
+def child(rows):
+    started = time.perf_counter()
+    sys.path.insert(0, BACKEND)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import app as app_module
+    imported = time.perf_counter()
+
+    import tempfile
+    from fastapi.testclient import TestClient
+    from bench_stock_cache import LocalPriceSource
+    from session import SessionManager
+    from stock import StockDataCache
+    from synthetic import make_csv
+    app_module.stock_analyzer.source = LocalPriceSource()
+    app_module.stock_analyzer.cache = StockDataCache(cache_dir=None)
+    app_module.session_manager = SessionManager(session_dir=tempfile.mkdtemp(prefix='bench-startup-'))
+    payload = make_csv(rows, 10)
+    setup = time.perf_counter() - imported
+
+    timings = {'import': imported - started}
+    with TestClient(app_module.app) as client:
+        ready = time.perf_counter()
+        timings['startup'] = ready - imported - setup
+        response = client.post('/upload', files={'file': ('data.csv', payload, 'text/csv')})
+        response.raise_for_status()
+        uploaded = time.perf_counter()
+        timings['first_upload'] = uploaded - ready
+        body = {'stock_symbol': 'SYM0', 'start_date': '2000-01-01', 'end_date': '2040-01-01',
+                'methods': ['pearson', 'spearman', 'kendall'], 'min_correlation': 0.0}
+        client.post(f"/stock-analysis/{response.json()['session_id']}", json=body).raise_for_status()
+        analysed = time.perf_counter()
+        timings['first_analysis'] = analysed - uploaded
+        timings['to_first_response'] = analysed - started - setup
+        # The same request for another symbol, once everything is initialized; the download still happens
+        response = client.post('/upload', files={'file': ('data.csv', payload, 'text/csv')})
+        again = time.perf_counter()
+        client.post(f"/stock-analysis/{response.json()['session_id']}",
+                    json={**body, 'stock_symbol': 'SYM1'}).raise_for_status()
+        timings['second_analysis'] = time.perf_counter() - again
+    print(json.dumps(timings))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--rows', type=int, default=2000)
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        return child(args.rows)
+
+    print(f"{'mode':<16}" + ''.join(f'{stage:>19}' for stage in STAGES) + '   (median seconds)')
+    for mode, env in MODES.items():
+        samples = []
+        for _ in range(args.runs):
+            output = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', '--rows', str(args.rows)],
+                                    env={**os.environ, **env}, capture_output=True, text=True, check=True).stdout
+            samples.append(json.loads(output.strip().splitlines()[-1]))
+        print(f'{mode:<16}' + ''.join(f'{statistics.median(s[stage] for s in samples):>19.3f}' for stage in STAGES))
+
+
+if __name__ == '__main__':
+    main()
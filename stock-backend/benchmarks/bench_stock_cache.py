@@ -0,0 +1,75 @@
+"""Stock price cache behaviour against an offline stand-in for yfinance.
+
+Usage: python benchmarks/bench_stock_cache.py [--latency 0.3] [--symbols 20]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import zlib
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from stock import StockAnalyzer, StockDataCache
+
+
+class LocalPriceSource:
+    """Deterministic business-day random walk per symbol, with a simulated network delay"""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = []
+
+    def history(self, symbol, start_date, end_date):
+        self.calls.append((symbol, start_date, end_date))
+        time.sleep(self.latency)
+        index = pd.bdate_range(start_date, end_date, inclusive='left', tz='America/New_York', name='Date')
+        # Seed on the absolute day number so overlapping requests agree
+        days = (index.tz_localize(None) - pd.Timestamp('2000-01-01')).days.to_numpy()
+        rng = np.random.default_rng(zlib.crc32(symbol.encode()))
+        walk = np.cumsum(rng.normal(0, 1, 20000))
+        close = 100 + walk[days % len(walk)]
+        return pd.DataFrame({
+            'Open': close - 0.5, 'High': close + 1, 'Low': close - 1, 'Close': close,
+            'Volume': (1e6 + days * 10).astype(np.int64), 'Dividends': 0.0, 'Stock Splits': 0.0
+        }, index=index)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--latency', type=float, default=0.3, help='simulated seconds per source call')
+    parser.add_argument('--symbols', type=int, default=20)
+    args = parser.parse_args()
+
+    symbols = [f'SYM{i}' for i in range(args.symbols)]
+    with tempfile.TemporaryDirectory() as cache_dir:
+        source = LocalPriceSource(args.latency)
+        analyzer = StockAnalyzer(source=source, cache=StockDataCache(cache_dir=cache_dir))
+
+        def run(label, start, end):
+            calls = len(source.calls)
+            started = time.perf_counter()
+            rows = sum(len(analyzer.fetch_stock_data(s, start, end)) for s in symbols)
+            elapsed = time.perf_counter() - started
+            print(f'{label:<28} {elapsed:>8.3f}s {len(source.calls) - calls:>6} source calls {rows:>8} rows')
+
+        run('cold 2020-2022', date(2020, 1, 1), date(2022, 1, 1))
+        run('warm memory, same range', date(2020, 1, 1), date(2022, 1, 1))
+        run('warm memory, sub-range', date(2020, 6, 1), date(2021, 1, 1))
+        run('widened 2019-2023 (edges)', date(2019, 1, 1), date(2023, 1, 1))
+
+        # A fresh process only has the disk tier
+        analyzer.cache = StockDataCache(cache_dir=cache_dir)
+        run('warm disk, new process', date(2019, 1, 1), date(2023, 1, 1))
+
+        analyzer.cache = StockDataCache(cache_dir=cache_dir, ttl_minutes=0)
+        run('expired (ttl=0)', date(2019, 1, 1), date(2023, 1, 1))
+
+
+if __name__ == '__main__':
+    main()
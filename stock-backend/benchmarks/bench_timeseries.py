@@ -0,0 +1,55 @@
+"""Time-series payload size and latency: every row vs downsampled to a target point count.
+
+Usage: python benchmarks/bench_timeseries.py [--rows 2000000] [--variables 5] [--max-points 2000]
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from responses import dumps
+from visualization import VisualizationEngine
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=2_000_000)
+    parser.add_argument('--variables', type=int, default=5)
+    parser.add_argument('--max-points', type=int, default=2000)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    variables = [f'metric_{i}' for i in range(args.variables)]
+    data = pd.DataFrame(rng.normal(size=(args.rows, args.variables)).cumsum(axis=0), columns=variables)
+    data.insert(0, 'date', pd.date_range('2014-01-01', periods=args.rows, freq='min'))
+    engine = VisualizationEngine()
+
+    cases = [
+        ('full', lambda: engine.create_time_series_data(data, 'date', variables)),
+        ('minmax', lambda: engine.create_time_series_window(data, 'date', variables, max_points=args.max_points)),
+        ('lttb', lambda: engine.create_time_series_window(data, 'date', variables, max_points=args.max_points,
+                                                          downsample='lttb')),
+        ('zoom 1 week', lambda: engine.create_time_series_window(
+            data, 'date', variables, max_points=args.max_points,
+            start_date=pd.Timestamp('2015-01-01').date(), end_date=pd.Timestamp('2015-01-07').date())),
+    ]
+    print(f"{args.rows} rows x {args.variables} variables, max_points={args.max_points}")
+    print(f"{'mode':>12} {'build_s':>8} {'encode_s':>9} {'payload_MB':>11} {'points':>8}")
+    for name, build in cases:
+        start = time.perf_counter()
+        result = build()
+        built = time.perf_counter() - start
+        start = time.perf_counter()
+        payload = dumps(result)
+        encoded = time.perf_counter() - start
+        points = len(result.get('x') or result['data'][0]['x'])
+        print(f"{name:>12} {built:8.3f} {encoded:9.3f} {len(payload) / 2**20:11.2f} {points:>8}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+"""Latency under concurrent uploads and analyses, with blocking work inline vs on executors.
+
+Runs the FastAPI app in-process through httpx's ASGI transport with an offline
+stock source, so no network or server is needed (requires httpx).
+
+Usage: python benchmarks/load_test.py [--clients 8] [--rounds 3] [--rows 3000] [--columns 40]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+import httpx
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as app_module
+import concurrency
+from bench_stock_cache import LocalPriceSource
+from stock import StockDataCache
+
+
+def make_csv(rows, columns, seed=0):
+    rng = np.random.default_rng(seed)
+    frame = pd.DataFrame(rng.normal(size=(rows, columns)).cumsum(axis=0),
+                         columns=[f'metric_{i}' for i in range(columns)])
+    frame.insert(0, 'date', pd.bdate_range('2012-01-02', periods=rows).strftime('%Y-%m-%d'))
+    return frame.to_csv(index=False).encode()
+
+
+def percentile(samples, q):
+    return float(np.percentile(samples, q)) * 1000 if samples else float('nan')
+
+
+async def run_load(args, payload):
+    latencies = {'upload': [], 'stock-analysis': [], 'health': []}
+    transport = httpx.ASGITransport(app=app_module.app)
+    async with httpx.AsyncClient(transport=transport, base_url='http://test', timeout=None) as client:
+        async def timed(kind, request):
+            started = time.perf_counter()
+            response = await request
+            latencies[kind].append(time.perf_counter() - started)
+            response.raise_for_status()
+            return response.json()
+
+        async def worker(i):
+            for _ in range(args.rounds):
+                files = {'file': (f'data_{i}.csv', payload, 'text/csv')}
+                upload = await timed('upload', client.post('/upload', files=files))
+                body = {'stock_symbol': f'SYM{i}', 'start_date': '2012-01-01', 'end_date': '2024-01-01',
+                        'methods': args.methods, 'min_correlation': 0.0}
+                await timed('stock-analysis', client.post(f"/stock-analysis/{upload['session_id']}", json=body))
+
+        async def prober(done, interval=0.02):
+            # Latency is measured from when each probe was due, so time spent
+            # waiting on a blocked event loop counts against it
+            due = time.perf_counter()
+            while not done.is_set():
+                await asyncio.sleep(max(0.0, due - time.perf_counter()))
+                response = await client.get('/health')
+                latencies['health'].append(time.perf_counter() - due)
+                response.raise_for_status()
+                due = max(due + interval, time.perf_counter())
+
+        done = asyncio.Event()
+        probe = asyncio.create_task(prober(done))
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(i) for i in range(args.clients)))
+        elapsed = time.perf_counter() - started
+        done.set()
+        await probe
+    return elapsed, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--rounds', type=int, default=3)
+    parser.add_argument('--rows', type=int, default=3000)
+    parser.add_argument('--columns', type=int, default=40)
+    parser.add_argument('--methods', nargs='+', default=['pearson', 'spearman'])
+    parser.add_argument('--latency', type=float, default=0.2, help='simulated seconds per stock download')
+    args = parser.parse_args()
+
+    payload = make_csv(args.rows, args.columns)
+    # Every analysis pays the simulated download: no cache hits between clients
+    app_module.stock_analyzer.source = LocalPriceSource(args.latency)
+    app_module.stock_analyzer.cache = StockDataCache(cache_dir=None, ttl_minutes=0)
+
+    print(f"{'mode':<10} {'endpoint':<16} {'count':>6} {'p50_ms':>9} {'p99_ms':>9}")
+    for mode, sizes in (('inline', (0, 0)), ('executor', ())):
+        concurrency.configure(*sizes)
+        elapsed, latencies = asyncio.run(run_load(args, payload))
+        for kind, samples in latencies.items():
+            print(f'{mode:<10} {kind:<16} {len(samples):>6} {percentile(samples, 50):>9.1f} {percentile(samples, 99):>9.1f}')
+        print(f'{mode:<10} {"wall time":<16} {"":>6} {elapsed * 1000:>9.1f}')
+    concurrency.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+"""Stress test for session safety: hundreds of parallel uploads and analyses, checked for lost or mixed-up data.
+
+Every upload carries a fingerprint column holding its own index and a row
+count derived from it, so any session that was overwritten, lost an update or
+was served another upload's frame shows up in the checks. A second
+SessionManager on the same directory stands in for a second uvicorn worker.
+
+Runs the FastAPI app in-process through httpx's ASGI transport with an offline
+stock source (requires httpx). Exits non-zero if any check fails.
+
+Usage: python benchmarks/stress_sessions.py [--uploads 300] [--budget-mb 2]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as app_module
+import concurrency
+from bench_stock_cache import LocalPriceSource
+from session import SessionManager
+from stock import StockDataCache
+
+
+def make_upload(i):
+    rows = 20 + i % 50
+    rng = np.random.default_rng(i)
+    frame = pd.DataFrame({
+        'date': pd.bdate_range('2015-01-02', periods=rows).strftime('%Y-%m-%d'),
+        'fingerprint': i,
+        'metric': rng.normal(size=rows).cumsum()
+    })
+    return frame.to_csv(index=False).encode(), rows
+
+
+async def run_http(uploads):
+    failures = []
+    transport = httpx.ASGITransport(app=app_module.app)
+    async with httpx.AsyncClient(transport=transport, base_url='http://test', timeout=None) as client:
+        async def upload(i):
+            payload, rows = make_upload(i)
+            response = await client.post('/upload', files={'file': (f'data_{i}.csv', payload, 'text/csv')})
+            response.raise_for_status()
+            return response.json()['session_id'], rows
+
+        async def analyze(i, session_id, rows):
+            body = {'stock_symbol': f'SYM{i % 7}', 'start_date': '2014-01-01', 'end_date': '2016-01-01',
+                    'min_correlation': 0.0}
+            responses = await asyncio.gather(
+                client.post(f'/stock-analysis/{session_id}', json=body),
+                client.post(f'/visualization/{session_id}',
+                            json={'variables': ['fingerprint'], 'chart_type': 'time_series'}))
+            # After the analysis, so its merged columns must be visible
+            responses.append(await client.get(f'/data/{session_id}/info'))
+            for response in responses:
+                if response.status_code != 200:
+                    failures.append(f'{session_id}: {response.request.url.path} -> {response.status_code}')
+                    return
+            trace = responses[1].json()['data'][0]
+            if set(trace['y']) != {i} or len(trace['y']) != rows:
+                failures.append(f'{session_id}: upload {i} served another frame')
+            info = responses[2].json()
+            if info['total_rows'] != rows or 'merged_numeric_columns' not in info:
+                failures.append(f'{session_id}: upload {i} info {info}')
+
+        started = time.perf_counter()
+        sessions = await asyncio.gather(*(upload(i) for i in range(uploads)))
+        upload_time = time.perf_counter() - started
+        ids = [session_id for session_id, _ in sessions]
+        if len(set(ids)) != uploads:
+            failures.append(f'{uploads - len(set(ids))} duplicate session ids')
+
+        started = time.perf_counter()
+        await asyncio.gather(*(analyze(i, session_id, rows) for i, (session_id, rows) in enumerate(sessions)))
+        analysis_time = time.perf_counter() - started
+
+        listed = (await client.get('/sessions')).json()['sessions']
+        if {s['session_id'] for s in listed} != set(ids):
+            failures.append(f'/sessions lists {len(listed)} sessions, expected {uploads}')
+    print(f'{uploads} uploads in {upload_time:.2f}s, {uploads * 3} analysis requests in {analysis_time:.2f}s')
+    return ids, failures
+
+
+def run_updates(session_dir, session_id, writers, updates):
+    """Concurrent update_session calls on one session from two managers; none may be lost"""
+    workers = [app_module.session_manager, SessionManager(session_dir=session_dir)]
+
+    def write(w):
+        manager = workers[w % 2]
+        for u in range(updates):
+            manager.update_session(session_id, {f'note_{w}_{u}': u, f'frame_{w}': pd.DataFrame({'u': [u]})})
+
+    with ThreadPoolExecutor(writers) as pool:
+        list(pool.map(write, range(writers)))
+
+    failures = []
+    for manager in workers:
+        session = manager.get_session(session_id)
+        missing = [(w, u) for w in range(writers) for u in range(updates) if f'note_{w}_{u}' not in session]
+        if missing:
+            failures.append(f'{len(missing)} lost updates seen through {manager!r}')
+        for w in range(writers):
+            frame = session.get(f'frame_{w}')
+            if frame is None or frame['u'].tolist() != [updates - 1]:
+                failures.append(f'frame_{w} is missing or holds a stale write')
+    print(f'{writers * updates} concurrent updates to one session from {writers} threads and 2 managers')
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--uploads', type=int, default=300)
+    parser.add_argument('--budget-mb', type=int, default=2, help='small enough to force spilling')
+    parser.add_argument('--writers', type=int, default=16)
+    parser.add_argument('--updates', type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as session_dir:
+        app_module.session_manager = SessionManager(memory_budget_mb=args.budget_mb, session_dir=session_dir)
+        app_module.stock_analyzer.source = LocalPriceSource()
+        app_module.stock_analyzer.cache = StockDataCache(cache_dir=None)
+        concurrency.configure()
+        try:
+            ids, failures = asyncio.run(run_http(args.uploads))
+            failures += run_updates(session_dir, ids[0], args.writers, args.updates)
+        finally:
+            concurrency.shutdown()
+
+    for failure in failures:
+        print('FAIL', failure)
+    print('ok' if not failures else f'{len(failures)} failures')
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
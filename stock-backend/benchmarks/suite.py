@@ -0,0 +1,292 @@
+"""Benchmark suite: core classes and every endpoint on synthetic data, results written to JSON.
+
+Uploads come from synthetic.py and stock prices from LocalPriceSource, so
+runs are offline and reproducible. Each case is timed --repeat times, then
+run once more under tracemalloc for its peak Python-visible allocation
+(NumPy and pandas buffers included). Save one JSON per commit and pass an
+earlier one as --compare to see what moved.
+
+Usage: python benchmarks/suite.py [--rows 20000] [--columns 20] [--date-format iso] [--nan-ratio 0.05]
+                                  [--repeat 5] [--only stock-analysis] [--output results.json]
+                                  [--compare previous.json]
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.testclient import TestClient
+
+import app as app_module
+from analysis import CorrelationAnalyzer
+from bench_stock_cache import LocalPriceSource
+from csv_utils import CSVValidator
+from result_cache import ResultCache
+from session import SessionManager
+from stock import StockAnalyzer, StockDataCache
+from synthetic import make_csv, make_frame
+from visualization import VisualizationEngine
+from warmup import warm_up
+
+BATCH_SYMBOLS = [f'SYM{i}' for i in range(10)]
+
+
+class Case:
+    def __init__(self, name, group, run, rows, setup=None):
+        self.name = name
+        self.group = group
+        self.run = run
+        self.rows = rows
+        self.setup = setup
+
+
+def measure(case, repeat):
+    times = []
+    for _ in range(repeat):
+        if case.setup:
+            case.setup()
+        started = time.perf_counter()
+        case.run()
+        times.append(time.perf_counter() - started)
+    if case.setup:
+        case.setup()
+    tracemalloc.start()
+    try:
+        case.run()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    median = statistics.median(times)
+    return {
+        'name': case.name,
+        'group': case.group,
+        'rows': case.rows,
+        'repeat': repeat,
+        'wall_seconds': {'min': min(times), 'median': median, 'max': max(times)},
+        'throughput_rows_per_second': case.rows / median if median > 0 else None,
+        'peak_memory_mb': peak / (1024 * 1024)
+    }
+
+
+def core_cases(args, payload, frame):
+    validator = CSVValidator()
+    analyzer = CorrelationAnalyzer()
+    engine = VisualizationEngine()
+    stock = StockAnalyzer(source=LocalPriceSource(), cache=StockDataCache(cache_dir=None))
+
+    parsed = validator.validate_csv(payload)
+    if not parsed['is_valid']:
+        raise SystemExit(f"Synthetic CSV did not validate: {parsed['error']}")
+    data, dates = parsed['data'], parsed['dates']
+    columns = parsed['numeric_columns']
+    prices = stock.fetch_stock_data('SYM0', dates.min(), dates.max() + pd.Timedelta(days=1))
+    merged = stock.align_and_merge(prices, data, parsed['date_column'], dates)
+    stock_columns = ['Open', 'High', 'Low', 'Close', 'Volume']
+    custom_columns = [col for col in merged.columns if col in columns and col not in stock_columns]
+    rows = len(data)
+
+    return [
+        Case('CSVValidator.validate_csv', 'core', lambda: validator.validate_csv(payload), rows),
+        Case('StockAnalyzer.align_and_merge', 'core',
+             lambda: stock.align_and_merge(prices, data, parsed['date_column'], dates), rows),
+        Case('StockAnalyzer.align_and_merge backward', 'core',
+             lambda: stock.align_and_merge(prices, data, parsed['date_column'], dates, alignment='backward'), rows),
+        Case('CorrelationAnalyzer pearson+spearman', 'core',
+             lambda: analyzer.analyze_correlations(data, columns, ['pearson', 'spearman'], 0.0), rows),
+        Case('CorrelationAnalyzer kendall', 'core',
+             lambda: analyzer.analyze_correlations(data, columns[:8], ['kendall'], 0.0), rows),
+        Case('CorrelationAnalyzer stock x custom', 'core',
+             lambda: analyzer.analyze_correlations(merged, stock_columns, ['pearson', 'spearman'], 0.0,
+                                                   right_columns=custom_columns), len(merged)),
+        Case('CorrelationAnalyzer permutation', 'core',
+             lambda: analyzer.analyze_correlations(merged, stock_columns, ['pearson'], 0.0,
+                                                   right_columns=custom_columns[:5], significance='permutation',
+                                                   resamples=200), len(merged)),
+        Case('CorrelationAnalyzer lagged +-20', 'core',
+             lambda: analyzer.lagged_correlations(merged, stock_columns, custom_columns, range(-20, 21), 0.0),
+             len(merged)),
+        Case('CorrelationAnalyzer rolling 60', 'core',
+             lambda: analyzer.rolling_correlations(merged, stock_columns, custom_columns, 60, min_correlation=0.0),
+             len(merged)),
+        Case('VisualizationEngine matrix', 'core',
+             lambda: engine.create_correlation_matrix(data[columns]), rows),
+        Case('VisualizationEngine time series', 'core',
+             lambda: engine.create_time_series_data(data, parsed['date_column'], columns[:5]), rows),
+        Case('VisualizationEngine window minmax', 'core',
+             lambda: engine.create_time_series_window(data, parsed['date_column'], columns[:5], max_points=2000),
+             rows),
+        Case('VisualizationEngine window lttb', 'core',
+             lambda: engine.create_time_series_window(data, parsed['date_column'], columns[:5], max_points=2000,
+                                                      downsample='lttb'), rows),
+    ]
+
+
+def endpoint_cases(args, client, payload, frame):
+    response = client.post('/upload', files={'file': ('bench.csv', payload, 'text/csv')})
+    response.raise_for_status()
+    session_id = response.json()['session_id']
+    session = app_module.session_manager.get_session(session_id)
+    dates = session['dates']
+    start, end = dates.min().date().isoformat(), (dates.max() + pd.Timedelta(days=1)).date().isoformat()
+    columns = session['numeric_columns']
+    rows = len(frame)
+    analysis = {'stock_symbol': 'SYM0', 'start_date': start, 'end_date': end, 'min_correlation': 0.0}
+    tail = make_csv(250, args.columns, date_format=args.date_format, nan_ratio=args.nan_ratio, seed=1,
+                    start=(dates.max() + pd.Timedelta(days=1)).date().isoformat())
+
+    def cold():
+        # Results, merges and alignments from earlier repeats would turn the next one into a lookup
+        app_module.result_cache.invalidate(session_id)
+        app_module.stock_analyzer.alignments = ResultCache(
+            max_entries=app_module.stock_analyzer.alignments.max_entries)
+        app_module.session_manager.update_session(session_id, {'merged_request': None})
+
+    def post(path, **kwargs):
+        def run():
+            response = client.post(path, **kwargs)
+            response.raise_for_status()
+            return response.content
+        return run
+
+    def get(path):
+        def run():
+            response = client.get(path)
+            response.raise_for_status()
+            return response.content
+        return run
+
+    copies = []
+
+    def fresh_copy():
+        # Every repeat appends the same rows onto a fresh copy of the analysed session
+        while copies:
+            app_module.session_manager.delete_session(copies.pop())
+        response = client.post('/upload', files={'file': ('bench.csv', payload, 'text/csv')})
+        copies.append(response.json()['session_id'])
+        client.post(f'/stock-analysis/{copies[0]}', json=analysis).raise_for_status()
+
+    def append():
+        response = client.post(f'/upload/{copies[0]}/append', files={'file': ('tail.csv', tail, 'text/csv')})
+        response.raise_for_status()
+        return response.content
+
+    matrix = {'variables': columns, 'chart_type': 'correlation_matrix'}
+    series = {'variables': columns[:5], 'chart_type': 'time_series', 'max_points': 2000}
+    return [
+        Case('POST /upload', 'endpoint', post('/upload', files={'file': ('bench.csv', payload, 'text/csv')}), rows),
+        Case('POST /stock-analysis cold', 'endpoint', post(f'/stock-analysis/{session_id}', json=analysis), rows,
+             setup=cold),
+        Case('POST /stock-analysis cached', 'endpoint', post(f'/stock-analysis/{session_id}', json=analysis), rows),
+        Case('POST /stock-analysis lagged', 'endpoint',
+             post(f'/stock-analysis/{session_id}', json={**analysis, 'mode': 'lagged'}), rows, setup=cold),
+        Case('POST /stock-analysis rolling', 'endpoint',
+             post(f'/stock-analysis/{session_id}', json={**analysis, 'mode': 'rolling'}), rows, setup=cold),
+        Case('POST /stock-analysis permutation', 'endpoint',
+             post(f'/stock-analysis/{session_id}',
+                  json={**analysis, 'methods': ['pearson'], 'significance': 'permutation', 'resamples': 200}),
+             rows, setup=cold),
+        Case('POST /stock-analysis/batch', 'endpoint',
+             post(f'/stock-analysis/{session_id}/batch',
+                  json={'stock_symbols': BATCH_SYMBOLS, 'start_date': start, 'end_date': end,
+                        'min_correlation': 0.0}), rows * len(BATCH_SYMBOLS)),
+        Case('POST /visualization matrix', 'endpoint', post(f'/visualization/{session_id}', json=matrix), rows,
+             setup=lambda: app_module.result_cache.invalidate(session_id)),
+        Case('POST /visualization time series', 'endpoint', post(f'/visualization/{session_id}', json=series), rows,
+             setup=lambda: app_module.result_cache.invalidate(session_id)),
+        Case('POST /upload/{id}/append', 'endpoint', append, 250, setup=fresh_copy),
+        Case('GET /data/{id}/info', 'endpoint', get(f'/data/{session_id}/info'), rows),
+        Case('GET /metrics', 'endpoint', get('/metrics'), 1),
+    ]
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, previous_path):
+    with open(previous_path) as f:
+        previous = {r['name']: r for r in json.load(f)['results']}
+    print(f"\n{'case':<42} {'before_ms':>10} {'after_ms':>10} {'change':>8}")
+    for result in results:
+        before = previous.get(result['name'])
+        if before is None:
+            continue
+        old, new = before['wall_seconds']['median'], result['wall_seconds']['median']
+        print(f"{result['name']:<42} {old * 1000:>10.1f} {new * 1000:>10.1f} {(new / old - 1) * 100:>+7.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=20_000)
+    parser.add_argument('--columns', type=int, default=20)
+    parser.add_argument('--date-format', default='iso', help="iso, us, eu, datetime or a strftime pattern")
+    parser.add_argument('--nan-ratio', type=float, default=0.05)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--only', help='run only cases whose name contains this text')
+    parser.add_argument('--output', default='benchmark-results.json')
+    parser.add_argument('--compare', help='an earlier --output file to compare medians against')
+    args = parser.parse_args()
+
+    frame = make_frame(args.rows, args.columns, date_format=args.date_format, nan_ratio=args.nan_ratio,
+                       seed=args.seed)
+    payload = frame.to_csv(index=False, float_format='%.6g').encode()
+
+    # Offline prices and a throwaway session store for the app
+    app_module.stock_analyzer.source = LocalPriceSource()
+    app_module.stock_analyzer.cache = StockDataCache(cache_dir=None)
+    session_dir = tempfile.mkdtemp(prefix='bench-sessions-')
+    app_module.session_manager = SessionManager(session_dir=session_dir)
+    app_module.session_manager.on_change(app_module.result_cache.invalidate)
+
+    # Cases measure steady state; first-use costs are bench_startup.py's subject
+    warm_up()
+    results = []
+    with TestClient(app_module.app) as client:
+        cases = core_cases(args, payload, frame) + endpoint_cases(args, client, payload, frame)
+        for case in cases:
+            if args.only and args.only not in case.name:
+                continue
+            result = measure(case, args.repeat)
+            results.append(result)
+            print(f"{case.name:<42} {result['wall_seconds']['median'] * 1000:>10.1f} ms "
+                  f"{result['throughput_rows_per_second'] or 0:>14,.0f} rows/s {result['peak_memory_mb']:>8.1f} MB")
+
+    report = {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'parameters': vars(args)
+        },
+        'results': results
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'\nWrote {args.output}')
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,28 @@
+"""Deterministic synthetic uploads for the benchmarks: random-walk metrics on a date column in a chosen format."""
+import numpy as np
+import pandas as pd
+
+# Named date layouts for --date-format; anything else is used as a strftime pattern
+DATE_FORMATS = {
+    'iso': '%Y-%m-%d',
+    'us': '%m/%d/%Y',
+    'eu': '%d.%m.%Y',
+    'datetime': '%Y-%m-%d %H:%M:%S',
+}
+
+
+def make_frame(rows, columns, date_format='iso', nan_ratio=0.0, seed=0, start='2000-01-03', freq='B',
+               date_column='date') -> pd.DataFrame:
+    """rows business days (by default) of columns random walks, nan_ratio of the cells blanked at random"""
+    rng = np.random.default_rng(seed)
+    values = rng.normal(size=(rows, columns)).cumsum(axis=0)
+    if nan_ratio:
+        values[rng.random(values.shape) < nan_ratio] = np.nan
+    frame = pd.DataFrame(values, columns=[f'metric_{i}' for i in range(columns)])
+    dates = pd.date_range(start, periods=rows, freq=freq)
+    frame.insert(0, date_column, dates.strftime(DATE_FORMATS.get(date_format, date_format)))
+    return frame
+
+
+def make_csv(rows, columns, **kwargs) -> bytes:
+    return make_frame(rows, columns, **kwargs).to_csv(index=False, float_format='%.6g').encode()
@@ -0,0 +1,74 @@
+import asyncio
+import contextvars
+import multiprocessing
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from functools import partial
+from config import ANALYSIS_WORKERS, FETCH_WORKERS, PROCESS_POOL_WORKERS
+from metrics import profiled
+
+# Threads rather than processes: session frames live in this process and the
+# heavy pandas/NumPy/SciPy kernels release the GIL, so nothing has to be pickled.
+_executors = {}
+_process_pool = None
+_process_pool_lock = threading.Lock()
+
+
+def configure(analysis_workers=ANALYSIS_WORKERS, fetch_workers=FETCH_WORKERS):
+    """(Re)create the pools. A size of 0 runs that kind of work inline on the event loop."""
+    shutdown()
+    _executors['analysis'] = (ThreadPoolExecutor(analysis_workers, thread_name_prefix='analysis')
+                              if analysis_workers else None)
+    _executors['fetch'] = (ThreadPoolExecutor(fetch_workers, thread_name_prefix='fetch')
+                           if fetch_workers else None)
+
+
+def shutdown():
+    global _process_pool
+    for executor in _executors.values():
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+    _executors.clear()
+    with _process_pool_lock:
+        if _process_pool is not None:
+            _process_pool.shutdown(wait=False, cancel_futures=True)
+            _process_pool = None
+
+
+def process_pool():
+    """Process pool shared by the Kendall and resampling paths, started on first use.
+
+    Workers come from a forkserver rather than a fork of this process: the
+    server is multithreaded, and a fork can copy a lock some other thread
+    holds, deadlocking the child. The forkserver imports the analysis
+    module once, so each worker starts from that instead of a cold import.
+    """
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            context = multiprocessing.get_context('forkserver')
+            context.set_forkserver_preload(['analysis'])
+            _process_pool = ProcessPoolExecutor(max_workers=PROCESS_POOL_WORKERS, mp_context=context)
+        return _process_pool
+
+
+async def run_analysis(func, *args, **kwargs):
+    """Run CPU-bound work (parsing, merging, correlations) on the bounded analysis pool"""
+    return await _run('analysis', func, *args, **kwargs)
+
+
+async def run_fetch(func, *args, **kwargs):
+    """Run blocking I/O (stock downloads, session reads and writes) on the fetch pool"""
+    return await _run('fetch', func, *args, **kwargs)
+
+
+async def _run(kind, func, *args, **kwargs):
+    if kind not in _executors:
+        configure()
+    executor = _executors[kind]
+    func = profiled(func)
+    if executor is None:
+        return func(*args, **kwargs)
+    # Pool threads see the caller's context variables, e.g. the background job reporting progress
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(executor, partial(context.run, func, *args, **kwargs))
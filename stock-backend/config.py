@@ -1,6 +1,47 @@
+import os
+import tempfile
+from dotenv import load_dotenv
+
+# Before any setting below is read, so .env can set them too
+load_dotenv()
+
 MAX_FILE_SIZE = 50 * 1024 * 1024  # 50MB
 SUPPORTED_FILE_TYPES = ['.csv']
 DEFAULT_CORRELATION_METHODS = ['pearson', 'spearman']
 MIN_DATA_POINTS = 10
 SESSION_TIMEOUT_HOURS = 24
-STOCK_DATA_CACHE_MINUTES = 15
\ No newline at end of file
+STOCK_DATA_CACHE_MINUTES = 15
+PROCESS_POOL_WORKERS = min(4, os.cpu_count() or 1)  # Kendall and resampling workers
+KENDALL_PARALLEL_MIN_WORK = 5_000_000  # rows x pairs before Kendall moves to a process pool
+KENDALL_BATCHED_MAX_ROWS = 10_000  # longer columns go pair by pair through scipy, whose O(n log n) wins there
+STOCK_CACHE_MAX_SYMBOLS = 64
+STOCK_CACHE_DIR = os.getenv("STOCK_CACHE_DIR", os.path.join(tempfile.gettempdir(), "stock-influence-cache"))
+STOCK_CACHE_MAX_DISK_MB = int(os.getenv("STOCK_CACHE_MAX_DISK_MB", 256))  # least recently used symbols go first
+ANALYSIS_WORKERS = int(os.getenv("ANALYSIS_WORKERS", min(4, os.cpu_count() or 1)))  # 0 = run inline
+FETCH_WORKERS = int(os.getenv("FETCH_WORKERS", 16))  # concurrent stock downloads, 0 = run inline
+CSV_CHUNK_ROWS = 100_000
+CSV_ENCODING_SAMPLE_BYTES = 64 * 1024
+DATE_SAMPLE_ROWS = 200
+SESSION_MEMORY_BUDGET_MB = int(os.getenv("SESSION_MEMORY_BUDGET_MB", 512))  # resident session frames
+SESSION_DIR = os.getenv("SESSION_DIR", os.path.join(tempfile.gettempdir(), "stock-influence-sessions"))
+SESSION_CLEANUP_INTERVAL_SECONDS = 300
+RESULT_CACHE_MAX_ENTRIES = 256
+RESULT_CACHE_MAX_MB = 256  # merged frames kept with cached stock analyses
+SERIES_CHUNK_ELEMENTS = 1 << 20  # float64 scratch per lagged/rolling correlation pass
+MAX_CORRELATION_LAG = 1000  # rows either way
+MAX_ROLLING_WINDOW = 100_000  # rows; a window can never usefully exceed the merged rows anyway
+RESAMPLE_BATCH = 250  # resamples per seed, so results do not depend on the worker count
+RESAMPLE_PARALLEL_MIN_WORK = 50_000_000  # resamples x rows x pairs before resampling moves to the pool
+ALIGNMENT_CACHE_ENTRIES = 256  # session x symbol date alignments kept by StockAnalyzer
+ALIGNMENT_CACHE_MAX_MB = 64
+# Seconds; upper bounds of the request and stage latency histograms on /metrics
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+PROFILE_REQUESTS = os.getenv("PROFILE_REQUESTS", "0") == "1"  # allow the X-Profile request header
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(tempfile.gettempdir(), "stock-influence-profiles"))
+LAZY_IMPORTS = os.getenv("LAZY_IMPORTS", "1") == "1"  # SciPy and yfinance load on first use, not at startup
+WARM_UP = os.getenv("WARM_UP", "0") == "1"  # exercise the hot paths before the worker starts serving
+MATRIX_TILE_COLUMNS = 128  # columns per tile of a correlation matrix; bounds its working set to rows x 2 tiles
+MATRIX_MAX_CELLS = 1_000_000  # full matrices beyond this many cells must be asked for as top_k
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 2))  # background jobs running at once; the rest queue
+JOB_HISTORY = 256  # finished jobs whose status stays in memory; results also persist with their session
+JOIN_MAX_DATASETS = 32  # sessions plus tickers joined by one /cross-correlation request
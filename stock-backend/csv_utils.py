@@ -1,102 +1,186 @@
 import pandas as pd
+import numpy as np
+import codecs
 import io
-from config import MAX_FILE_SIZE
+import os
+from metrics import span, record_error
+from dates import infer_date_format, parse_dates, normalize_dates
+from config import MAX_FILE_SIZE, CSV_CHUNK_ROWS, CSV_ENCODING_SAMPLE_BYTES
+
+
+def _compact(values: np.ndarray) -> np.ndarray:
+    """Smallest dtype that holds the values exactly: downcast ints, float32 when lossless"""
+    if values.dtype.kind == 'i' and len(values):
+        for dtype in (np.int8, np.int16, np.int32):
+            info = np.iinfo(dtype)
+            if info.min <= values.min() and values.max() <= info.max:
+                return values.astype(dtype)
+    elif values.dtype == np.float64:
+        narrow = values.astype(np.float32)
+        if np.array_equal(narrow, values, equal_nan=True):
+            return narrow
+    return values
 
 class CSVValidator:
     date_patterns = ['date', 'time', 'timestamp', 'day', 'month', 'year', 'created', 'updated']
 
-    def validate_csv(self, file_content: bytes) -> dict:
+    encodings = ['utf-8', 'latin-1', 'cp1252']
+
+    @span('csv.validate')
+    def validate_csv(self, source, min_rows=10) -> dict:
+        """Validate and load a CSV from a path, a binary file object (e.g. a spooled upload) or bytes.
+
+        The file is parsed in chunks of CSV_CHUNK_ROWS rows and coerced chunk by
+        chunk, so peak memory stays close to the size of the final frame.
+        Appends to an existing session pass a lower min_rows.
+        """
         try:
-            # Check file size
-            if len(file_content) > MAX_FILE_SIZE:
-                return {
-                    'is_valid': False, 
-                    'error': f'File size exceeds maximum limit of {MAX_FILE_SIZE // (1024*1024)}MB'
-                }
-            
-            # Try different encodings
-            encodings = ['utf-8', 'latin-1', 'cp1252']
-            df = None
-            
-            for encoding in encodings:
-                try:
-                    df = pd.read_csv(io.BytesIO(file_content), encoding=encoding)
-                    break
-                except UnicodeDecodeError:
-                    continue
-                except Exception as e:
-                    continue
-            
-            if df is None:
-                return {'is_valid': False, 'error': 'Could not read CSV file with any supported encoding'}
-            
-            # Basic validation
-            if df.empty:
-                return {'is_valid': False, 'error': 'CSV file is empty'}
-            
-            if len(df.columns) < 2:
-                return {'is_valid': False, 'error': 'CSV must have at least 2 columns'}
-            
-            # Clean column names (remove whitespace)
-            df.columns = df.columns.str.strip()
-            
-            # Detect date column
-            date_column = self._detect_date_column(df)
-            if not date_column:
-                return {'is_valid': False, 'error': 'No valid date column detected. Column names should contain: date, time, timestamp, etc.'}
-            
-            # Convert and validate date column
-            original_length = len(df)
-            df[date_column] = pd.to_datetime(df[date_column], errors='coerce')
-            df = df.dropna(subset=[date_column])
-            
-            if df.empty:
-                return {'is_valid': False, 'error': 'No valid dates found in date column'}
-            
-            
-            # Identify numeric columns
-            numeric_columns = []
-            for col in df.columns:
-                if col != date_column:
-                    # Try to convert to numeric
-                    numeric_series = pd.to_numeric(df[col], errors='coerce')
-                    if not numeric_series.isna().all():  # At least some valid numeric values
-                        df[col] = numeric_series
-                        numeric_columns.append(col)
-            
-            if not numeric_columns:
-                return {'is_valid': False, 'error': 'No numeric variables found for analysis'}
-            
-            # Sort by date
-            df = df.sort_values(date_column).reset_index(drop=True)
-            
-            # Check for minimum data requirements
-            if len(df) < 10:
-                return {'is_valid': False, 'error': 'Need at least 10 valid data points for analysis'}
-            
-            
+            if isinstance(source, (bytes, bytearray)):
+                handle = io.BytesIO(source)
+            elif isinstance(source, (str, os.PathLike)):
+                handle = open(source, 'rb')
+            else:
+                handle = source
+            try:
+                return self._validate_handle(handle, min_rows)
+            finally:
+                if handle is not source:
+                    handle.close()
+        except Exception as e:
+            record_error('csv.validate', 'Error processing CSV')
+            return {'is_valid': False, 'error': f'Error processing CSV: {str(e)}'}
+
+    def _validate_handle(self, handle, min_rows) -> dict:
+        # Check file size
+        handle.seek(0, os.SEEK_END)
+        if handle.tell() > MAX_FILE_SIZE:
             return {
-                'is_valid': True,
-                'data': df,
-                'date_column': date_column,
-                'numeric_columns': numeric_columns,
-                'total_rows': len(df),
-                'original_rows': original_length,
-                'data_quality': {
-                    'date_coverage': len(df) / original_length,
-                    'numeric_columns_found': len(numeric_columns),
-                    'date_range': {
-                        'start': df[date_column].min().strftime('%Y-%m-%d'),
-                        'end': df[date_column].max().strftime('%Y-%m-%d')
-                    }
+                'is_valid': False, 
+                'error': f'File size exceeds maximum limit of {MAX_FILE_SIZE // (1024*1024)}MB'
+            }
+        handle.seek(0)
+        sample = handle.read(CSV_ENCODING_SAMPLE_BYTES)
+
+        # Pick the encoding from a sample; fall back to the next one only if a
+        # later chunk turns out not to decode
+        parsed = None
+        for encoding in self._candidate_encodings(sample):
+            try:
+                handle.seek(0)
+                parsed = self._read_chunks(handle, encoding)
+                break
+            except UnicodeDecodeError:
+                continue
+            except Exception:
+                record_error('csv.parse', f'Could not parse CSV as {encoding}')
+                continue
+
+        if parsed is None:
+            return {'is_valid': False, 'error': 'Could not read CSV file with any supported encoding'}
+        if isinstance(parsed, str):
+            return {'is_valid': False, 'error': parsed}
+        df, date_column, date_format, original_length = parsed
+
+        if df.empty:
+            return {'is_valid': False, 'error': 'No valid dates found in date column'}
+
+        numeric_columns = [col for col in df.columns if col != date_column]
+        if not numeric_columns:
+            return {'is_valid': False, 'error': 'No numeric variables found for analysis'}
+
+        # Check for minimum data requirements
+        if len(df) < min_rows:
+            return {'is_valid': False, 'error': f'Need at least {min_rows} valid data points for analysis'}
+
+
+        return {
+            'is_valid': True,
+            'data': df,
+            'date_column': date_column,
+            'date_format': date_format,
+            # Calendar dates for aligning with stock data, parsed here once
+            'dates': normalize_dates(df[date_column]),
+            'numeric_columns': numeric_columns,
+            'total_rows': len(df),
+            'original_rows': original_length,
+            'data_quality': {
+                'date_coverage': len(df) / original_length,
+                'numeric_columns_found': len(numeric_columns),
+                'date_range': {
+                    'start': df[date_column].min().strftime('%Y-%m-%d'),
+                    'end': df[date_column].max().strftime('%Y-%m-%d')
                 }
             }
-            
-        except Exception as e:
-            return {'is_valid': False, 'error': f'Error processing CSV: {str(e)}'}
+        }
+
+    def _candidate_encodings(self, sample: bytes):
+        for i, encoding in enumerate(self.encodings):
+            try:
+                # Incremental decode so a multi-byte character cut at the end of the sample is fine
+                codecs.getincrementaldecoder(encoding)().decode(sample, final=False)
+                return self.encodings[i:]
+            except UnicodeDecodeError:
+                continue
+        return []
+
+    @span('csv.parse')
+    def _read_chunks(self, handle, encoding):
+        """Parse and coerce chunk by chunk.
+
+        Returns (frame, date_column, date_format, raw_rows), or an error message for
+        problems with the file's shape or content.
+        """
+        date_column = None
+        columns = None
+        dates, values = [], {}
+        original_length = 0
+        for chunk in pd.read_csv(handle, encoding=encoding, chunksize=CSV_CHUNK_ROWS):
+            if columns is None:
+                # Clean column names (remove whitespace)
+                columns = chunk.columns.str.strip()
+                if len(columns) < 2:
+                    return 'CSV must have at least 2 columns'
+                chunk.columns = columns
+                # Detect date column and its format from the first chunk
+                date_column, date_format, chunk_dates = self._detect_date_column(chunk)
+                if not date_column:
+                    return 'No valid date column detected. Column names should contain: date, time, timestamp, etc.'
+                values = {col: [] for col in columns if col != date_column}
+            else:
+                chunk.columns = columns
+                # Later chunks reuse the format, so inference runs only once
+                chunk_dates = parse_dates(chunk[date_column], date_format)
+            original_length += len(chunk)
+
+            # Drop rows without a valid date
+            valid = chunk_dates.notna().to_numpy()
+            dates.append(chunk_dates.to_numpy()[valid])
+            for col in values:
+                values[col].append(pd.to_numeric(chunk[col], errors='coerce').to_numpy()[valid])
 
-    def _detect_date_column(self, df: pd.DataFrame) -> str:
-        """Detect date column with improved pattern matching and validation"""
+        if columns is None or original_length == 0:
+            return 'CSV file is empty'
+
+        # Sort by date while assembling, one column at a time, so only a single
+        # column is ever held twice
+        dates = np.concatenate(dates)
+        order = np.argsort(dates, kind='stable')
+        data = {date_column: dates[order]}
+        del dates
+        for col in list(values):
+            column = np.concatenate(values.pop(col))
+            # Identify numeric columns (at least some valid numeric values); the rest is dropped
+            if column.dtype.kind != 'f' or not np.isnan(column).all():
+                data[col] = _compact(column[order])
+        return pd.DataFrame(data, copy=False), date_column, date_format, original_length
+
+    @span('csv.dates')
+    def _detect_date_column(self, df: pd.DataFrame):
+        """Detect date column with improved pattern matching and validation.
+
+        Returns (column, format, parsed values) so the chosen column is parsed
+        once, or (None, None, None) when nothing looks like a date.
+        """
         potential_date_columns = []
         
         # First, check for obvious date patterns in column names
@@ -112,21 +196,27 @@ class CSVValidator:
                     # Try to convert first few non-null values
                     sample = df[col].dropna().head(10)
                     if len(sample) > 0:
-                        converted = pd.to_datetime(sample, errors='coerce')
+                        converted = parse_dates(sample, infer_date_format(sample))
                         if not converted.isna().all():  # At least some valid dates
                             potential_date_columns.append(col)
-                except:
+                except Exception:
                     continue
         
         # Validate and select best date column
+        parsed = {}
         for col in potential_date_columns:
             try:
-                converted = pd.to_datetime(df[col], errors='coerce')
+                date_format = infer_date_format(df[col])
+                converted = parse_dates(df[col], date_format)
+                parsed[col] = (date_format, converted)
                 valid_ratio = converted.notna().sum() / len(df)
                 if valid_ratio > 0.8:  # At least 80% valid dates
-                    return col
-            except:
+                    return col, date_format, converted
+            except Exception:
                 continue
         
         # If still no good column found, return the first potential one
-        return potential_date_columns[0] if potential_date_columns else None
\ No newline at end of file
+        for col in potential_date_columns:
+            if col in parsed:
+                return (col,) + parsed[col]
+        return None, None, None
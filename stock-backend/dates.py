@@ -0,0 +1,62 @@
+import warnings
+import numpy as np
+import pandas as pd
+from pandas.tseries.api import guess_datetime_format
+from config import DATE_SAMPLE_ROWS
+
+
+def infer_date_format(values: pd.Series, sample_rows=DATE_SAMPLE_ROWS):
+    """strftime format that parses most of a sample of values, or None if there is no text to guess from.
+
+    Candidates are guessed from every distinct sampled value both month-first
+    and day-first, so '1/2/2020' alongside '13/2/2020' settles on day-first.
+    Ties go to the earlier candidate, which is what pandas itself would pick.
+    """
+    sample = values.dropna()
+    if not (pd.api.types.is_object_dtype(sample) or pd.api.types.is_string_dtype(sample)):
+        return None
+    if len(sample) > sample_rows:
+        # Spread the sample over the column: the first rows alone are often all day <= 12
+        sample = sample.iloc[np.linspace(0, len(sample) - 1, sample_rows).astype(int)]
+    sample = sample.astype(str).str.strip()
+    candidates = []
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', UserWarning)
+        for value in sample.unique():
+            for dayfirst in (False, True):
+                fmt = guess_datetime_format(value, dayfirst=dayfirst)
+                if fmt and fmt not in candidates:
+                    candidates.append(fmt)
+
+    best, best_count = None, 0
+    for fmt in candidates:
+        count = pd.to_datetime(sample, format=fmt, errors='coerce').notna().sum()
+        if count > best_count:
+            best, best_count = fmt, count
+            if count == len(sample):
+                break
+    return best
+
+
+def parse_dates(values: pd.Series, date_format=None) -> pd.Series:
+    """Parse with an explicit format when one is known; already parsed values pass straight through.
+
+    Unparseable values become NaT. Timezone-aware results keep their wall time
+    and drop the zone, matching how the stock data is aligned.
+    """
+    if pd.api.types.is_datetime64_any_dtype(values):
+        parsed = values
+    elif date_format is not None:
+        parsed = pd.to_datetime(values, format=date_format, errors='coerce')
+    else:
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', UserWarning)
+            parsed = pd.to_datetime(values, errors='coerce')
+    if isinstance(parsed.dtype, pd.DatetimeTZDtype):
+        parsed = parsed.dt.tz_localize(None)
+    return parsed
+
+
+def normalize_dates(dates: pd.Series) -> pd.Series:
+    """Parse to naive calendar dates (local wall time, midnight) so stock and custom rows line up"""
+    return parse_dates(dates).dt.normalize()
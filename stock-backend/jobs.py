@@ -0,0 +1,201 @@
+import asyncio
+import secrets
+import threading
+from collections import OrderedDict
+from datetime import datetime
+import orjson
+from fastapi import HTTPException
+from metrics import Counter, record_error
+from progress import current, JobCancelled
+from responses import dumps
+from concurrency import run_fetch
+from config import JOB_WORKERS, JOB_HISTORY
+
+JOBS = Counter('jobs_total', 'Background jobs by kind and final status', ('kind', 'status'))
+
+
+class Job:
+    def __init__(self, session_id, kind, params):
+        # Same shape as session ids: readable time, random part for uniqueness
+        self.id = f"job_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{secrets.token_hex(8)}"
+        self.session_id = session_id
+        self.kind = kind
+        self.params = params
+        self.status = 'queued'
+        self.created_at = datetime.now()
+        self.started_at = self.finished_at = None
+        self.done = self.total = 0
+        self.error = self.status_code = None
+        self.result = None
+        self.persisted = False
+        self.task = None
+        self._cancelled = threading.Event()
+        # Progress is reported from analysis threads
+        self._lock = threading.Lock()
+
+    @property
+    def finished(self):
+        return self.status not in ('queued', 'running')
+
+    def expect(self, pairs):
+        with self._lock:
+            self.total += int(pairs)
+
+    def advance(self, pairs):
+        with self._lock:
+            self.done += int(pairs)
+        if self._cancelled.is_set():
+            raise JobCancelled(self.id)
+
+    def cancel(self):
+        self._cancelled.set()
+        if self.task is not None and not self.task.done():
+            # Sessions are deleted from pool threads, so go through the loop
+            self.task.get_loop().call_soon_threadsafe(self.task.cancel)
+
+    def finish(self, status, result=None, error=None, status_code=None):
+        self.status = status
+        self.result = result
+        self.error = error
+        self.status_code = status_code
+        self.finished_at = datetime.now()
+        JOBS.inc(kind=self.kind, status=status)
+
+    def record(self):
+        """Status for the API, without the result"""
+        with self._lock:
+            done, total = self.done, self.total
+        fraction = 1.0 if self.status == 'done' else min(done / total, 1.0) if total else 0.0
+        return {
+            'job_id': self.id,
+            'session_id': self.session_id,
+            'kind': self.kind,
+            'status': self.status,
+            'params': self.params,
+            'progress': {'pairs_done': min(done, total), 'pairs_total': total, 'fraction': fraction},
+            'created_at': self.created_at.isoformat(),
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+            'error': self.error,
+            'status_code': self.status_code
+        }
+
+
+class JobManager:
+    """Background jobs for analyses that would outlive a proxy's request timeout.
+
+    A job is an asyncio task in this process running the same coroutine as
+    the synchronous endpoint; at most ``workers`` run at once and the rest
+    wait their turn, while the CPU work still goes through the analysis
+    pool. Analysis code reports pairs done through progress.expect() and
+    progress.advance(), which is also where a cancelled job stops.
+    Finished jobs, results included, are written next to their session
+    with SessionManager.save_job, so they outlive restarts and other
+    workers can read them; queued and running jobs are only known to the
+    worker that accepted them.
+    """
+
+    def __init__(self, session_manager, workers=JOB_WORKERS, history=JOB_HISTORY):
+        self.session_manager = session_manager
+        self.workers = workers
+        self.history = history
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        # Created inside the running loop on first use
+        self._slots = None
+        session_manager.on_change(self._session_changed)
+
+    def submit(self, session_id, kind, params, compute) -> Job:
+        """Run compute(), a coroutine function returning the response content, as a job of session_id"""
+        job = Job(session_id, kind, params)
+        job.task = asyncio.ensure_future(self._run(job, compute))
+        with self._lock:
+            self._jobs[job.id] = job
+            finished = [job_id for job_id, old in self._jobs.items() if old.finished]
+            for job_id in finished[:max(0, len(self._jobs) - self.history)]:
+                del self._jobs[job_id]
+        return job
+
+    def get(self, session_id, job_id):
+        """The job's status record, from memory or from the session's saved jobs, or None"""
+        job = self._jobs.get(job_id)
+        if job is not None:
+            return job.record() if job.session_id == session_id else None
+        saved = self._load(session_id, job_id)
+        if saved is None:
+            return None
+        saved.pop('result', None)
+        return saved
+
+    def result(self, session_id, job_id):
+        """(status record, result content) of the job, or None when it is unknown"""
+        job = self._jobs.get(job_id)
+        if job is not None and job.session_id == session_id and not job.persisted:
+            return job.record(), job.result
+        saved = self._load(session_id, job_id)
+        if saved is None:
+            return None
+        return saved, saved.pop('result', None)
+
+    def list(self, session_id):
+        """Status records of the session's jobs, oldest first"""
+        records = {job_id: self.get(session_id, job_id) for job_id in self.session_manager.list_jobs(session_id)}
+        with self._lock:
+            jobs = [job for job in self._jobs.values() if job.session_id == session_id]
+        for job in jobs:
+            records[job.id] = job.record()
+        return sorted((r for r in records.values() if r is not None), key=lambda r: r['created_at'])
+
+    def cancel(self, session_id, job_id):
+        """Cancel a queued or running job; its status record, or None when it is unknown"""
+        job = self._jobs.get(job_id)
+        if job is None or job.session_id != session_id:
+            return self.get(session_id, job_id)
+        if not job.finished:
+            job.cancel()
+        return job.record()
+
+    async def _run(self, job, compute):
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.workers)
+        try:
+            async with self._slots:
+                job.status = 'running'
+                job.started_at = datetime.now()
+                # Each task runs in its own copy of the context, and run_analysis carries it into the pool
+                current.set(job)
+                result = await compute()
+        except (JobCancelled, asyncio.CancelledError):
+            job.finish('cancelled')
+        except HTTPException as e:
+            job.finish('failed', error=e.detail, status_code=e.status_code)
+        except Exception as e:
+            record_error('jobs.run', f"Job {job.id} failed")
+            job.finish('failed', error=str(e), status_code=500)
+        else:
+            job.finish('done', result=result)
+        try:
+            job.persisted = await run_fetch(self._save, job)
+        except Exception:
+            record_error('jobs.save', f"Could not save job {job.id}")
+        if job.persisted:
+            # Read back from the session directory when asked for
+            job.result = None
+
+    def _save(self, job):
+        return self.session_manager.save_job(job.session_id, job.id, dumps({**job.record(), 'result': job.result}))
+
+    def _load(self, session_id, job_id):
+        payload = self.session_manager.load_job(session_id, job_id)
+        return orjson.loads(payload) if payload is not None else None
+
+    def _session_changed(self, session_id, keys):
+        if keys is not None:
+            return
+        # Deleted session: its saved jobs went with its directory
+        with self._lock:
+            jobs = [job for job in self._jobs.values() if job.session_id == session_id]
+            for job in jobs:
+                del self._jobs[job.id]
+        for job in jobs:
+            job.cancel()
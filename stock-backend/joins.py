@@ -0,0 +1,60 @@
+import numpy as np
+import pandas as pd
+from metrics import span
+from stock import _as_ns, NAT_NS
+
+
+def _daily_rows(dates_ns: np.ndarray, values: np.ndarray):
+    """Sorted distinct dates and one row of values per date; rows sharing a date are averaged, ignoring NaN"""
+    keep = dates_ns != NAT_NS
+    dates_ns, values = dates_ns[keep], values[keep]
+    if not np.all(dates_ns[1:] >= dates_ns[:-1]):
+        order = np.argsort(dates_ns, kind='stable')
+        dates_ns, values = dates_ns[order], values[order]
+    days, starts = np.unique(dates_ns, return_index=True)
+    if len(days) == len(dates_ns):
+        return days, values
+    valid = ~np.isnan(values)
+    sums = np.add.reduceat(np.where(valid, values, 0.0), starts, axis=0)
+    counts = np.add.reduceat(valid, starts, axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return days, sums / counts
+
+
+def shared_dates(dates, how='inner') -> pd.DatetimeIndex:
+    """Sorted date index of several normalized date series: the dates all of them have, or any of them has"""
+    days = [np.unique(ns[ns != NAT_NS]) for ns in map(_as_ns, dates)]
+    if how == 'inner':
+        index = days[0]
+        for other in days[1:]:
+            index = np.intersect1d(index, other, assume_unique=True)
+    else:
+        index = np.unique(np.concatenate(days))
+    return pd.DatetimeIndex(index.view('datetime64[ns]'), name='date')
+
+
+@span('datasets.join')
+def join_on_dates(index: pd.DatetimeIndex, datasets) -> pd.DataFrame:
+    """Frame of 'date' plus every dataset's columns on index, named 'label:column'.
+
+    datasets are (label, dates, frame) with dates the normalized date of each
+    frame row. Each one is reduced to a row per date and scattered by
+    binary search into a single preallocated array, so the join costs one
+    pass per dataset and the result rows x total columns, where chained
+    pd.merge calls would copy the growing frame once per dataset. Dates a
+    dataset lacks stay NaN, which the pairwise-complete correlations skip.
+    """
+    index_ns = _as_ns(index)
+    names = [f'{label}:{col}' for label, _, frame in datasets for col in frame.columns]
+    values = np.full((len(index_ns), len(names)), np.nan)
+    offset = 0
+    for label, dates, frame in datasets:
+        days, rows = _daily_rows(_as_ns(dates), frame.to_numpy(dtype=np.float64, na_value=np.nan))
+        positions = np.searchsorted(index_ns, days)
+        found = positions < len(index_ns)
+        found[found] = index_ns[positions[found]] == days[found]
+        values[positions[found], offset:offset + frame.shape[1]] = rows[found]
+        offset += frame.shape[1]
+    joined = pd.DataFrame(values, columns=names, copy=False)
+    joined.insert(0, 'date', index)
+    return joined
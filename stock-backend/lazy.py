@@ -0,0 +1,31 @@
+import importlib
+from config import LAZY_IMPORTS
+
+_modules = []
+
+
+class LazyModule:
+    """Stands in for a heavy module and imports it on first attribute access.
+
+    With LAZY_IMPORTS off the import happens here instead, so both startup
+    modes use the same names. importlib's own locks make the first access
+    safe from several worker threads at once.
+    """
+
+    def __init__(self, name, lazy=LAZY_IMPORTS):
+        self._name = name
+        _modules.append(name)
+        if not lazy:
+            importlib.import_module(name)
+
+    def __getattr__(self, attr):
+        return getattr(importlib.import_module(self._name), attr)
+
+    def __repr__(self):
+        return f'<lazy module {self._name!r}>'
+
+
+def import_deferred():
+    """Import every module that is still deferred, e.g. while warming up"""
+    for name in _modules:
+        importlib.import_module(name)
@@ -0,0 +1,233 @@
+import cProfile
+import contextvars
+import logging
+import os
+import pstats
+import secrets
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+from config import LATENCY_BUCKETS, PROFILE_REQUESTS, PROFILE_DIR
+
+logger = logging.getLogger('stock_backend')
+
+
+def _labels(names, values) -> str:
+    if not names:
+        return ''
+    pairs = ','.join('{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                     for name, value in zip(names, values))
+    return '{' + pairs + '}'
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels):
+        return tuple(labels[name] for name in self.label_names)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_labels(self.label_names, key)} {value!r}')
+        return lines
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """A value that goes up and down; kind='counter' mirrors a total kept elsewhere (e.g. cache hits)"""
+
+    def __init__(self, name, help, labels=(), kind='gauge'):
+        super().__init__(name, help, labels)
+        self.kind = kind
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                # Per-bucket counts (the last one is +Inf), made cumulative on render
+                series = self._values[key] = {'counts': [0] * (len(self.buckets) + 1), 'sum': 0.0}
+            series['counts'][bisect_left(self.buckets, value)] += 1
+            series['sum'] += value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        names = self.label_names + ('le',)
+        with self._lock:
+            for key, series in sorted(self._values.items()):
+                total = 0
+                for bound, count in zip(self.buckets + ('+Inf',), series['counts']):
+                    total += count
+                    lines.append(f'{self.name}_bucket{_labels(names, key + (bound,))} {total}')
+                lines.append(f'{self.name}_sum{_labels(self.label_names, key)} {series["sum"]!r}')
+                lines.append(f'{self.name}_count{_labels(self.label_names, key)} {total}')
+        return lines
+
+
+_registry = []
+_collectors = []
+
+REQUEST_SECONDS = Histogram('http_request_duration_seconds', 'Time from request to last response byte',
+                            ('method', 'route', 'status'))
+REQUESTS_IN_FLIGHT = Gauge('http_requests_in_flight', 'Requests being handled')
+STAGE_SECONDS = Histogram('stage_duration_seconds', 'Time spent in each stage of request handling', ('stage',))
+STAGE_ERRORS = Counter('stage_errors_total', 'Errors raised or handled inside a stage', ('stage',))
+
+
+@contextmanager
+def span(stage):
+    """Time a block (or, as a decorator, a function) into stage_duration_seconds; exceptions are counted and re-raised"""
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        STAGE_ERRORS.inc(stage=stage)
+        raise
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage=stage)
+
+
+def record_error(stage, message):
+    """For except blocks that recover: count the error against stage and log it with its traceback"""
+    STAGE_ERRORS.inc(stage=stage)
+    logger.exception(message)
+
+
+def on_collect(callback):
+    """Call callback() before every scrape, to set gauges from state kept elsewhere"""
+    _collectors.append(callback)
+
+
+def render() -> str:
+    """All metrics in the Prometheus text exposition format"""
+    for callback in _collectors:
+        try:
+            callback()
+        except Exception:
+            record_error('metrics.collect', 'Metrics collector failed')
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+# Per-request profiling: the profiles of every call a request hands to the worker
+# pools, merged and dumped once the response is sent
+_profiles = contextvars.ContextVar('profiles', default=None)
+
+
+def profiled(func):
+    """func, run under cProfile when the current request is being profiled"""
+    profiles = _profiles.get()
+    if profiles is None:
+        return func
+
+    @wraps(func)
+    def run(*args, **kwargs):
+        profile = cProfile.Profile()
+        try:
+            return profile.runcall(func, *args, **kwargs)
+        finally:
+            profiles.append(profile)
+    return run
+
+
+class MetricsMiddleware:
+    """ASGI middleware for request latency, in-flight count and the opt-in profiler.
+
+    Latency runs until the last body chunk is sent, so streamed responses
+    count in full. Routes are labelled by their template, not the raw path,
+    to keep session ids out of the label set. With PROFILE_REQUESTS on, a
+    request carrying ``X-Profile: 1`` gets an ``X-Profile-Path`` header
+    naming the pstats file written for it.
+    """
+
+    def __init__(self, app, profile_requests=PROFILE_REQUESTS, profile_dir=PROFILE_DIR):
+        self.app = app
+        self.profile_requests = profile_requests
+        self.profile_dir = profile_dir
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        profile_path = None
+        if self.profile_requests and dict(scope['headers']).get(b'x-profile') == b'1':
+            os.makedirs(self.profile_dir, exist_ok=True)
+            name = f"{time.strftime('%Y%m%d_%H%M%S')}_{secrets.token_hex(4)}.prof"
+            profile_path = os.path.join(self.profile_dir, name)
+            token = _profiles.set([])
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+                if profile_path is not None:
+                    message = {**message, 'headers': [*message.get('headers', []),
+                                                      (b'x-profile-path', profile_path.encode())]}
+            await send(message)
+
+        REQUESTS_IN_FLIGHT.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            REQUESTS_IN_FLIGHT.dec()
+            route = getattr(scope.get('route'), 'path', 'unmatched')
+            REQUEST_SECONDS.observe(time.perf_counter() - start, method=scope['method'], route=route,
+                                    status=str(status))
+            if profile_path is not None:
+                profiles = _profiles.get()
+                _profiles.reset(token)
+                self._dump(profiles, profile_path)
+
+    def _dump(self, profiles, path):
+        if not profiles:
+            # Nothing reached the worker pools; still leave a file so the header is not dangling
+            empty = cProfile.Profile()
+            empty.runcall(int)
+            profiles = [empty]
+        stats = pstats.Stats(profiles[0])
+        for profile in profiles[1:]:
+            stats.add(profile)
+        stats.dump_stats(path)
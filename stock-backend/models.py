@@ -1,6 +1,7 @@
 from pydantic import BaseModel, Field
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Literal
 from datetime import date
+from config import MAX_CORRELATION_LAG, MAX_ROLLING_WINDOW, MATRIX_MAX_CELLS, JOIN_MAX_DATASETS
 
 class StockAnalysisRequest(BaseModel):
     stock_symbol: str
@@ -8,12 +9,72 @@ class StockAnalysisRequest(BaseModel):
     end_date: date
     methods: List[str] = Field(default=['pearson', 'spearman'])
     min_correlation: float = Field(default=0.1, ge=0.0, le=1.0)
+    # How custom dates meet trading days: the same day, or as of the nearest trading day in a direction
+    alignment: Literal['exact', 'backward', 'forward', 'nearest'] = 'exact'
+    tolerance_days: Optional[int] = Field(default=None, ge=0)
+    # Roll both series up to weekly or monthly periods first, custom columns by aggregation
+    frequency: Optional[Literal['weekly', 'monthly']] = None
+    aggregation: Literal['mean', 'median', 'sum', 'last'] = 'mean'
+    # 'lagged' and 'rolling' are Pearson only; lags and windows count merged rows (trading days)
+    mode: Literal['standard', 'lagged', 'rolling'] = 'standard'
+    min_lag: int = Field(default=-20, ge=-MAX_CORRELATION_LAG, le=MAX_CORRELATION_LAG)
+    max_lag: int = Field(default=20, ge=-MAX_CORRELATION_LAG, le=MAX_CORRELATION_LAG)
+    window: int = Field(default=60, ge=3, le=MAX_ROLLING_WINDOW)
+    step: int = Field(default=1, ge=1)
+    # Standard mode: block-resampled p-values with Benjamini-Hochberg FDR control instead of closed-form ones
+    significance: Literal['analytic', 'permutation', 'bootstrap'] = 'analytic'
+    resamples: int = Field(default=1000, ge=100, le=100_000)
+    block_size: Optional[int] = Field(default=None, ge=1)
+    seed: int = Field(default=0, ge=0)
+
+class BatchStockAnalysisRequest(BaseModel):
+    stock_symbols: List[str] = Field(min_length=1, max_length=500)
+    start_date: date
+    end_date: date
+    methods: List[str] = Field(default=['pearson', 'spearman'])
+    min_correlation: float = Field(default=0.1, ge=0.0, le=1.0)
+    alignment: Literal['exact', 'backward', 'forward', 'nearest'] = 'exact'
+    tolerance_days: Optional[int] = Field(default=None, ge=0)
 
 class VisualizationRequest(BaseModel):
     variables: List[str]
     chart_type: str
     x_var: Optional[str] = None
     y_var: Optional[str] = None
+    # Time series only: any of these switches to the windowed, shared-axis response
+    max_points: Optional[int] = Field(default=None, ge=10)
+    start_date: Optional[date] = None
+    end_date: Optional[date] = None
+    offset: int = Field(default=0, ge=0)
+    limit: Optional[int] = Field(default=None, ge=1)
+    downsample: Literal['minmax', 'lttb'] = 'minmax'
+
+class CorrelationMatrixRequest(BaseModel):
+    # Every numeric column of the source frame when omitted
+    variables: Optional[List[str]] = None
+    method: Literal['pearson', 'spearman', 'kendall'] = 'pearson'
+    # Cells with fewer shared rows are null
+    min_periods: int = Field(default=3, ge=3)
+    # Only the k strongest pairs, as a list of cells instead of a matrix
+    top_k: Optional[int] = Field(default=None, ge=1, le=MATRIX_MAX_CELLS)
+    order: Literal['original', 'clustered'] = 'original'
+
+class CrossDatasetRequest(BaseModel):
+    session_ids: List[str] = Field(min_length=1, max_length=JOIN_MAX_DATASETS)
+    # Column prefixes, one per session ('label:column'); the session ids by default
+    labels: Optional[List[str]] = None
+    # Aligned onto the sessions' dates like /stock-analysis/batch; the range defaults to theirs
+    stock_symbols: List[str] = Field(default=[], max_length=JOIN_MAX_DATASETS)
+    start_date: Optional[date] = None
+    end_date: Optional[date] = None
+    alignment: Literal['exact', 'backward', 'forward', 'nearest'] = 'exact'
+    tolerance_days: Optional[int] = Field(default=None, ge=0)
+    # 'inner' keeps the dates every session has, 'outer' any session's
+    join: Literal['inner', 'outer'] = 'inner'
+    methods: List[str] = Field(default=['pearson', 'spearman'])
+    min_correlation: float = Field(default=0.1, ge=0.0, le=1.0)
+    # Only pairs of columns from different datasets
+    cross_only: bool = True
 
 class ErrorResponse(BaseModel):
     detail: str
\ No newline at end of file
@@ -0,0 +1,27 @@
+"""Progress reporting from analysis code to whatever runs it, without depending on how it is run.
+
+A background job sets itself as the current tracker; anything else leaves
+it unset and the calls below do nothing. Pool threads see the tracker
+because run_analysis carries the caller's context into them.
+"""
+import contextvars
+
+current = contextvars.ContextVar('progress', default=None)
+
+
+class JobCancelled(Exception):
+    """Raised inside an analysis at its next progress report once its job is cancelled"""
+
+
+def expect(pairs):
+    """Add pairs to the current tracker's total; a no-op without one"""
+    tracker = current.get()
+    if tracker is not None:
+        tracker.expect(pairs)
+
+
+def advance(pairs):
+    """Count pairs as done, raising JobCancelled if the tracker's job has been cancelled meanwhile"""
+    tracker = current.get()
+    if tracker is not None:
+        tracker.advance(pairs)
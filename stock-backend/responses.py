@@ -0,0 +1,101 @@
+import orjson
+import numpy as np
+import pyarrow as pa
+from fastapi import Request
+from fastapi.responses import Response
+from metrics import span
+
+try:
+    import msgpack
+except ImportError:  # MessagePack is optional; such clients get JSON
+    msgpack = None
+
+JSON = 'application/json'
+MSGPACK = 'application/msgpack'
+ARROW = 'application/vnd.apache.arrow.stream'
+MSGPACK_ALIASES = (MSGPACK, 'application/x-msgpack')
+
+# NaN and inf become null, NumPy arrays and scalars are written without a
+# Python-level walk, so endpoints can hand back arrays as they are
+ORJSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+
+def _json_default(value):
+    # orjson writes only C-contiguous arrays natively, e.g. not a column sliced out of a matrix
+    if isinstance(value, np.ndarray):
+        return np.ascontiguousarray(value)
+    raise TypeError(f'Cannot serialize {type(value).__name__}')
+
+
+def dumps(content) -> bytes:
+    return orjson.dumps(content, default=_json_default, option=ORJSON_OPTIONS)
+
+
+def _msgpack_default(value):
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    raise TypeError(f'Cannot serialize {type(value).__name__}')
+
+
+def _arrow_table(content):
+    """Columnar form of the tabular payloads, or None for anything else"""
+    if not isinstance(content, dict):
+        return None
+    if isinstance(content.get('correlations'), list):
+        return pa.Table.from_pylist(content['correlations'])
+    data = content.get('data')
+    if content.get('type') == 'correlation_matrix' and 'cells' in data:
+        return pa.Table.from_pylist(data['cells'])
+    if content.get('type') == 'correlation_matrix':
+        columns = list(data['columns'])
+        values = np.asarray(data['values'], dtype=np.float64).reshape(len(columns), len(columns))
+        return pa.table({'variable': columns, **{col: values[:, i] for i, col in enumerate(columns)}})
+    if content.get('type') == 'time_series' and data:
+        x = content.get('x', data[0].get('x'))
+        return pa.table({'x': x, **{trace['name']: np.asarray(trace['y'], dtype=np.float64) for trace in data}})
+    return None
+
+
+def _accepted(request: Request):
+    """Media types from the Accept header, most preferred first"""
+    ranked = []
+    for position, part in enumerate(request.headers.get('accept', '').split(',')):
+        media_type, *params = [piece.strip() for piece in part.split(';')]
+        quality = 1.0
+        for param in params:
+            if param.startswith('q='):
+                try:
+                    quality = float(param[2:])
+                except ValueError:
+                    quality = 0.0
+        if media_type and quality > 0:
+            ranked.append((-quality, position, media_type.lower()))
+    return [media_type for _, _, media_type in sorted(ranked)]
+
+
+@span('response.encode')
+def negotiated_response(request: Request, content, status_code=200) -> Response:
+    """Encode content as the first of Arrow IPC, MessagePack or JSON that the client accepts.
+
+    Arrow is only offered for tabular payloads (correlation lists, matrices
+    and time series); JSON is the fallback for everything else.
+    """
+    for media_type in _accepted(request):
+        if media_type == ARROW:
+            table = _arrow_table(content)
+            if table is None:
+                continue
+            sink = pa.BufferOutputStream()
+            with pa.ipc.new_stream(sink, table.schema) as writer:
+                writer.write_table(table)
+            return Response(sink.getvalue().to_pybytes(), status_code=status_code, media_type=ARROW)
+        if media_type in MSGPACK_ALIASES and msgpack is not None:
+            return Response(msgpack.packb(content, default=_msgpack_default), status_code=status_code,
+                            media_type=MSGPACK)
+        if media_type in (JSON, 'application/*', '*/*'):
+            break
+    return Response(dumps(content), status_code=status_code, media_type=JSON)
@@ -0,0 +1,70 @@
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from config import RESULT_CACHE_MAX_ENTRIES, RESULT_CACHE_MAX_MB
+
+
+class ResultCache:
+    """LRU cache of endpoint results, bounded by entry count and by the bytes of frames kept in them.
+
+    Keys should include the content hash of every session frame the result
+    was computed from, so a result can never outlive its data; invalidate()
+    frees entries early once update_session has replaced one of those frames.
+    """
+
+    def __init__(self, max_entries=RESULT_CACHE_MAX_ENTRIES, max_mb=RESULT_CACHE_MAX_MB):
+        self.max_entries = max_entries
+        self.max_bytes = max_mb * 1024 * 1024
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Cached value for key, or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry['expires'] is not None and datetime.now() > entry['expires']:
+                self._drop(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry['value']
+
+    def put(self, key, value, session_id, depends_on, nbytes=0, ttl_minutes=None):
+        """Store value; depends_on names the session frames it was computed from"""
+        if nbytes > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = {
+                'value': value,
+                'session_id': session_id,
+                'depends_on': set(depends_on),
+                'nbytes': nbytes,
+                'expires': datetime.now() + timedelta(minutes=ttl_minutes) if ttl_minutes is not None else None
+            }
+            self._bytes += nbytes
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+
+    def invalidate(self, session_id, keys=None):
+        """Drop a session's entries that depend on any of keys (all of them when keys is None)"""
+        with self._lock:
+            stale = [key for key, entry in self._entries.items()
+                     if entry['session_id'] == session_id
+                     and (keys is None or entry['depends_on'].intersection(keys))]
+            for key in stale:
+                self._drop(key)
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'entries': len(self._entries), 'bytes': self._bytes}
+
+    def _drop(self, key):
+        self._bytes -= self._entries.pop(key)['nbytes']
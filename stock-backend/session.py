@@ -1,40 +1,414 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
 from datetime import datetime, timedelta
 from typing import Dict, Any
-from config import  SESSION_TIMEOUT_HOURS
+import pandas as pd
+import pyarrow.feather as feather
+try:
+    import fcntl
+except ImportError:  # Windows: sessions are still safe within one process
+    fcntl = None
+from metrics import span
+from config import SESSION_TIMEOUT_HOURS, SESSION_MEMORY_BUDGET_MB, SESSION_DIR
+
+
+def _frame_bytes(value) -> int:
+    usage = value.memory_usage(deep=True)
+    return int(usage.sum()) if isinstance(usage, pd.Series) else int(usage)
+
+
+@span('session.hash')
+def content_hash(value) -> str:
+    """Digest of a frame's columns, dtypes and values (not its index), for keying cached results"""
+    frame = value.to_frame() if isinstance(value, pd.Series) else value
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(repr([(str(col), str(dtype)) for col, dtype in frame.dtypes.items()]).encode())
+    digest.update(pd.util.hash_pandas_object(frame, index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
 
 class SessionManager:
-    def __init__(self):
-        self.sessions: Dict[str, Dict[str, Any]] = {}
+    """Session store with a global memory budget for session frames.
 
+    Every DataFrame or Series in a session is written through to an
+    uncompressed Arrow file under ``session_dir``. Once the resident frames
+    exceed the budget, the least recently used sessions drop theirs and
+    reload them, memory-mapped, on their next access. Several worker
+    processes can share one ``session_dir``. Pass ``session_dir=None`` for a
+    memory-only store, which cannot spill and so ignores the budget.
+    """
+
+    def __init__(self, memory_budget_mb=SESSION_MEMORY_BUDGET_MB, session_dir=SESSION_DIR):
+        self.memory_budget = memory_budget_mb * 1024 * 1024
+        self.session_dir = session_dir
+        # session_id -> {'meta', 'frames' (None when spilled), 'kinds', 'sizes', 'version'}, LRU order
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+        # Per-session locks serialize writers of one session without blocking the others
+        self._session_locks = {}
+        self._listeners = []
+        # Session count for /health: set by each full listing, kept current by this worker's creates and deletes
+        self._count = None
+        if session_dir:
+            os.makedirs(session_dir, exist_ok=True)
+
+    @span('session.write')
     def create_session(self, session_id: str, data: Dict[str, Any]):
-        self.sessions[session_id] = {
-            **data,
-            "created_at": datetime.now(),
-            "last_accessed": datetime.now()
-        }
+        """Store a new session; an existing id is never overwritten, even one from another worker"""
+        if not self._valid_id(session_id):
+            raise ValueError(f"Invalid session id: {session_id!r}")
+        meta, frames = self._split(data)
+        meta['created_at'] = meta['last_accessed'] = datetime.now()
+        meta['content_hashes'] = {key: content_hash(value) for key, value in frames.items()}
+        entry = {'meta': meta, 'frames': frames, 'kinds': {},
+                 'sizes': {key: _frame_bytes(value) for key, value in frames.items()}, 'version': None}
+        with self._locked(session_id):
+            with self._lock:
+                exists = session_id in self._entries
+            if not exists and self.session_dir:
+                try:
+                    # mkdir is atomic across processes, so it doubles as the claim on the id
+                    os.mkdir(self._path(session_id))
+                except FileExistsError:
+                    exists = True
+            if exists:
+                raise ValueError(f"Session already exists: {session_id!r}")
+            self._write(session_id, entry, frames)
+            with self._lock:
+                self._entries[session_id] = entry
+                self._entries.move_to_end(session_id)
+                self._evict(keep=session_id)
+                if self._count is not None:
+                    self._count += 1
 
+    @span('session.read')
     def get_session(self, session_id: str) -> Dict[str, Any]:
-        session = self.sessions.get(session_id)
-        if session:
-            session["last_accessed"] = datetime.now()
-        return session
+        """A snapshot of the session; change it through update_session"""
+        entry, frames = self._resident(session_id)
+        if entry is None:
+            return None
+        entry['meta']['last_accessed'] = datetime.now()
+        self._touch(session_id)
+        return {**entry['meta'], **frames}
+
+    @span('session.write')
+    def update_session(self, session_id: str, new_data: Dict[str, Any], if_unchanged: Dict[str, str] = None) -> bool:
+        """Merge new_data into the session; False if it is gone or the if_unchanged check failed.
 
-    def update_session(self, session_id: str, new_data: Dict[str, Any]):
-        session = self.get_session(session_id)
-        if session:
-            session.update(new_data)
+        Updates to one session are serialized, across workers too. Each builds
+        a new entry and swaps it in, so snapshots already handed out by
+        get_session never change underneath their readers. if_unchanged maps
+        frame keys to the content hashes new_data was derived from; if any
+        frame has changed since, nothing is written.
+        """
+        meta, frames = self._split(new_data)
+        hashes = {key: content_hash(value) for key, value in frames.items()}
+        with self._locked(session_id):
+            entry, current = self._resident(session_id)
+            if entry is None:
+                return False
+            if if_unchanged and any(entry['meta']['content_hashes'].get(key) != digest
+                                    for key, digest in if_unchanged.items()):
+                return False
+            changed = [key for key, digest in hashes.items() if entry['meta']['content_hashes'].get(key) != digest]
+            updated = {
+                'meta': {**entry['meta'], **meta, 'last_accessed': datetime.now(),
+                         'content_hashes': {**entry['meta']['content_hashes'], **hashes}},
+                'frames': {**current, **frames},
+                'kinds': dict(entry['kinds']),
+                'sizes': {**entry['sizes'], **{key: _frame_bytes(value) for key, value in frames.items()}},
+                'version': entry['version']
+            }
+            # Frames whose content did not change are already on disk
+            self._write(session_id, updated, {key: frames[key] for key in changed})
+            with self._lock:
+                if session_id in self._entries:
+                    self._entries[session_id] = updated
+                    self._entries.move_to_end(session_id)
+                self._evict(keep=session_id)
+        if changed:
+            self._notify(session_id, changed)
+        return True
 
     def delete_session(self, session_id: str) -> bool:
-        if session_id in self.sessions:
-            del self.sessions[session_id]
-            return True
-        return False
-
-    def cleanup_sessions(self):
-        now = datetime.now()
-        expired = [
-            sid for sid, s in self.sessions.items()
-            if now - s["last_accessed"] > timedelta(hours=SESSION_TIMEOUT_HOURS)
-        ]
+        if not self._valid_id(session_id):
+            return False
+        with self._locked(session_id):
+            with self._lock:
+                found = self._entries.pop(session_id, None) is not None
+            if self.session_dir:
+                path = self._path(session_id)
+                found = found or os.path.exists(path)
+                shutil.rmtree(path, ignore_errors=True)
+        with self._lock:
+            self._session_locks.pop(session_id, None)
+            if found and self._count:
+                self._count -= 1
+        if found:
+            self._notify(session_id, None)
+        if self.session_dir:
+            try:
+                os.remove(self._lock_path(session_id))
+            except FileNotFoundError:
+                pass
+        return found
+
+    def cleanup_sessions(self) -> int:
+        """Delete sessions idle for longer than SESSION_TIMEOUT_HOURS; returns how many went"""
+        cutoff = datetime.now() - timedelta(hours=SESSION_TIMEOUT_HOURS)
+        expired = [sid for sid, meta in self.list_sessions().items() if meta['last_accessed'] < cutoff]
         for sid in expired:
-            self.delete_session(sid)
\ No newline at end of file
+            self.delete_session(sid)
+        return len(expired)
+
+    def list_sessions(self) -> Dict[str, Dict[str, Any]]:
+        """Metadata of every session, including ones created by other workers, without loading frames"""
+        with self._lock:
+            known = {sid: dict(entry['meta']) for sid, entry in self._entries.items()}
+        if not self.session_dir:
+            self._count = len(known)
+            return known
+        # The directory is the source of truth; another worker may have added or deleted sessions
+        sessions = {}
+        for sid in self._disk_ids():
+            meta = known.get(sid)
+            if meta is None:
+                entry = self._read_meta(sid)
+                if entry is None:
+                    continue
+                meta = entry['meta']
+            meta['last_accessed'] = max(meta['last_accessed'], self._accessed_at(sid))
+            sessions[sid] = meta
+        self._count = len(sessions)
+        return sessions
+
+    def save_job(self, session_id: str, job_id: str, payload: bytes) -> bool:
+        """Write a finished job's serialized record into the session's directory.
+
+        False when the store is memory-only or the session no longer exists;
+        deleting the session deletes its jobs with it.
+        """
+        if not (self.session_dir and self._valid_id(session_id) and self._valid_id(job_id)):
+            return False
+        with self._locked(session_id):
+            if self._disk_version(session_id) is None:
+                return False
+            path = os.path.join(self._path(session_id), 'jobs')
+            os.makedirs(path, exist_ok=True)
+            target = os.path.join(path, f'{job_id}.json')
+            suffix = f'.{os.getpid()}.{threading.get_ident()}.tmp'
+            with open(target + suffix, 'wb') as f:
+                f.write(payload)
+            os.replace(target + suffix, target)
+        return True
+
+    def load_job(self, session_id: str, job_id: str):
+        """A record written by save_job, or None"""
+        if not (self.session_dir and self._valid_id(session_id) and self._valid_id(job_id)):
+            return None
+        try:
+            with open(os.path.join(self._path(session_id), 'jobs', f'{job_id}.json'), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def list_jobs(self, session_id: str):
+        """Ids of the session's saved jobs"""
+        if not (self.session_dir and self._valid_id(session_id)):
+            return []
+        try:
+            names = os.listdir(os.path.join(self._path(session_id), 'jobs'))
+        except FileNotFoundError:
+            return []
+        return [name[:-len('.json')] for name in names if name.endswith('.json')]
+
+    def memory_usage(self) -> Dict[str, Any]:
+        """Byte accounting for /health: resident total against the budget, and per session"""
+        with self._lock:
+            per_session = [{
+                'session_id': sid,
+                'bytes': sum(entry['sizes'].values()),
+                'resident': entry['frames'] is not None
+            } for sid, entry in self._entries.items()]
+        return {
+            'budget_bytes': self.memory_budget if self.session_dir else None,
+            'resident_bytes': sum(s['bytes'] for s in per_session if s['resident']),
+            'sessions': per_session
+        }
+
+    def on_change(self, listener):
+        """Call listener(session_id, keys) when frames change; keys is None when the session is deleted.
+
+        Only changes made through this manager are reported, not ones from other workers.
+        """
+        self._listeners.append(listener)
+
+    def _notify(self, session_id, keys):
+        for listener in self._listeners:
+            listener(session_id, keys)
+
+    def __len__(self):
+        """Sessions as of the last listing plus this worker's changes since; other workers' show up at the next one"""
+        if self._count is None:
+            # Counting directories reads no metadata
+            self._count = len(self._disk_ids()) if self.session_dir else len(self._entries)
+        return self._count
+
+    def _valid_id(self, session_id):
+        # Session ids come from URLs and name directories, so keep them to plain names
+        return re.fullmatch(r'[A-Za-z0-9_-]+', session_id) is not None
+
+    def _split(self, data):
+        meta = {key: value for key, value in data.items() if not isinstance(value, (pd.DataFrame, pd.Series))}
+        frames = {key: value for key, value in data.items() if isinstance(value, (pd.DataFrame, pd.Series))}
+        return meta, frames
+
+    def _resident(self, session_id):
+        """(entry, frames) with the frames loaded, refreshed if another worker changed it on disk"""
+        if not self._valid_id(session_id):
+            return None, None
+        with self._lock:
+            entry = self._entries.get(session_id)
+        version = self._disk_version(session_id)
+        if self.session_dir and version is None:
+            # Deleted, possibly by another worker
+            if entry is not None:
+                with self._lock:
+                    self._entries.pop(session_id, None)
+            return None, None
+        if entry is None or entry['version'] != version:
+            entry = self._read_meta(session_id)
+            if entry is None:
+                return None, None
+        # Hold our own reference: eviction may clear entry['frames'] at any time
+        frames = entry['frames']
+        if frames is None:
+            frames = entry['frames'] = self._read_frames(session_id, entry)
+        with self._lock:
+            self._entries[session_id] = entry
+            self._entries.move_to_end(session_id)
+            self._evict(keep=session_id)
+        return entry, frames
+
+    def _evict(self, keep=None):
+        # Spilled frames are already on disk, so evicting just drops the references
+        if not self.session_dir:
+            return
+        resident = sum(sum(e['sizes'].values()) for e in self._entries.values() if e['frames'] is not None)
+        for sid, entry in self._entries.items():
+            if resident <= self.memory_budget:
+                break
+            if sid == keep or entry['frames'] is None:
+                continue
+            entry['frames'] = None
+            resident -= sum(entry['sizes'].values())
+
+    def _path(self, session_id):
+        return os.path.join(self.session_dir, session_id)
+
+    def _lock_path(self, session_id):
+        return os.path.join(self.session_dir, f'.{session_id}.lock')
+
+    @contextmanager
+    def _locked(self, session_id):
+        """Per-session lock, held across threads here and, through flock, across workers"""
+        with self._lock:
+            lock = self._session_locks.setdefault(session_id, threading.Lock())
+        with lock:
+            if not (self.session_dir and fcntl):
+                yield
+                return
+            with open(self._lock_path(session_id), 'a') as handle:
+                fcntl.flock(handle, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(handle, fcntl.LOCK_UN)
+
+    def _disk_ids(self):
+        if not self.session_dir:
+            return []
+        return [name for name in os.listdir(self.session_dir)
+                if os.path.exists(os.path.join(self.session_dir, name, 'meta.json'))]
+
+    def _disk_version(self, session_id):
+        if not self.session_dir:
+            return None
+        try:
+            return os.stat(os.path.join(self._path(session_id), 'meta.json')).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _touch(self, session_id):
+        # Access times go to their own file so reads never rewrite the metadata
+        if not self.session_dir:
+            return
+        try:
+            with open(os.path.join(self._path(session_id), 'accessed'), 'a'):
+                pass
+            os.utime(os.path.join(self._path(session_id), 'accessed'))
+        except FileNotFoundError:
+            pass
+
+    def _accessed_at(self, session_id):
+        try:
+            return datetime.fromtimestamp(os.stat(os.path.join(self._path(session_id), 'accessed')).st_mtime)
+        except FileNotFoundError:
+            return datetime.min
+
+    def _write(self, session_id, entry, frames):
+        """Write the changed frames, then the metadata that makes them visible to other workers"""
+        if not self.session_dir:
+            return
+        path = self._path(session_id)
+        suffix = f'.{os.getpid()}.{threading.get_ident()}.tmp'
+        for key, value in frames.items():
+            if isinstance(value, pd.Series):
+                entry['kinds'][key] = {'kind': 'series', 'name': value.name}
+                value = value.to_frame(name='value')
+            else:
+                entry['kinds'][key] = {'kind': 'frame'}
+            target = os.path.join(path, f'{key}.arrow')
+            feather.write_feather(value, target + suffix, compression='uncompressed')
+            os.replace(target + suffix, target)
+        meta = {**entry['meta'],
+                'created_at': entry['meta']['created_at'].isoformat(),
+                'last_accessed': entry['meta']['last_accessed'].isoformat(),
+                '_frames': entry['kinds'],
+                '_sizes': entry['sizes']}
+        target = os.path.join(path, 'meta.json')
+        with open(target + suffix, 'w') as f:
+            json.dump(meta, f)
+        os.replace(target + suffix, target)
+        entry['version'] = os.stat(target).st_mtime_ns
+
+    def _read_meta(self, session_id):
+        if not self.session_dir:
+            return None
+        target = os.path.join(self._path(session_id), 'meta.json')
+        try:
+            version = os.stat(target).st_mtime_ns
+            with open(target) as f:
+                meta = json.load(f)
+        except FileNotFoundError:
+            return None
+        meta['created_at'] = datetime.fromisoformat(meta['created_at'])
+        meta['last_accessed'] = datetime.fromisoformat(meta['last_accessed'])
+        return {'meta': meta, 'frames': None, 'kinds': meta.pop('_frames'), 'sizes': meta.pop('_sizes'),
+                'version': version}
+
+    def _read_frames(self, session_id, entry):
+        frames = {}
+        for key, kind in entry['kinds'].items():
+            frame = feather.read_table(os.path.join(self._path(session_id), f'{key}.arrow'),
+                                       memory_map=True).to_pandas()
+            if kind['kind'] == 'series':
+                frame = frame['value'].rename(kind['name'])
+            frames[key] = frame
+        return frames
@@ -1,56 +1,456 @@
-import yfinance as yf
 import pandas as pd
 import numpy as np
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from dates import normalize_dates
+from result_cache import ResultCache
+from metrics import span, record_error
+from lazy import LazyModule
+from config import (STOCK_DATA_CACHE_MINUTES, STOCK_CACHE_MAX_SYMBOLS, STOCK_CACHE_DIR, STOCK_CACHE_MAX_DISK_MB,
+                    ALIGNMENT_CACHE_ENTRIES, ALIGNMENT_CACHE_MAX_MB)
+
+# Only the default price source needs it, on the first download
+yf = LazyModule('yfinance')
+
+STOCK_COLUMNS = ['Date', 'Open', 'High', 'Low', 'Close', 'Volume']
+# Calendar frequencies for align_and_merge: weeks end on Friday, months on their last day
+PERIOD_RULES = {'weekly': 'W-FRI', 'monthly': 'ME'}
+# How trading days roll up into a period; other columns keep their last value
+STOCK_AGGREGATION = {'Open': 'first', 'High': 'max', 'Low': 'min', 'Close': 'last', 'Volume': 'sum'}
+
+
+class YahooFinanceSource:
+    """Default price source. Anything with the same history() method can stand in for it."""
+
+    def history(self, symbol, start_date, end_date) -> pd.DataFrame:
+        return yf.Ticker(symbol).history(start=start_date, end=end_date)
+
+
+def _missing_ranges(start, end, covered):
+    """Parts of [start, end) not covered by the sorted, disjoint ranges in covered"""
+    missing = []
+    cursor = start
+    for lo, hi in covered:
+        if hi <= cursor:
+            continue
+        if lo >= end:
+            break
+        if lo > cursor:
+            missing.append((cursor, lo))
+        cursor = hi
+        if cursor >= end:
+            break
+    if cursor < end:
+        missing.append((cursor, end))
+    return missing
+
+
+def _merge_ranges(ranges):
+    merged = []
+    for lo, hi in sorted(ranges):
+        if merged and lo <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], hi))
+        else:
+            merged.append((lo, hi))
+    return merged
+
+
+def _trading_dates(data: pd.DataFrame) -> pd.Series:
+    return normalize_dates(data['Date'])
+
+
+class StockDataCache:
+    """Per-symbol price cache with an in-memory LRU tier and a Parquet tier on disk.
+
+    Each symbol keeps the union of the date ranges fetched so far, so a wider
+    request only fetches the edges it is missing. A symbol expires
+    ``ttl_minutes`` after its oldest fetch; pass ``cache_dir=None`` to keep
+    everything in memory. The disk tier drops expired symbols and then the
+    least recently written or loaded ones beyond ``max_disk_mb``.
+    """
+
+    def __init__(self, ttl_minutes=STOCK_DATA_CACHE_MINUTES, max_symbols=STOCK_CACHE_MAX_SYMBOLS,
+                 cache_dir=STOCK_CACHE_DIR, max_disk_mb=STOCK_CACHE_MAX_DISK_MB):
+        self.ttl = timedelta(minutes=ttl_minutes)
+        self.max_symbols = max_symbols
+        self.cache_dir = cache_dir
+        self.max_disk_bytes = max_disk_mb * 1024 * 1024
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # symbol -> (lock, holders and waiters); dropped once nobody uses it, as symbols come from clients
+        self._symbol_locks = {}
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def get(self, symbol, start_date, end_date, fetch) -> pd.DataFrame:
+        """Rows of symbol with start_date <= Date < end_date; fetch(symbol, start, end) fills the gaps.
+
+        Concurrent requests for one symbol take turns, so a range missing for
+        several of them is fetched once and the rest find it cached.
+        """
+        key = symbol.strip().upper()
+        with self._locked(key):
+            entry = self._load(key)
+            covered = entry['ranges'] if entry else []
+            missing = _missing_ranges(start_date, end_date, covered)
+            with self._lock:
+                if missing:
+                    self.misses += 1
+                else:
+                    self.hits += 1
+            if missing:
+                pieces = [entry['data']] if entry else []
+                pieces += [fetch(symbol, lo, hi) for lo, hi in missing]
+                pieces = [piece for piece in pieces if piece is not None and not piece.empty]
+                data = pd.concat(pieces, ignore_index=True) if pieces else pd.DataFrame(columns=STOCK_COLUMNS)
+                data = data.drop_duplicates(subset='Date').sort_values('Date').reset_index(drop=True)
+                entry = {
+                    'data': data,
+                    'ranges': _merge_ranges(covered + missing),
+                    'fetched_at': entry['fetched_at'] if entry else datetime.now()
+                }
+                self._store(key, entry)
+
+        data = entry['data']
+        if data.empty:
+            return data
+        dates = _trading_dates(data)
+        in_range = (dates >= pd.Timestamp(start_date)) & (dates < pd.Timestamp(end_date))
+        return data[in_range.to_numpy()].reset_index(drop=True)
+
+    def clear(self):
+        with self._lock:
+            for key in list(self._entries):
+                self._remove(key)
+            if self.cache_dir:
+                for name in os.listdir(self.cache_dir):
+                    if name.endswith(('.parquet', '.json')):
+                        os.remove(os.path.join(self.cache_dir, name))
+
+    @contextmanager
+    def _locked(self, key):
+        with self._lock:
+            lock, users = self._symbol_locks.get(key, (None, 0))
+            lock = lock or threading.Lock()
+            self._symbol_locks[key] = (lock, users + 1)
+        try:
+            with lock:
+                yield
+        finally:
+            with self._lock:
+                users = self._symbol_locks[key][1] - 1
+                if users:
+                    self._symbol_locks[key] = (lock, users)
+                else:
+                    del self._symbol_locks[key]
+
+    def _expired(self, entry) -> bool:
+        return datetime.now() - entry['fetched_at'] > self.ttl
+
+    def _load(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._read_disk(key)
+                if entry is None:
+                    return None
+                self._entries[key] = entry
+            if self._expired(entry):
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            self._evict()
+            return entry
+
+    def _store(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            self._evict()
+        self._write_disk(key, entry)
+
+    def _evict(self):
+        # Only the memory tier is bounded; evicted symbols can still be reloaded from disk
+        while len(self._entries) > self.max_symbols:
+            self._entries.popitem(last=False)
+
+    def _remove(self, key):
+        self._entries.pop(key, None)
+        if self.cache_dir:
+            for path in self._paths(key):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def _paths(self, key):
+        # Sanitizing alone maps e.g. BRK/B and BRK_B to one name; the digest of the raw symbol keeps them apart
+        digest = hashlib.blake2b(key.encode(), digest_size=8).hexdigest()
+        name = f"{re.sub(r'[^A-Z0-9._^-]', '_', key)}-{digest}"
+        return (os.path.join(self.cache_dir, f'{name}.parquet'),
+                os.path.join(self.cache_dir, f'{name}.json'))
+
+    def _read_disk(self, key):
+        if not self.cache_dir:
+            return None
+        data_path, meta_path = self._paths(key)
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+            if meta.get('symbol') != key:
+                return None
+            data = pd.read_parquet(data_path) if meta['rows'] else pd.DataFrame(columns=STOCK_COLUMNS)
+            # Loads count as use for the disk tier's LRU
+            os.utime(meta_path)
+        except FileNotFoundError:
+            return None
+        except Exception:
+            record_error('stock.cache', f"Stock cache read error for {key}")
+            return None
+        return {
+            'data': data,
+            'ranges': [(datetime.fromisoformat(lo).date(), datetime.fromisoformat(hi).date())
+                       for lo, hi in meta['ranges']],
+            'fetched_at': datetime.fromisoformat(meta['fetched_at'])
+        }
+
+    def _write_disk(self, key, entry):
+        if not self.cache_dir:
+            return
+        data_path, meta_path = self._paths(key)
+        meta = {
+            'symbol': key,
+            'rows': len(entry['data']),
+            'ranges': [(lo.isoformat(), hi.isoformat()) for lo, hi in entry['ranges']],
+            'fetched_at': entry['fetched_at'].isoformat()
+        }
+        try:
+            # Write to temporary files and rename so readers never see a partial file
+            suffix = f'.{os.getpid()}.{threading.get_ident()}.tmp'
+            if len(entry['data']):
+                entry['data'].to_parquet(data_path + suffix, index=False)
+                os.replace(data_path + suffix, data_path)
+            with open(meta_path + suffix, 'w') as f:
+                json.dump(meta, f)
+            os.replace(meta_path + suffix, meta_path)
+        except Exception:
+            record_error('stock.cache', f"Stock cache write error for {key}")
+        with self._lock:
+            self._prune_disk()
+
+    def _prune_disk(self):
+        """Delete expired symbols' files, then the least recently used ones until the tier fits max_disk_bytes"""
+        symbols = {}
+        try:
+            for item in os.scandir(self.cache_dir):
+                # Temporary files of writes in progress end in .tmp and are left alone
+                if item.name.endswith(('.parquet', '.json')):
+                    name, stat = item.name.rsplit('.', 1)[0], item.stat()
+                    size, used = symbols.get(name, (0, 0.0))
+                    symbols[name] = (size + stat.st_size, max(used, stat.st_mtime))
+        except OSError:
+            record_error('stock.cache', "Stock cache scan error")
+            return
+        # Files are written no earlier than their symbol's first fetch, so an old mtime means expired
+        cutoff = time.time() - self.ttl.total_seconds()
+        total = sum(size for size, _ in symbols.values())
+        for name, (size, used) in sorted(symbols.items(), key=lambda item: item[1][1]):
+            if used >= cutoff and total <= self.max_disk_bytes:
+                break
+            for suffix in ('.parquet', '.json'):
+                try:
+                    os.remove(os.path.join(self.cache_dir, name + suffix))
+                except FileNotFoundError:
+                    pass
+            total -= size
+
+
+NAT_NS = np.iinfo(np.int64).min
+
+
+def _as_ns(dates) -> np.ndarray:
+    # Naive datetimes as int64 nanoseconds; a view when they already are
+    return np.asarray(dates, dtype='datetime64[ns]').view(np.int64)
+
+
+def _aligned_positions(stock_ns: np.ndarray, custom_ns: np.ndarray, alignment='exact', tolerance_days=None):
+    """Stock row matched to every custom date, -1 where there is none.
+
+    stock_ns must be sorted; custom_ns may be in any order. 'exact' matches
+    the same calendar day, 'backward' the last trading day on or before the
+    date, 'forward' the first on or after it and 'nearest' whichever is
+    closer (the earlier on a tie), as pandas' merge_asof does, within
+    tolerance_days when given.
+    """
+    size = len(stock_ns)
+    if size == 0:
+        return np.full(len(custom_ns), -1, dtype=np.int64)
+    after = np.searchsorted(stock_ns, custom_ns, side='left')
+    if alignment == 'exact':
+        found = stock_ns[np.minimum(after, size - 1)] == custom_ns
+        return np.where(found, after, -1)
+    before = np.searchsorted(stock_ns, custom_ns, side='right') - 1
+    if alignment == 'backward':
+        positions = before
+    elif alignment == 'forward':
+        positions = np.where(after < size, after, -1)
+    else:
+        gap_before = custom_ns - stock_ns[np.maximum(before, 0)]
+        gap_after = stock_ns[np.minimum(after, size - 1)] - custom_ns
+        use_after = (before < 0) | ((after < size) & (gap_after < gap_before))
+        positions = np.where(use_after, np.where(after < size, after, -1), before)
+    if tolerance_days is not None:
+        gap = np.abs(stock_ns[np.maximum(positions, 0)] - custom_ns)
+        positions = np.where(gap <= tolerance_days * 86_400 * 10**9, positions, -1)
+    # NaT sorts first, so only 'exact' leaves it unmatched on its own
+    return np.where(custom_ns == NAT_NS, -1, positions)
+
 
 class StockAnalyzer:
+    def __init__(self, source=None, cache=None):
+        self.source = source or YahooFinanceSource()
+        self.cache = cache if cache is not None else StockDataCache()
+        # Custom row -> stock row positions, keyed by a session's date hash and the symbol's trading days
+        self.alignments = ResultCache(max_entries=ALIGNMENT_CACHE_ENTRIES, max_mb=ALIGNMENT_CACHE_MAX_MB)
+
+    @span('stock.fetch')
     def fetch_stock_data(self, symbol, start_date, end_date):
         try:
-            ticker = yf.Ticker(symbol)
-            data = ticker.history(start=start_date, end=end_date)
-            
+            data = self.cache.get(symbol, pd.Timestamp(start_date).date(), pd.Timestamp(end_date).date(),
+                                  self._download)
             if data.empty:
                 return None
-            
-            # Reset index to make Date a column
-            data = data.reset_index()
-            data['Date'] = pd.to_datetime(data['Date'], errors='coerce')
-            
-            # Select only the core stock variables
-            data = data[['Date', 'Open', 'High', 'Low', 'Close','Volume']]
-
-            # Clean up non-finite values (still important for core variables)
-            data.replace([np.inf, -np.inf], np.nan, inplace=True)
-            
             return data
-            
-        except Exception as e:
+
+        except Exception:
+            record_error('stock.fetch', f"Stock fetch error for {symbol}")
             return None
 
-    def align_and_merge(self, stock_data, custom_data, date_column):
+    @span('stock.download')
+    def _download(self, symbol, start_date, end_date):
+        data = self.source.history(symbol, start_date, end_date)
+
+        if data is None or data.empty:
+            return None
+
+        # Reset index to make Date a column
+        data = data.reset_index()
+        data['Date'] = pd.to_datetime(data['Date'], errors='coerce')
+
+        # Select only the core stock variables
+        data = data[STOCK_COLUMNS]
+
+        # Clean up non-finite values (still important for core variables)
+        data = data.replace([np.inf, -np.inf], np.nan)
+
+        return data
+
+    def _positions(self, stock_dates, custom_dates, alignment, tolerance_days, dates_key):
+        """_aligned_positions, memoized when the caller can name its dates (a session content hash)"""
+        stock_ns = _as_ns(stock_dates)
+        if dates_key is None:
+            return _aligned_positions(stock_ns, _as_ns(custom_dates), alignment, tolerance_days)
+        calendar = hashlib.blake2b(stock_ns.tobytes(), digest_size=16).hexdigest()
+        key = (dates_key, calendar, alignment, tolerance_days)
+        positions = self.alignments.get(key)
+        if positions is None:
+            positions = _aligned_positions(stock_ns, _as_ns(custom_dates), alignment, tolerance_days)
+            self.alignments.put(key, positions, None, (), nbytes=positions.nbytes)
+        return positions
+
+    def _trading_days(self, stock_data):
+        """Stock rows with a valid date, deduplicated by day, and their normalized dates"""
+        dates = normalize_dates(stock_data['Date'])
+        keep = (dates.notna() & ~dates.duplicated()).to_numpy()
+        if not keep.all():
+            stock_data, dates = stock_data[keep], dates[keep]
+        if not dates.is_monotonic_increasing:
+            order = np.argsort(dates.to_numpy(), kind='stable')
+            stock_data, dates = stock_data.iloc[order], dates.iloc[order]
+        return stock_data.reset_index(drop=True), dates.reset_index(drop=True)
+
+    @span('stock.align')
+    def align_to_dates(self, stock_data, dates: pd.Series, alignment='exact', tolerance_days=None,
+                       dates_key=None) -> pd.DataFrame:
+        """Stock values reindexed onto already normalized custom dates, NaN where there is no trading day.
+
+        Row i of the result belongs to row i of the custom frame, so correlating
+        it against the custom columns on pairwise-complete rows matches an inner
+        merge without building one.
+        """
+        columns = [col for col in STOCK_COLUMNS if col != 'Date']
+        stock_data, stock_dates = self._trading_days(stock_data)
+        values = stock_data[columns].to_numpy(dtype=np.float64, na_value=np.nan)
+        positions = self._positions(stock_dates, dates, alignment, tolerance_days, dates_key)
+        aligned = values[positions]
+        aligned[positions < 0] = np.nan
+        return pd.DataFrame(aligned, columns=columns)
+
+    @span('stock.merge')
+    def align_and_merge(self, stock_data, custom_data, date_column, dates=None, alignment='exact',
+                        tolerance_days=None, frequency=None, aggregation='mean', dates_key=None):
+        """Join stock and custom rows by date, in date order.
+
+        By default an inner join on calendar date. alignment 'backward',
+        'forward' or 'nearest' instead gives every custom row the as-of
+        trading day (see _aligned_positions), so weekend and holiday rows are
+        kept. frequency 'weekly' or 'monthly' rolls both sides up to the
+        trading calendar's periods first: OHLCV the usual way, custom columns
+        by aggregation. Pass the session's already normalized dates to skip
+        reparsing, and their content hash as dates_key to reuse the alignment
+        across requests. Rows come out of sorted arrays by position, with no
+        hash join.
+        """
         try:
-            # Prepare stock data
-            stock_data = stock_data.copy()
-            stock_data['date'] = pd.to_datetime(stock_data['Date'], errors='coerce')
-            if pd.api.types.is_datetime64tz_dtype(stock_data['date']):
-                stock_data['date'] = stock_data['date'].dt.tz_localize(None)
-            stock_data['date'] = stock_data['date'].dt.normalize()
-
-            # Prepare custom data
-            custom_data = custom_data.copy()
-            custom_data['date'] = pd.to_datetime(custom_data[date_column], errors='coerce')
-            if pd.api.types.is_datetime64tz_dtype(custom_data['date']):
-                custom_data['date'] = custom_data['date'].dt.tz_localize(None)
-            custom_data['date'] = custom_data['date'].dt.normalize()
-
-            # Remove rows with invalid dates
-            stock_data = stock_data.dropna(subset=['date'])
-            custom_data = custom_data.dropna(subset=['date'])
-
-            
-            # Merge on date
-            merged = pd.merge(stock_data, custom_data, on='date', how='inner')
-            
-            return merged
-            
-        except Exception as e:
-            return pd.DataFrame()  # Return empty DataFrame on error
\ No newline at end of file
+            stock_data, stock_dates = self._trading_days(stock_data)
+            dates = pd.Series(dates.to_numpy() if dates is not None else normalize_dates(custom_data[date_column]),
+                              name='date')
+            if frequency is not None:
+                return self._merge_periods(stock_data, stock_dates, custom_data, date_column, dates, frequency,
+                                           aggregation)
+
+            positions = self._positions(stock_dates, dates, alignment, tolerance_days, dates_key)
+            rows = np.flatnonzero(positions >= 0)
+            if not dates.is_monotonic_increasing:
+                # validate_csv sorts uploads by date, so this is only for other callers
+                rows = rows[np.argsort(dates.to_numpy()[rows], kind='stable')]
+            return self._assemble(stock_data.iloc[positions[rows]], dates.iloc[rows], custom_data.iloc[rows])
+
+        except Exception:
+            record_error('stock.merge', "Merge error")
+            return pd.DataFrame()  # Return empty DataFrame on error
+
+    def _merge_periods(self, stock_data, stock_dates, custom_data, date_column, dates, frequency, aggregation):
+        rule = PERIOD_RULES[frequency]
+        stock_frame = stock_data.set_axis(pd.DatetimeIndex(stock_dates))
+        stock_periods = stock_frame.resample(rule)
+        stock_frame = stock_periods.agg({col: STOCK_AGGREGATION.get(col, 'last') for col in stock_frame.columns})
+        stock_frame = stock_frame[stock_periods.size() > 0]
+
+        numeric = [col for col in custom_data.columns
+                   if col not in (date_column, 'date') and pd.api.types.is_numeric_dtype(custom_data[col])]
+        custom_periods = custom_data[numeric].set_axis(pd.DatetimeIndex(dates)).resample(rule)
+        custom_frame = custom_periods.agg(aggregation)
+        custom_frame = custom_frame[custom_periods.size() > 0]
+
+        labels = stock_frame.index.intersection(custom_frame.index)
+        return self._assemble(stock_frame.loc[labels], pd.Series(labels, name='date'), custom_frame.loc[labels])
+
+    @staticmethod
+    def _assemble(stock_rows, dates, custom_rows):
+        """Stock columns, 'date', then custom columns, named as pd.merge would name them"""
+        custom_rows = custom_rows.drop(columns='date', errors='ignore')
+        shared = stock_rows.columns.intersection(custom_rows.columns)
+        if len(shared):
+            stock_rows = stock_rows.rename(columns={col: f'{col}_x' for col in shared})
+            custom_rows = custom_rows.rename(columns={col: f'{col}_y' for col in shared})
+        stock_rows = stock_rows.reset_index(drop=True)
+        stock_rows['date'] = dates.to_numpy()
+        return pd.concat([stock_rows, custom_rows.reset_index(drop=True)], axis=1)
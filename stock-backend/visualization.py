@@ -1,26 +1,149 @@
+import numpy as np
 import pandas as pd
+from analysis import CorrelationAnalyzer
+from lazy import LazyModule
+from metrics import span
+
+hierarchy = LazyModule('scipy.cluster.hierarchy')
+
+
+def _minmax_indices(values: np.ndarray, buckets: int) -> np.ndarray:
+    """Positions of the min and max of each of ``buckets`` equal slices, NaN-aware, in one vectorized pass"""
+    size = -(-len(values) // buckets)
+    padded = np.full(buckets * size, np.nan)
+    padded[:len(values)] = values
+    padded = padded.reshape(buckets, size)
+    missing = np.isnan(padded)
+    filled = ~missing.all(axis=1)
+    offsets = np.arange(buckets)[filled] * size
+    lows = np.where(missing, np.inf, padded)[filled].argmin(axis=1)
+    highs = np.where(missing, -np.inf, padded)[filled].argmax(axis=1)
+    return np.unique(np.concatenate([offsets + lows, offsets + highs]))
+
+
+def _lttb_indices(values: np.ndarray, n_out: int) -> np.ndarray:
+    """Largest-Triangle-Three-Buckets over the non-NaN points, with row position as x.
+
+    Each bucket's triangle areas are computed vectorized; only the walk from
+    bucket to bucket, which depends on the previous pick, is a Python loop.
+    """
+    positions = np.flatnonzero(~np.isnan(values))
+    if len(positions) <= n_out or n_out < 3:
+        return positions
+    x = positions.astype(np.float64)
+    y = values[positions]
+    edges = np.linspace(1, len(x) - 1, n_out - 1).astype(np.int64)
+    # Next-bucket averages, precomputed for every bucket at once
+    sums_x = np.add.reduceat(x[1:-1], edges[:-1] - 1)
+    sums_y = np.add.reduceat(y[1:-1], edges[:-1] - 1)
+    counts = np.diff(edges)
+    avg_x = np.append(sums_x / counts, x[-1])
+    avg_y = np.append(sums_y / counts, y[-1])
+
+    picks = np.empty(n_out, dtype=np.int64)
+    picks[0], picks[-1] = 0, len(x) - 1
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        cx, cy = avg_x[i + 1], avg_y[i + 1]
+        area = np.abs((x[a] - cx) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (cy - y[a]))
+        a = lo + int(area.argmax())
+        picks[i + 1] = a
+    return positions[picks]
+
+
+def _cluster_order(corr: np.ndarray) -> np.ndarray:
+    """Leaf order of average-linkage clustering on 1 - |r|; pairs without a correlation count as unrelated"""
+    if len(corr) < 3:
+        return np.arange(len(corr))
+    distance = np.clip(1 - np.abs(np.nan_to_num(corr, nan=0.0)), 0.0, 1.0)
+    condensed = distance[np.triu_indices(len(corr), 1)]
+    return hierarchy.leaves_list(hierarchy.linkage(condensed, method='average'))
+
 
 class VisualizationEngine:
-    def create_correlation_matrix(self, data: pd.DataFrame):
-        # Replace NaN with 0 for JSON compatibility
-        corr_matrix = data.corr().fillna(0)
+    def __init__(self, analyzer=None):
+        self.analyzer = analyzer or CorrelationAnalyzer()
+
+    @span('visualization.matrix')
+    def create_correlation_matrix(self, data: pd.DataFrame, stats=None, method='pearson', min_periods=3, top_k=None,
+                                  order='original'):
+        """Pairwise-complete correlation matrix of data's columns, with the observation count of every cell.
+
+        Cells with fewer than min_periods shared rows or a constant column are
+        NaN (null in JSON), not 0. With stats (a PearsonAccumulator covering
+        the columns) Pearson is read off its sums without touching the rows;
+        otherwise it is computed in column tiles. top_k returns only the k
+        strongest pairs as a list of cells; order 'clustered' puts columns
+        that correlate with each other next to each other.
+        """
+        columns = data.columns.tolist()
+        if stats is not None and method == 'pearson':
+            values, n_obs, degenerate = stats.correlation(columns, columns)
+            n_obs = n_obs.astype(np.int64)
+            degenerate |= n_obs < 3
+            values[degenerate] = np.nan
+            np.fill_diagonal(values, np.where(np.diag(degenerate), np.nan, 1.0))
+        elif top_k is not None:
+            rows, cols, corr, counts = self.analyzer.top_correlations(data, columns, top_k, method, min_periods)
+            return self._matrix_cells(columns, method, top_k, rows, cols, corr, counts)
+        else:
+            values, n_obs = self.analyzer.correlation_matrix(data, columns, method)
+        values[n_obs < min_periods] = np.nan
+
+        if top_k is not None:
+            rows, cols = np.triu_indices(len(columns), 1)
+            keep = ~np.isnan(values[rows, cols])
+            rows, cols = rows[keep], cols[keep]
+            strongest = np.lexsort((cols, rows, -np.abs(values[rows, cols])))[:top_k]
+            rows, cols = rows[strongest], cols[strongest]
+            return self._matrix_cells(columns, method, top_k, rows, cols, values[rows, cols], n_obs[rows, cols])
+        if order == 'clustered':
+            positions = _cluster_order(values)
+            columns = [columns[i] for i in positions]
+            values = values[np.ix_(positions, positions)]
+            n_obs = n_obs[np.ix_(positions, positions)]
+        return {
+            'type': 'correlation_matrix',
+            'data': {
+                'columns': columns,
+                'method': method,
+                'order': order,
+                # orjson only writes C-contiguous arrays; NaN is written as null
+                'values': np.ascontiguousarray(values),
+                'n_observations': np.ascontiguousarray(n_obs)
+            }
+        }
+
+    @staticmethod
+    def _matrix_cells(columns, method, top_k, rows, cols, corr, n_obs):
         return {
             'type': 'correlation_matrix',
             'data': {
-                'columns': corr_matrix.columns.tolist(),
-                'values': corr_matrix.values.tolist()
+                'columns': columns,
+                'method': method,
+                'top_k': top_k,
+                'cells': [{
+                    'variable1': columns[i],
+                    'variable2': columns[j],
+                    'correlation': r,
+                    'n_observations': n
+                } for i, j, r, n in zip(rows.tolist(), cols.tolist(), corr.tolist(), n_obs.tolist())]
             }
         }
 
+    @span('visualization.time_series')
     def create_time_series_data(self, data: pd.DataFrame, date_column: str, variables):
         dates = pd.to_datetime(data[date_column], errors='coerce')
+        # Formatted once; every trace shares the same axis
+        x_values = dates.dt.strftime('%Y-%m-%d').tolist()
         traces = []
         for var in variables:
             if var in data.columns:
-                # Replace NaN with None for JSON compatibility
-                y_values = data[var].where(pd.notna(data[var]), None).tolist()
+                # Left as an array: the response encoder writes NaN as null
+                y_values = data[var].to_numpy(dtype=np.float64, na_value=np.nan)
                 traces.append({
-                    'x': dates.dt.strftime('%Y-%m-%d').tolist(),
+                    'x': x_values,
                     'y': y_values,
                     'name': var,
                     'type': 'scatter',
@@ -29,4 +152,64 @@ class VisualizationEngine:
         return {
             'type': 'time_series',
             'data': traces
-        }
\ No newline at end of file
+        }
+
+    @span('visualization.time_series_window')
+    def create_time_series_window(self, data: pd.DataFrame, date_column: str, variables, max_points=None,
+                                  start_date=None, end_date=None, offset=0, limit=None, downsample='minmax'):
+        """Time series for one date window, paginated by row and downsampled to about max_points.
+
+        All traces share one top-level x axis: the union of the points each
+        trace's downsampler keeps, so peaks of every variable survive.
+        """
+        dates = pd.to_datetime(data[date_column], errors='coerce')
+        in_window = dates.notna().to_numpy().copy()
+        if start_date is not None:
+            in_window &= (dates >= pd.Timestamp(start_date)).to_numpy()
+        if end_date is not None:
+            # Inclusive of the whole end day
+            in_window &= (dates < pd.Timestamp(end_date) + pd.Timedelta(days=1)).to_numpy()
+        rows = np.flatnonzero(in_window)
+        total = len(rows)
+        page = rows[offset:offset + limit] if limit is not None else rows[offset:]
+        variables = [var for var in variables if var in data.columns]
+        columns = [data[var].to_numpy(dtype=np.float64, na_value=np.nan)[page] for var in variables]
+
+        keep = np.arange(len(page))
+        if max_points is not None and len(page) > max_points and columns:
+            if downsample == 'lttb':
+                per_trace = [_lttb_indices(values, max(3, max_points // len(columns))) for values in columns]
+            else:
+                buckets = max(1, max_points // (2 * len(columns)))
+                per_trace = [_minmax_indices(values, buckets) for values in columns]
+            # The page's end points stay so the axis spans the whole window
+            keep = np.unique(np.concatenate(per_trace + [[0, len(page) - 1]]))
+
+        x = dates.to_numpy()[page[keep]]
+        has_time = (pd.DatetimeIndex(x) != pd.DatetimeIndex(x).normalize()).any()
+        x_values = pd.DatetimeIndex(x).strftime('%Y-%m-%dT%H:%M:%S' if has_time else '%Y-%m-%d').tolist()
+        traces = []
+        for var, values in zip(variables, columns):
+            y = values[keep]
+            traces.append({
+                'y': y,
+                'name': var,
+                'type': 'scatter',
+                'mode': 'lines+markers'
+            })
+        next_offset = offset + len(page)
+        return {
+            'type': 'time_series',
+            'x': x_values,
+            'data': traces,
+            'window': {
+                'start': x_values[0] if x_values else None,
+                'end': x_values[-1] if x_values else None,
+                'total_points': total,
+                'offset': offset,
+                'page_points': len(page),
+                'returned_points': len(keep),
+                'downsampled': len(keep) < len(page),
+                'next_offset': next_offset if next_offset < total else None
+            }
+        }
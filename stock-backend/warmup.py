@@ -0,0 +1,71 @@
+import time
+import numpy as np
+import pandas as pd
+from analysis import CorrelationAnalyzer, PearsonAccumulator
+from concurrency import process_pool
+from csv_utils import CSVValidator
+from lazy import import_deferred
+from metrics import span, logger
+from responses import dumps, _arrow_table, _msgpack_default, msgpack
+from session import content_hash
+from stock import StockAnalyzer, StockDataCache
+from visualization import VisualizationEngine
+from config import PROCESS_POOL_WORKERS
+
+WARM_UP_ROWS = 300
+
+
+@span('startup.warm_up')
+def warm_up():
+    """Import the deferred modules and run every hot path once on a small synthetic session.
+
+    First calls pay for more than imports: SciPy's and pandas' own lazy
+    submodules, date-format guessing, FFT plans, ufunc loops and forking the
+    process pool. Nothing is fetched; the prices are synthetic too.
+    """
+    started = time.perf_counter()
+    import_deferred()
+
+    rng = np.random.default_rng(0)
+    days = pd.bdate_range('2020-01-01', periods=WARM_UP_ROWS)
+    custom = pd.DataFrame(rng.normal(size=(WARM_UP_ROWS, 3)).cumsum(axis=0), columns=['a', 'b', 'c'])
+    custom.insert(0, 'date', days.strftime('%Y-%m-%d'))
+    close = 100 + rng.normal(size=WARM_UP_ROWS).cumsum()
+    prices = pd.DataFrame({'Date': days.tz_localize('America/New_York'), 'Open': close, 'High': close + 1,
+                           'Low': close - 1, 'Close': close, 'Volume': np.full(WARM_UP_ROWS, 1e6)})
+
+    parsed = CSVValidator().validate_csv(custom.to_csv(index=False).encode())
+    stock = StockAnalyzer(cache=StockDataCache(cache_dir=None))
+    stock.align_to_dates(prices, parsed['dates'], 'backward', 3)
+    stock.align_and_merge(prices, parsed['data'], parsed['date_column'], parsed['dates'], frequency='weekly')
+    merged = stock.align_and_merge(prices, parsed['data'], parsed['date_column'], parsed['dates'])
+    content_hash(merged)
+
+    left, right = ['Open', 'Close', 'Volume'], ['a', 'b', 'c']
+    analyzer = CorrelationAnalyzer()
+    analyzer.analyze_correlations(merged, left, ['pearson', 'spearman', 'kendall'], 0.0, right_columns=right)
+    analyzer.analyze_correlations(merged, left, ['pearson'], 0.0, right_columns=right,
+                                  significance='permutation', resamples=100)
+    analyzer.lagged_correlations(merged, left, right, range(-5, 6), 0.0)
+    analyzer.rolling_correlations(merged, left, right, 20, min_correlation=0.0)
+    stats = PearsonAccumulator.from_frame(PearsonAccumulator(left + right).add(merged).to_frame())
+
+    engine = VisualizationEngine()
+    matrix = engine.create_correlation_matrix(merged[left + right], stats)
+    engine.create_correlation_matrix(merged[left + right], method='spearman', order='clustered')
+    engine.create_correlation_matrix(merged[left + right], method='kendall', top_k=5)
+    series = engine.create_time_series_window(parsed['data'], parsed['date_column'], right, max_points=50,
+                                              downsample='lttb')
+    for content in (matrix, series):
+        dumps(content)
+        _arrow_table(content)
+        if msgpack is not None:
+            msgpack.packb(content, default=_msgpack_default)
+
+    if PROCESS_POOL_WORKERS > 1:
+        # Fork the Kendall and resampling workers now rather than inside the first large request
+        list(process_pool().map(abs, range(PROCESS_POOL_WORKERS)))
+
+    elapsed = time.perf_counter() - started
+    logger.info(f"Warm-up finished in {elapsed:.2f}s")
+    return elapsed
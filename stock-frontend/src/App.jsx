@@ -136,8 +136,8 @@ export default function App() {
       if (!mRes.ok) throw new Error(`Matrix visualization failed: ${mJson?.detail || mRes.statusText}`)
       setMatrixData(mJson)
 
-      // time series
-      const tsPayload = { chart_type: "time_series", variables: selectedVars }
+      // time series, downsampled server-side: a chart cannot show more points than it has pixels
+      const tsPayload = { chart_type: "time_series", variables: selectedVars, max_points: 2000 }
       const tsOptions = {
         method: "POST",
         headers: { "Content-Type": "application/json" },
@@ -1,4 +1,5 @@
 function cellBg(c) {
+  if (c === null) return "#e9ecef" // no correlation could be computed
   const alpha = Math.min(1, Math.max(0, Math.abs(c) * 0.8 + 0.2))
   return c > 0
     ? `rgba(13, 110, 253, ${alpha})` // blue-ish for positive
@@ -8,7 +9,7 @@ function cellBg(c) {
 export default function CorrelationMatrix({ vizData }) {
   if (!vizData?.data?.columns || !vizData?.data?.values) return null
 
-  const { columns, values } = vizData.data
+  const { columns, values, n_observations: counts } = vizData.data
 
   return (
     <div id="correlation-matrix-container" className="table-responsive">
@@ -39,11 +40,14 @@ export default function CorrelationMatrix({ vizData }) {
                   style={{
                     cursor: "pointer",
                     backgroundColor: cellBg(v),
-                    color: Math.abs(v) > 0.5 ? "white" : undefined,
+                    color: v !== null && Math.abs(v) > 0.5 ? "white" : undefined,
                   }}
-                  title={`Correlation: ${v.toFixed(3)}`}
+                  title={
+                    (v === null ? "Correlation: n/a" : `Correlation: ${v.toFixed(3)}`) +
+                    (counts ? ` (n = ${counts[i][j]})` : "")
+                  }
                 >
-                  {v.toFixed(2)}
+                  {v === null ? "–" : v.toFixed(2)}
                 </td>
               ))}
             </tr>
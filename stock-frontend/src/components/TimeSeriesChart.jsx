@@ -24,7 +24,8 @@ export default function TimeSeriesChart({ vizData }) {
 
     if (!vizData?.data?.length) return
 
-    const labels = vizData.data[0].x
+    // Windowed responses share one top-level axis; full ones repeat it per trace
+    const labels = vizData.x ?? vizData.data[0].x
     const datasets = vizData.data.map((trace, index) => ({
       label: trace.name,
       data: trace.y,